@@ -1,27 +1,80 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request, jsonify
 from dotenv import load_dotenv
 import os
-import vertexai
+import hmac
+import json
+import time
+import logging
+import threading
 
 # Load environment variables
 load_dotenv()
 
+# Bearer token that unlocks user identities on /usage (unset: nobody sees them)
+USAGE_ADMIN_TOKEN = os.getenv('USAGE_ADMIN_TOKEN', '')
+# IAP-authenticated emails, comma-separated, that see user identities on /usage
+USAGE_ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('USAGE_ADMIN_EMAILS', '').split(',') if email.strip()}
+# Audience of the app's Identity-Aware Proxy, e.g. /projects/NUMBER/global/backendServices/ID;
+# when set, users are identified by the signed X-Goog-IAP-JWT-Assertion header
+IAP_AUDIENCE = os.getenv('IAP_AUDIENCE', '')
+# Trust the unsigned X-Goog-Authenticated-User-Email header; only safe if nothing reaches the app except through IAP
+TRUST_IAP_HEADERS = os.getenv('TRUST_IAP_HEADERS', 'false').lower() == 'true'
+IAP_CERTS_URL = 'https://www.gstatic.com/iap/verify/public_key'
+IAP_ISSUER = 'https://cloud.google.com/iap'
+# IAP rotates its signing keys rarely; refetch them at most this often
+IAP_CERTS_TTL = 3600
+
+_iap_certs = {'keys': None, 'fetched_at': 0.0}
+_iap_certs_lock = threading.Lock()
+
+def fetch_iap_certs():
+    """IAP's public signing keys by key ID, cached for IAP_CERTS_TTL seconds."""
+    with _iap_certs_lock:
+        if _iap_certs['keys'] is None or time.monotonic() - _iap_certs['fetched_at'] > IAP_CERTS_TTL:
+            from google.auth.transport.requests import Request
+            response = Request()(IAP_CERTS_URL, method='GET')
+            _iap_certs['keys'] = json.loads(response.data)
+            _iap_certs['fetched_at'] = time.monotonic()
+        return _iap_certs['keys']
+
+def iap_user_email(req):
+    """The IAP-authenticated email of a request, or None if there is none that can be trusted."""
+    if IAP_AUDIENCE:
+        assertion = req.headers.get('X-Goog-IAP-JWT-Assertion')
+        if not assertion:
+            return None
+        from google.auth import jwt, exceptions as auth_exceptions
+        try:
+            claims = jwt.decode(assertion, certs=fetch_iap_certs(), audience=IAP_AUDIENCE)
+        except (ValueError, auth_exceptions.GoogleAuthError) as e:
+            logging.getLogger(__name__).warning(f"Rejected IAP assertion: {e}")
+            return None
+        if claims.get('iss') != IAP_ISSUER:
+            return None
+        return (claims.get('email') or '').lower() or None
+    if TRUST_IAP_HEADERS:
+        # IAP sends "accounts.google.com:<email>"
+        return req.headers.get('X-Goog-Authenticated-User-Email', '').split(':')[-1].lower() or None
+    return None
+
+def is_usage_admin(req):
+    """Whether a request may see the users behind the token usage."""
+    auth = req.headers.get('Authorization', '')
+    if USAGE_ADMIN_TOKEN and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:], USAGE_ADMIN_TOKEN):
+        return True
+    email = iap_user_email(req)
+    return bool(email) and email in USAGE_ADMIN_EMAILS
+
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__, template_folder='templates')
 
-    # Initialize Vertex AI
-    try:
-        project_id = os.getenv('GCP_PROJECT')
-        location = "us-central1"
-        if project_id:
-            vertexai.init(project=project_id, location=location)
-            app.config['VERTEXAI_INITIALIZED'] = True
-        else:
-            app.config['VERTEXAI_INITIALIZED'] = False
-            print("Warning: GCP_PROJECT not set. Some features may not work.")
-    except Exception as e:
+    # Vertex AI clients are created on first use by utils.utils_vertex; only the project is needed up front
+    if os.getenv('GCP_PROJECT'):
+        app.config['VERTEXAI_INITIALIZED'] = True
+    else:
         app.config['VERTEXAI_INITIALIZED'] = False
-        print(f"Warning: Could not initialize Vertex AI. {e}")
+        print("Warning: GCP_PROJECT not set. Some features may not work.")
 
 
     # Register blueprints
@@ -46,11 +99,41 @@ def create_app():
     from apps.repo_cache_analysis import repo_cache_analysis_bp
     app.register_blueprint(repo_cache_analysis_bp)
 
+    @app.before_request
+    def label_gemini_usage():
+        # Attribute token usage to the route and (IAP-authenticated or remote) user
+        from utils.utils_vertex import set_usage_labels
+        user = iap_user_email(request) or request.remote_addr
+        set_usage_labels(route=request.endpoint, user=user)
+
+    @app.route('/usage')
+    def usage():
+        # Only administrators see whose emails and IPs spent what; everyone else gets pseudonyms
+        from utils.utils_vertex import usage_tracker
+        return jsonify(usage_tracker.snapshot(identify_users=is_usage_admin(request)))
+
+    @app.route('/startup')
+    def startup():
+        from utils.utils_lazy import lazy_imports
+        return jsonify({**app.config['STARTUP'], 'lazy_imports': lazy_imports.report()})
+
     @app.route('/')
     def index():
         # This now renders the main layout, and JS handles the rest
         return render_template('layout.html')
 
+    # Heavy dependencies (genai, Magika, git, numpy) are imported on first use; keep them off this path
+    from utils.utils_lazy import lazy_imports, STARTUP_BUDGET_MS, WARM_UP
+    startup_ms = (time.perf_counter() - started) * 1000
+    app.config['STARTUP'] = {'create_app_ms': round(startup_ms, 1), 'budget_ms': STARTUP_BUDGET_MS}
+    if STARTUP_BUDGET_MS and startup_ms > STARTUP_BUDGET_MS:
+        logging.getLogger(__name__).warning(
+            f"create_app took {startup_ms:.0f} ms, over the {STARTUP_BUDGET_MS:.0f} ms budget; "
+            f"eagerly imported: {lazy_imports.report()['loaded']}"
+        )
+    if WARM_UP:
+        lazy_imports.start_warm_up()
+
     return app
 
 if __name__ == '__main__':
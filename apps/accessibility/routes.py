@@ -2,6 +2,7 @@ from flask import render_template, request, jsonify
 from . import accessibility_bp
 import os
 from utils.utils_vertex import sendPrompt
+from utils.utils_sse import wants_stream, stream_prompt
 
 # Load models from .env file
 model_gemini_flash = os.getenv("MODEL_GEMINI_FLASH", "gemini-1.5-flash-001")
@@ -62,6 +63,9 @@ def generate_wcag_analysis():
     Note: This is a simulated analysis. In production, this would analyze the actual video content from {video_uri}.
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model, meta={'video_uri': video_uri})
+
     response_content = sendPrompt(prompt, model)
     
     return jsonify({
@@ -95,6 +99,9 @@ def generate_user_stories():
     {wcag_analysis}
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_content = sendPrompt(prompt, model)
     
     return jsonify({
@@ -128,6 +135,9 @@ def generate_implementation():
     {user_stories}
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_content = sendPrompt(prompt, model)
     
     return jsonify({
@@ -163,6 +173,9 @@ def generate_test_plan():
     {implementation}
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_content = sendPrompt(prompt, model)
     
     return jsonify({
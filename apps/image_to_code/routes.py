@@ -3,6 +3,7 @@ from . import image_to_code_bp
 import os
 import base64
 from utils.utils_vertex import sendPrompt
+from utils.utils_sse import wants_stream, stream_prompt
 
 # Load models from .env file
 model_gemini_flash = os.getenv("MODEL_GEMINI_FLASH", "gemini-2.5-flash")
@@ -67,6 +68,9 @@ def generate_description():
     
     # For now, we'll simulate the image analysis since we don't have multimodal setup
     # In a real implementation, you would use Vertex AI's multimodal model
+    if wants_stream():
+        return stream_prompt(prompt + "\n\n[Note: This is a text-only simulation. In production, this would analyze the uploaded image.]", model, meta={'prompt': prompt})
+
     response_content = sendPrompt(prompt + "\n\n[Note: This is a text-only simulation. In production, this would analyze the uploaded image.]", model)
     
     return jsonify({'content': response_content, 'prompt': prompt})
@@ -91,6 +95,9 @@ def generate_backend():
     - Security considerations
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_backend = sendPrompt(prompt, model)
     return jsonify({'content': response_backend, 'prompt': prompt})
 
@@ -114,6 +121,9 @@ def generate_frontend():
     - Integration with backend API
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_frontend = sendPrompt(prompt, model)
     return jsonify({'content': response_frontend, 'prompt': prompt})
 
@@ -142,6 +152,9 @@ def generate_deployment():
     - Environment variables setup
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_deployment = sendPrompt(prompt, model)
     return jsonify({'content': response_deployment, 'prompt': prompt})
 
@@ -166,6 +179,9 @@ def generate_test_cases():
     - Security test cases
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_test_cases = sendPrompt(prompt, model)
     return jsonify({'content': response_test_cases, 'prompt': prompt})
 
@@ -190,6 +206,9 @@ def generate_test_script():
     - CI/CD integration
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_test_script = sendPrompt(prompt, model)
     return jsonify({'content': response_test_script, 'prompt': prompt})
 
@@ -215,6 +234,9 @@ def generate_selenium():
     - Parallel execution capabilities
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_selenium = sendPrompt(prompt, model)
     return jsonify({'content': response_selenium, 'prompt': prompt})
 
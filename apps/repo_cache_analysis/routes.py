@@ -1,61 +1,35 @@
 import os
-import shutil
-import git
-import magika
 import re
-import datetime
-import json
-from pathlib import Path
 from flask import render_template, request, jsonify, current_app
 
 # Use the centralized GeminiClient and standard types
-from utils.utils_vertex import GeminiClient
-from google.genai import types as genai_types
+from utils.utils_vertex import get_default_client, types as genai_types
+from utils.utils_repo import snapshot_store, ingest_repository, diff_snapshots
+from utils.utils_packing import (pack_files, pack_changes, get_delta_prompt, shard_files, TOKEN_BUDGET, SHARD_TOKEN_BUDGET,
+                                 MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+from utils.utils_map_reduce import map_reduce_analysis, MAP_CONCURRENCY, MAX_MAP_CONCURRENCY
+from utils.utils_retrieval import retrieve, get_retrieval_prompt, TOP_K, MAX_TOP_K
+from utils.utils_params import number_param, ParamError
+from utils.utils_jobs import job_queue, job_status_response, job_events_response, job_cancel_response
+from utils.utils_history import get_history_store, HISTORY_PAGE_SIZE
 
 from . import repo_cache_analysis_bp
 
 # Constants
-REPO_DIR = "./repo_cache"
-HISTORY_DIR = "./history"
-
-# Ensure history directory exists
-os.makedirs(HISTORY_DIR, exist_ok=True)
-
-# Initialize Magika
-m = magika.Magika()
+# Vertex AI rejects context caches smaller than this many tokens
+MIN_CACHE_TOKENS = int(os.getenv("REPO_CACHE_MIN_TOKENS", "4096"))
+# A cache is rebuilt on re-processing only if more than this share of the code changed since it was built
+CACHE_REBUILD_RATIO = float(os.getenv("REPO_CACHE_REBUILD_RATIO", "0.05"))
+# Range a requested cache lifetime is clamped to, in hours
+MIN_CACHE_TTL_HOURS = 0.1
+MAX_CACHE_TTL_HOURS = 168
+CODE_ANALYZER_INSTRUCTION = "You are an expert code analyzer and technical writer. The entire codebase is provided in the context."
 
 # --- Helper Functions ---
 
 def get_gemini_client():
-    """Initializes and returns a GeminiClient instance."""
-    return GeminiClient(project_id=os.getenv('GCP_PROJECT'))
-
-def clone_repo(repo_url, repo_dir):
-    if os.path.exists(repo_dir):
-        shutil.rmtree(repo_dir)
-    os.makedirs(repo_dir)
-    git.Repo.clone_from(repo_url, repo_dir)
-    return True
-
-def extract_code(repo_dir):
-    code_index = []
-    code_text = ""
-    for root, _, files in os.walk(repo_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, repo_dir)
-            code_index.append(relative_path)
-
-            try:
-                file_type = m.identify_path(Path(file_path))
-                if file_type.output.group in ("text", "code"):
-                    with open(file_path, "r", encoding='utf-8', errors='ignore') as f:
-                        code_text += f"----- File: {relative_path} -----\n"
-                        code_text += f.read()
-                        code_text += "\n-------------------------\n"
-            except Exception:
-                pass # Ignore files that can't be read
-    return code_index, code_text, len(code_text)
+    """Returns the shared GeminiClient instance."""
+    return get_default_client()
 
 def get_code_prompt(question, code_index, code_text):
     return f"""
@@ -77,22 +51,98 @@ def get_code_prompt(question, code_index, code_text):
     Response:
     """
 
+def get_codebase_contents(code_index, code_text):
+    """Builds the codebase context that is stored in the Vertex AI cache."""
+    context = f"""
+    Here is an index of all the files in the codebase:
+      \n\n{code_index}\n\n
+    The content of each file is concatenated below:
+      \n\n{code_text}\n\n
+    """
+    return [genai_types.Content(role="user", parts=[genai_types.Part(text=context)])]
+
+def get_cached_prompt(question, changes_text=None, since_commit=None):
+    """
+    Formats the prompt sent alongside a cached codebase. When the cache is
+    behind the current snapshot, the changes since the cached commit are
+    included so answers reflect the current code.
+    """
+    changes = ""
+    if changes_text:
+        changes = f"""
+    Changes since the cached codebase (commit {since_commit[:12]}), as unified diffs for modified files,
+    full text for added files and a note for deleted files; they take precedence over the cached code:
+      \n\n{changes_text}\n\n"""
+    return f"""
+    Task: {question}{changes}
+    Instructions:
+    1. Carefully analyze the codebase provided in the cached context.
+    2. Focus on addressing the specific task or question given.
+    3. Provide a comprehensive and well-structured response.
+    4. Use markdown formatting to enhance readability.
+    5. If relevant, include code snippets or examples from the codebase.
+    6. Ensure your analysis is accurate, insightful, and actionable.
+    Response:
+    """
+
+def create_repo_cache(client, repo_url, model_name, code_index, code_text, ttl_hours):
+    """
+    Creates a Vertex AI context cache for the codebase.
+
+    Returns (cache, token_count); cache is None when the codebase is below the
+    minimum cache size, in which case analysis falls back to inline context.
+    """
+    contents = get_codebase_contents(code_index, code_text)
+    token_count = client.count_tokens(contents, model=model_name).total_tokens
+    if token_count < MIN_CACHE_TOKENS:
+        return None, token_count
+
+    cache = client.create_cache(
+        contents=contents,
+        model=model_name,
+        ttl_seconds=int(ttl_hours * 3600),
+        display_name=re.sub(r'[^a-zA-Z0-9_-]', '_', repo_url)[-100:],
+        system_instruction=CODE_ANALYZER_INSTRUCTION
+    )
+    return cache, token_count
+
+def reuse_repo_cache(client, cache_name, cache_snapshot_id, snapshot):
+    """
+    Decides whether an existing cache can serve a new snapshot of the same repository.
+
+    Returns (cache, diff): cache is None when it must be rebuilt, because the
+    changes since its snapshot exceed CACHE_REBUILD_RATIO of the code or the
+    cache has expired; diff is None when the cache was built from this very
+    snapshot or its snapshot is gone.
+    """
+    with snapshot_store.use(cache_snapshot_id) as cached:
+        if cached is None:
+            return None, None
+        diff = diff_snapshots(cached, snapshot) if cached.snapshot_id != snapshot.snapshot_id else None
+    if diff is not None and diff.changed_bytes > CACHE_REBUILD_RATIO * max(1, snapshot.byte_size):
+        return None, diff
+    try:
+        return client.get_cache(cache_name), diff
+    except Exception as e:
+        current_app.logger.info(f"Cache {cache_name} cannot be reused: {e}")
+        return None, diff
+
+def serialize_cache(cache):
+    """Converts a CachedContent into the JSON shape the frontend expects."""
+    return {
+        'name': cache.name,
+        'displayName': cache.display_name,
+        'modelName': cache.model,
+        'createTime': cache.create_time.isoformat() if cache.create_time else None,
+        'expireTime': cache.expire_time.isoformat() if cache.expire_time else None,
+        'totalTokenCount': cache.usage_metadata.total_token_count if cache.usage_metadata else None
+    }
+
 def save_analysis(analysis_type, analysis_text, repo_url):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    sanitized_repo = re.sub(r'[^a-zA-Z0-9]', '_', repo_url)
-    filename = f"{timestamp}_{analysis_type}_{sanitized_repo[:50]}.json"
-    filepath = os.path.join(HISTORY_DIR, filename)
-    
     try:
-        with open(filepath, "w") as f:
-            json.dump({
-                "type": analysis_type,
-                "text": analysis_text,
-                "repo_url": repo_url,
-                "timestamp": timestamp
-            }, f)
+        get_history_store().add(analysis_type, analysis_text, repo_url)
     except Exception as e:
-        print(f"Error saving analysis: {e}")
+        current_app.logger.error(f"Error saving analysis: {e}", exc_info=True)
 
 # --- Routes ---
 
@@ -106,82 +156,294 @@ def process_repository():
     if not current_app.config.get('VERTEXAI_INITIALIZED'):
         return jsonify({'error': 'Vertex AI is not initialized. Please check server logs.'}), 500
 
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     repo_url = data.get('repo_url')
+    model_name = data.get('model_name') or os.getenv("MODEL_GEMINI_FLASH", "gemini-2.5-flash")
+    try:
+        cache_ttl = number_param(data, 'cache_ttl', 1, MIN_CACHE_TTL_HOURS, MAX_CACHE_TTL_HOURS, cast=float)
+        token_budget = number_param(data, 'token_budget', TOKEN_BUDGET, MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+    except ParamError as e:
+        return jsonify({'error': str(e)}), 400
+    # Optional path globs, as a list or comma-separated, to extract only part of the repository
+    include = data.get('include') or []
+    if isinstance(include, str):
+        include = include.split(',')
+    # The cache from the previous processing of this repository, kept if the code barely changed
+    cache_name = data.get('cache_name')
+    cache_model = data.get('cache_model') or ''
+    cache_snapshot_id = data.get('cache_snapshot_id')
     
     if not repo_url:
         return jsonify({'error': 'Repository URL is required'}), 400
 
-    try:
-        clone_repo(repo_url, REPO_DIR)
-        code_index, code_text, char_count = extract_code(REPO_DIR)
+    def run(job):
+        client = get_gemini_client()
+        with ingest_repository(repo_url, progress=job.update, include=include) as (snapshot, _):
+            job.update(stage="caching")
+            cache, delta, packed = None, None, None
+            if cache_name and cache_snapshot_id and cache_model.split('/')[-1] == model_name:
+                cache, delta = reuse_repo_cache(client, cache_name, cache_snapshot_id, snapshot)
+            if cache:
+                token_count = cache.usage_metadata.total_token_count if cache.usage_metadata else None
+                built_from = cache_snapshot_id
+            else:
+                packed = pack_files(snapshot.iter_files(), token_budget, snapshot.code_index)
+                cache, token_count = create_repo_cache(
+                    client, repo_url, model_name, packed.index, packed.text, cache_ttl
+                )
+                built_from = snapshot.snapshot_id
+        if cache and built_from != snapshot.snapshot_id:
+            message = (f"Repository re-indexed; kept the existing cache because only {delta.changed} file(s) "
+                       f"(~{delta.changed_bytes} bytes) changed since it was built. The changes are sent "
+                       f"alongside the cache.")
+        elif cache and packed is None:
+            message = "Repository unchanged since the existing cache was built; reusing it."
+        elif cache:
+            message = f"Repository cloned, indexed and cached! {token_count} tokens cached with {model_name}."
+        else:
+            message = (f"Repository cloned and indexed successfully! {token_count} tokens is below the "
+                       f"{MIN_CACHE_TOKENS}-token cache minimum, so the code will be sent inline.")
+        changes = snapshot.changes_summary()
+        if changes:
+            message += (f" Since commit {changes['base_commit'][:12]}: {changes['added']} added, "
+                        f"{changes['modified']} modified, {changes['deleted']} deleted.")
+        if snapshot.truncated:
+            message += f" Size budget reached: content of {snapshot.skipped_files} file(s) was left out."
+        if packed and packed.dropped_count:
+            message += (f" {packed.dropped_count} file(s) (~{packed.dropped_tokens} tokens) were left out"
+                        f" as lockfiles, vendored, generated, ignored or over the token budget.")
 
-        # Caching is removed. We just return the extracted code.
-        return jsonify({
-            'message': f"Repository cloned and indexed successfully! Character count: {char_count}",
-            'char_count': char_count,
-            'code_index': code_index,
-            'code_text': code_text  # Send the full code text to the client
-        })
-    except Exception as e:
-        current_app.logger.error(f"Error processing repository: {e}", exc_info=True)
-        return jsonify({'error': str(e)}), 500
+        return {
+            'message': message,
+            'token_count': token_count,
+            'packing': packed.report() if packed else None,
+            'cache': serialize_cache(cache) if cache else None,
+            'cache_snapshot_id': built_from if cache else None,
+            'cache_delta': delta.summary() if delta and cache else None,
+            **snapshot.summary()
+        }
+
+    job = job_queue.submit('process', run)
+    return jsonify({'job_id': job.job_id, 'state': job.state}), 202
+
+@repo_cache_analysis_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    return job_status_response(job_id)
+
+@repo_cache_analysis_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    return job_events_response(job_id)
+
+@repo_cache_analysis_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    return job_cancel_response(job_id)
 
 @repo_cache_analysis_bp.route('/analyze', methods=['POST'])
 def analyze_repository():
     if not current_app.config.get('VERTEXAI_INITIALIZED'):
         return jsonify({'error': 'Vertex AI is not initialized. Please check server logs.'}), 500
         
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     question = data.get('question')
     repo_url = data.get('repo_url')
     analysis_type = data.get('analysis_type')
-    code_index = data.get('code_index')
-    code_text = data.get('code_text') # Expect the full code text from the client
+    model_name = data.get('model_name')
+    cache_name = data.get('cache_name')
+    cache_model = data.get('cache_model') or ''
+    # The snapshot the cache was built from, when it is older than `snapshot_id`
+    cache_snapshot_id = data.get('cache_snapshot_id')
+    snapshot_id = data.get('snapshot_id')
+    # 'auto' uses the cache when it can, otherwise map-reduce only if packing drops files for the budget
+    mode = data.get('mode') or 'auto'
+    try:
+        token_budget = number_param(data, 'token_budget', TOKEN_BUDGET, MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+        shard_token_budget = number_param(data, 'shard_token_budget', SHARD_TOKEN_BUDGET,
+                                          MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+        concurrency = number_param(data, 'concurrency', MAP_CONCURRENCY, 1, MAX_MAP_CONCURRENCY)
+        top_k = number_param(data, 'top_k', TOP_K, 1, MAX_TOP_K)
+    except ParamError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if mode not in ('auto', 'single', 'map_reduce', 'retrieval', 'delta'):
+        return jsonify({'error': f"Unknown analysis mode '{mode}'"}), 400
+
+    # A cache can only be used with the model it was created for
+    use_cache = (bool(cache_name) and cache_model.split('/')[-1] == model_name
+                 and mode not in ('map_reduce', 'retrieval', 'delta'))
 
-    if not all([question, repo_url, analysis_type, code_index, code_text]):
+    if not all([question, repo_url, analysis_type]) or not (use_cache or snapshot_id):
         return jsonify({'error': 'Missing required parameters for analysis'}), 400
 
+    packed = None
+    plan = None
+    retrieved = None
+    diff = None
+    if use_cache and snapshot_id and cache_snapshot_id and cache_snapshot_id != snapshot_id:
+        # The cache was kept across a re-processing; send what changed since alongside it
+        with snapshot_store.use(snapshot_id) as snapshot, snapshot_store.use(cache_snapshot_id) as cached:
+            if snapshot is not None and cached is not None:
+                diff = diff_snapshots(cached, snapshot)
+                packed = pack_changes(diff, cached, snapshot, token_budget) if diff.changed else None
+    elif not use_cache:
+        with snapshot_store.use(snapshot_id) as snapshot:
+            if snapshot is None:
+                return jsonify({'error': 'Unknown snapshot; please process the repository again'}), 404
+            if mode == 'delta':
+                since_id = (data.get('since_snapshot_id') or cache_snapshot_id
+                            or (snapshot.changes or {}).get('base_snapshot_id'))
+                with snapshot_store.use(since_id) as since:
+                    if since is None or since.snapshot_id == snapshot.snapshot_id:
+                        return jsonify({'error': 'No earlier snapshot of this repository to compare with'}), 404
+                    diff = diff_snapshots(since, snapshot)
+                    packed = pack_changes(diff, since, snapshot, token_budget)
+                if not diff.changed:
+                    return jsonify({
+                        'analysis': f"No files changed between commits {diff.old_commit[:12]} and "
+                                    f"{diff.new_commit[:12]}.",
+                        'used_cache': False,
+                        'mode': 'delta',
+                        'changes': diff.summary()
+                    })
+            elif mode == 'retrieval':
+                try:
+                    retrieved = retrieve(snapshot, question, top_k)
+                except Exception as e:
+                    current_app.logger.error(f"Error retrieving from snapshot: {e}", exc_info=True)
+                    return jsonify({'error': str(e)}), 500
+            elif mode != 'map_reduce':
+                packed = pack_files(snapshot.iter_files(), token_budget, snapshot.code_index)
+            if mode == 'map_reduce' or (mode == 'auto' and packed.over_budget_count):
+                plan = shard_files(snapshot.iter_files(), shard_token_budget)
+
     try:
         client = get_gemini_client()
-        
-        # Construct the full prompt with the code text for each analysis
-        prompt = get_code_prompt(question, code_index, code_text)
+        generation_config = genai_types.GenerateContentConfig(
+            max_output_tokens=8192,
+            temperature=0.4,
+            top_p=1
+        )
+
+        if plan is not None:
+            result = map_reduce_analysis(client, question, plan, model_name, generation_config,
+                                         max_concurrency=concurrency, logger=current_app.logger)
+            save_analysis(analysis_type, result.answer, repo_url)
+            return jsonify({
+                'analysis': result.answer,
+                'used_cache': False,
+                'mode': 'map_reduce',
+                'packing': packed.report() if packed else None,
+                'sharding': plan.report(),
+                'map_reduce': result.report(),
+                'usage': {
+                    'prompt_tokens': result.usage.prompt_tokens,
+                    'cached_tokens': result.usage.cached_tokens,
+                    'completion_tokens': result.usage.completion_tokens
+                }
+            })
+
+        if use_cache:
+            # Only the question (and any changes since the cache) is sent; the codebase is read from the Vertex AI cache
+            prompt = get_cached_prompt(question, packed.text if packed else None, diff.old_commit if diff else None)
+            generation_config.cached_content = cache_name
+        elif mode == 'delta':
+            prompt = get_delta_prompt(question, diff.old_commit, diff.new_commit, packed.text)
+        elif retrieved is not None:
+            prompt = get_retrieval_prompt(question, retrieved.index, retrieved.text)
+        else:
+            prompt = get_code_prompt(question, packed.index, packed.text)
         contents = [genai_types.Content(role="user", parts=[genai_types.Part(text=prompt)])]
 
-        response_text = client.generate_content(
+        response_text, token_count = client.generate_content(
             contents=contents,
-            model=data.get('model_name'),
-            generation_config=genai_types.GenerateContentConfig(
-                max_output_tokens=8192,
-                temperature=0.4,
-                top_p=1
-            )
+            model=model_name,
+            generation_config=generation_config,
+            count_tokens=True
         )
         
         save_analysis(analysis_type, response_text, repo_url)
         
-        return jsonify({'analysis': response_text})
+        return jsonify({
+            'analysis': response_text,
+            'used_cache': use_cache,
+            'mode': 'delta' if mode == 'delta' else 'retrieval' if retrieved is not None else 'single',
+            'packing': packed.report() if packed else None,
+            'retrieval': retrieved.report() if retrieved else None,
+            'changes': diff.summary() if diff else None,
+            'usage': {
+                'prompt_tokens': token_count.prompt_tokens,
+                'cached_tokens': token_count.cached_tokens,
+                'completion_tokens': token_count.completion_tokens
+            }
+        })
     except Exception as e:
         current_app.logger.error(f"Error analyzing repository: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@repo_cache_analysis_bp.route('/changes', methods=['GET'])
+def changes():
+    """Summarizes what changed between two snapshots (by default, since the snapshot this one was built on)."""
+    snapshot_id = request.args.get('snapshot_id')
+    with snapshot_store.use(snapshot_id) as snapshot:
+        if snapshot is None:
+            return jsonify({'error': 'Unknown snapshot'}), 404
+        since_id = request.args.get('since') or (snapshot.changes or {}).get('base_snapshot_id')
+        with snapshot_store.use(since_id) as since:
+            if since is None:
+                return jsonify({'error': 'No earlier snapshot to compare with'}), 404
+            return jsonify(diff_snapshots(since, snapshot).summary(max_paths=500))
+
+@repo_cache_analysis_bp.route('/caches', methods=['GET'])
+def list_caches():
+    try:
+        caches = get_gemini_client().list_caches()
+        return jsonify([serialize_cache(cache) for cache in caches])
+    except Exception as e:
+        current_app.logger.error(f"Error listing caches: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@repo_cache_analysis_bp.route('/caches/<path:cache_name>', methods=['DELETE'])
+def delete_cache(cache_name):
+    try:
+        get_gemini_client().delete_cache(cache_name)
+        return jsonify({'message': f"Cache {cache_name.split('/')[-1]} deleted."})
+    except Exception as e:
+        current_app.logger.error(f"Error deleting cache: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@repo_cache_analysis_bp.route('/caches/<path:cache_name>/ttl', methods=['POST'])
+def extend_cache_ttl(cache_name):
+    data = request.get_json(silent=True) or {}
+    try:
+        ttl_hours = number_param(data, 'ttl_hours', 1, MIN_CACHE_TTL_HOURS, MAX_CACHE_TTL_HOURS, cast=float)
+    except ParamError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        cache = get_gemini_client().update_cache_ttl(cache_name, int(ttl_hours * 3600))
+        return jsonify({
+            'message': f"Cache {cache_name.split('/')[-1]} now expires in {ttl_hours:g} hour(s).",
+            'cache': serialize_cache(cache)
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error extending cache TTL: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @repo_cache_analysis_bp.route('/history', methods=['GET'])
 def get_history():
-    history = []
-    if not os.path.exists(HISTORY_DIR):
-        return jsonify([])
-
+    """
+    Returns a page of past analyses, newest first, optionally filtered by
+    `repo_url`, `type` and the words in `q`. Pass the page's `next_before`
+    as `before` to get the next one.
+    """
     try:
-        files = sorted(
-            [os.path.join(HISTORY_DIR, f) for f in os.listdir(HISTORY_DIR) if f.endswith(".json")],
-            key=os.path.getmtime,
-            reverse=True
+        page = get_history_store().query(
+            repo_url=request.args.get('repo_url'),
+            analysis_type=request.args.get('type'),
+            search=request.args.get('q'),
+            before=request.args.get('before', type=int),
+            limit=request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
         )
-        for filepath in files:
-            with open(filepath, "r") as f:
-                history.append(json.load(f))
     except Exception as e:
-        current_app.logger.error(f"Error loading history files: {e}", exc_info=True)
+        current_app.logger.error(f"Error loading history: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
 
-    return jsonify(history)
+    return jsonify(page.report())
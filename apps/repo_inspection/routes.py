@@ -1,17 +1,14 @@
 from flask import render_template, request, jsonify
 from . import repo_inspection_bp
 import os
-import shutil
-from pathlib import Path
-import git
-import magika
-from utils.utils_vertex import sendPrompt
-
-# Initialize Magika
-m = magika.Magika()
-
-# Constants
-REPO_DIR = "./repo_cache"
+from utils.utils_vertex import sendPrompt, get_default_client
+from utils.utils_repo import snapshot_store, ingest_repository, diff_snapshots
+from utils.utils_packing import (pack_files, pack_changes, get_delta_prompt, shard_files, TOKEN_BUDGET, SHARD_TOKEN_BUDGET,
+                                 MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+from utils.utils_map_reduce import map_reduce_analysis, MAP_CONCURRENCY, MAX_MAP_CONCURRENCY
+from utils.utils_retrieval import retrieve, get_retrieval_prompt, TOP_K, MAX_TOP_K
+from utils.utils_params import number_param, ParamError
+from utils.utils_jobs import job_queue, job_status_response, job_events_response, job_cancel_response
 
 @repo_inspection_bp.route('/')
 def repo_inspection_index():
@@ -28,60 +25,61 @@ def repo_inspection_index():
     models = [os.getenv("MODEL_GEMINI_FLASH", "gemini-1.5-flash-001"), os.getenv("MODEL_GEMINI_PRO", "gemini-1.5-pro-001")]
     return render_template('repo_inspection.html', models=models, analysis_options=analysis_options)
 
-def clone_repo(repo_url, repo_dir):
-    """Clones a Git repository, removing the old one if it exists."""
-    if os.path.exists(repo_dir):
-        shutil.rmtree(repo_dir)
-    os.makedirs(repo_dir)
-    git.Repo.clone_from(repo_url, repo_dir)
-    return True
-
-def extract_code(repo_dir):
-    """Extracts code files from a directory, creating an index and concatenated text."""
-    code_index = []
-    code_text = ""
-    for root, _, files in os.walk(repo_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, repo_dir)
-            
-            # Ignore .git directory and other non-essential files
-            if ".git" in file_path.split(os.sep):
-                continue
-
-            code_index.append(relative_path)
-            
-            try:
-                file_type = m.identify_path(Path(file_path))
-                if file_type.output.group in ("text", "code"):
-                    with open(file_path, "r", encoding='utf-8', errors='ignore') as f:
-                        code_text += f"----- File: {relative_path} -----\n"
-                        code_text += f.read()
-                        code_text += "\n-------------------------\n"
-            except Exception:
-                # Ignore files that can't be read
-                pass
-    return code_index, code_text
-
 @repo_inspection_bp.route('/clone_and_index', methods=['POST'])
 def clone_and_index():
-    """Clones and indexes a repository, returns the file index and content."""
+    """Queues a job that clones and indexes a repository into a server-side snapshot."""
     data = request.json
     repo_url = data.get('repo_url')
+    # Optional path globs, as a list or comma-separated, to extract only part of the repository
+    include = data.get('include') or []
+    if isinstance(include, str):
+        include = include.split(',')
     if not repo_url:
         return jsonify({'error': 'Repository URL is required'}), 400
-        
-    try:
-        clone_success = clone_repo(repo_url, REPO_DIR)
-        if clone_success:
-            code_index, code_text = extract_code(REPO_DIR)
-            return jsonify({
-                'message': 'Repository cloned and indexed successfully!',
-                'index': code_index,
-                'text': code_text
-            })
-    except Exception as e:
-        return jsonify({'error': f"Failed to clone or index repository: {str(e)}"}), 500
+
+    def run(job):
+        with ingest_repository(repo_url, progress=job.update, include=include) as (snapshot, reused):
+            if reused:
+                message = 'Repository already indexed at this commit; reusing snapshot.'
+            else:
+                message = 'Repository cloned and indexed successfully!'
+            if snapshot.changes and not reused:
+                changes = snapshot.changes_summary()
+                message += (f" Since commit {changes['base_commit'][:12]}: {changes['added']} added, "
+                            f"{changes['modified']} modified, {changes['deleted']} deleted; "
+                            f"{snapshot.reused_files} unchanged files reused.")
+            return {'message': message, **snapshot.summary()}
+
+    job = job_queue.submit('clone_and_index', run)
+    return jsonify({'job_id': job.job_id, 'state': job.state}), 202
+
+@repo_inspection_bp.route('/changes', methods=['GET'])
+def changes():
+    """Summarizes what changed between two snapshots (by default, since the snapshot this one was built on)."""
+    snapshot_id = request.args.get('snapshot_id')
+    with snapshot_store.use(snapshot_id) as snapshot:
+        if snapshot is None:
+            return jsonify({'error': 'Unknown snapshot'}), 404
+        since_id = request.args.get('since') or (snapshot.changes or {}).get('base_snapshot_id')
+        with snapshot_store.use(since_id) as since:
+            if since is None:
+                return jsonify({'error': 'No earlier snapshot to compare with'}), 404
+            return jsonify(diff_snapshots(since, snapshot).summary(max_paths=500))
+
+@repo_inspection_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Returns a clone-and-index job's state, progress and, once done, its result."""
+    return job_status_response(job_id)
+
+@repo_inspection_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Streams a clone-and-index job's progress as Server-Sent Events."""
+    return job_events_response(job_id)
+
+@repo_inspection_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancels a queued or running clone-and-index job."""
+    return job_cancel_response(job_id)
 
 def get_code_prompt(question, code_index, code_text):
     """Formats the prompt for the Gemini model."""
@@ -109,19 +107,103 @@ def get_code_prompt(question, code_index, code_text):
 
 @repo_inspection_bp.route('/generate_analysis', methods=['POST'])
 def generate_analysis():
-    """Generates code analysis using the Gemini model."""
-    data = request.json
+    """
+    Generates code analysis using the Gemini model.
+
+    `mode` is 'single' (one packed prompt), 'map_reduce' (question asked of
+    every shard, then the answers merged), 'retrieval' (only the `top_k`
+    chunks most relevant to the question), 'delta' (only the changes since
+    `since_snapshot_id`, by default the snapshot this one was built on) or
+    'auto' (the default: map-reduce only when packing had to drop files for
+    the token budget).
+    """
+    data = request.get_json(silent=True) or {}
     model_name = data.get('model_name')
     question = data.get('question')
-    code_index = data.get('code_index')
-    code_text = data.get('code_text')
+    snapshot_id = data.get('snapshot_id')
+    mode = data.get('mode') or 'auto'
+    try:
+        token_budget = number_param(data, 'token_budget', TOKEN_BUDGET, MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+        shard_token_budget = number_param(data, 'shard_token_budget', SHARD_TOKEN_BUDGET,
+                                          MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET)
+        concurrency = number_param(data, 'concurrency', MAP_CONCURRENCY, 1, MAX_MAP_CONCURRENCY)
+        top_k = number_param(data, 'top_k', TOP_K, 1, MAX_TOP_K)
+    except ParamError as e:
+        return jsonify({'error': str(e)}), 400
 
-    if not all([model_name, question, code_index, code_text]):
+    if not all([model_name, question, snapshot_id]):
         return jsonify({'error': 'Missing required data for analysis'}), 400
+    if mode not in ('auto', 'single', 'map_reduce', 'retrieval', 'delta'):
+        return jsonify({'error': f"Unknown analysis mode '{mode}'"}), 400
+
+    plan = None
+    with snapshot_store.use(snapshot_id) as snapshot:
+        if snapshot is None:
+            return jsonify({'error': 'Unknown snapshot; please clone and index the repository again'}), 404
+        if mode == 'delta':
+            since_id = data.get('since_snapshot_id') or (snapshot.changes or {}).get('base_snapshot_id')
+            with snapshot_store.use(since_id) as since:
+                if since is None:
+                    return jsonify({'error': 'No earlier snapshot of this repository to compare with'}), 404
+                diff = diff_snapshots(since, snapshot)
+                packed = pack_changes(diff, since, snapshot, token_budget)
+            if not diff.changed:
+                return jsonify({'content': f"No files changed between commits {diff.old_commit[:12]} and "
+                                           f"{diff.new_commit[:12]}.", 'prompt': '', 'mode': 'delta',
+                                'changes': diff.summary()})
+            prompt = get_delta_prompt(question, diff.old_commit, diff.new_commit, packed.text)
+            shown_prompt = get_delta_prompt(question, diff.old_commit, diff.new_commit,
+                                            f"[{diff.changed} changed files, ~{packed.tokens} tokens]")
+            try:
+                response = sendPrompt(prompt, model_name, hedge=False)
+            except Exception as e:
+                return jsonify({'error': f"Failed to generate analysis: {str(e)}"}), 500
+            return jsonify({'content': response, 'prompt': shown_prompt,
+                            'mode': 'delta', 'changes': diff.summary(), 'packing': packed.report()})
+        if mode == 'retrieval':
+            try:
+                retrieved = retrieve(snapshot, question, top_k)
+            except Exception as e:
+                return jsonify({'error': f"Failed to retrieve from snapshot: {str(e)}"}), 500
+            prompt = get_retrieval_prompt(question, retrieved.index, retrieved.text)
+            shown_prompt = get_retrieval_prompt(question, retrieved.index,
+                                                f"[{len(retrieved.chunks)} excerpts, ~{retrieved.tokens} tokens, "
+                                                f"from snapshot {snapshot_id}]")
+            try:
+                response = sendPrompt(prompt, model_name, hedge=False)
+            except Exception as e:
+                return jsonify({'error': f"Failed to generate analysis: {str(e)}"}), 500
+            return jsonify({'content': response, 'prompt': shown_prompt,
+                            'mode': 'retrieval', 'retrieval': retrieved.report()})
+        # Keep the prompt within the token budget, most relevant files first; map-reduce shards instead
+        packed = None
+        if mode != 'map_reduce':
+            packed = pack_files(snapshot.iter_files(), token_budget, snapshot.code_index)
+        if mode == 'map_reduce' or (mode == 'auto' and packed.over_budget_count):
+            plan = shard_files(snapshot.iter_files(), shard_token_budget)
+
+    if plan is not None:
+        try:
+            result = map_reduce_analysis(get_default_client(), question, plan, model_name,
+                                         max_concurrency=concurrency)
+            return jsonify({
+                'content': result.answer,
+                'prompt': f"Task: {question}\n\n[Map-reduce over {len(plan.shards)} shards of snapshot {snapshot_id}]",
+                'mode': 'map_reduce',
+                'sharding': plan.report(),
+                'map_reduce': result.report()
+            })
+        except Exception as e:
+            return jsonify({'error': f"Failed to generate analysis: {str(e)}"}), 500
 
     try:
-        prompt = get_code_prompt(question, code_index, code_text)
-        response = sendPrompt(prompt, model_name)
-        return jsonify({'content': response, 'prompt': prompt})
+        prompt = get_code_prompt(question, packed.index, packed.text)
+        # Whole-repo prompts are too expensive to hedge
+        response = sendPrompt(prompt, model_name, hedge=False)
+        # Echo the prompt without the code so the response stays small
+        shown_prompt = get_code_prompt(question, packed.index,
+                                       f"[~{packed.tokens} tokens from {len(packed.included)} files of snapshot "
+                                       f"{snapshot_id}; {packed.dropped_count} files dropped]")
+        return jsonify({'content': response, 'prompt': shown_prompt, 'mode': 'single', 'packing': packed.report()})
     except Exception as e:
         return jsonify({'error': f"Failed to generate analysis: {str(e)}"}), 500
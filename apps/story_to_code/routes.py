@@ -2,6 +2,7 @@ from flask import render_template, request, jsonify
 from . import story_to_code_bp
 import os
 from utils.utils_vertex import sendPrompt
+from utils.utils_sse import wants_stream, stream_prompt
 
 # Load models from .env file
 model_gemini_flash = os.getenv("MODEL_GEMINI_FLASH", "gemini-2.5-flash")
@@ -66,6 +67,9 @@ def generate_story():
     All the answers are required to be in {data['story_lang']} and to stick to the persona. 
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_story = sendPrompt(prompt, model)
     return jsonify({'content': response_story, 'prompt': prompt})
 
@@ -82,6 +86,9 @@ def generate_tasks():
     Create a table with the tasks as the table index with the task description.
     """ + data['story_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_tasks = sendPrompt(prompt, model)
     return jsonify({'content': response_tasks, 'prompt': prompt})
 
@@ -108,6 +115,9 @@ def generate_code():
         Create code only for the first task. Make a numbered list where the first item is the task name, the second is a summary of the code, and then include the generated snippet and as many new items as needed to complement the required information.
 """  + data['tasks_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_code = sendPrompt(prompt, model)
     return jsonify({'content': response_code, 'prompt': prompt})
 
@@ -145,5 +155,8 @@ def generate_test():
 
         """ + data['code_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_test = sendPrompt(prompt, model)
     return jsonify({'content': response_test, 'prompt': prompt})
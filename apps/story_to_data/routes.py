@@ -2,6 +2,7 @@ from flask import render_template, request, jsonify
 from . import story_to_data_bp
 import os
 from utils.utils_vertex import sendPrompt
+from utils.utils_sse import wants_stream, stream_prompt
 
 # Load models from .env file
 model_gemini_flash = os.getenv("MODEL_GEMINI_FLASH", "gemini-2.5-flash")
@@ -63,6 +64,9 @@ def generate_story():
     All the answers are required to be in {data['story_lang']} and to stick to the persona. 
     """
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_story = sendPrompt(prompt, model)
     return jsonify({'content': response_story, 'prompt': prompt})
 
@@ -79,6 +83,9 @@ def generate_tasks():
     Create a table with the tasks as the table index with the task description. 
     """ + data['story_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_tasks = sendPrompt(prompt, model)
     return jsonify({'content': response_tasks, 'prompt': prompt})
 
@@ -153,6 +160,9 @@ def generate_dw():
         Utilize o dados abaixo como entrada. 
     """ + data['tasks_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_snippets = sendPrompt(prompt, model)
     return jsonify({'content': response_snippets, 'prompt': prompt})
 
@@ -242,5 +252,8 @@ def generate_bigquery():
 
     """ + data['dw_content']
     
+    if wants_stream():
+        return stream_prompt(prompt, model)
+
     response_bigquery = sendPrompt(prompt, model)
     return jsonify({'content': response_bigquery, 'prompt': prompt})
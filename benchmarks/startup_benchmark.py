@@ -0,0 +1,265 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Startup benchmark.
+
+Measures, each in fresh interpreters so nothing is already imported:
+  - cold `create_app()` time (import of app.py included)
+  - `python -X importtime` cost of utils.utils_vertex and every apps.*.routes,
+    with the heaviest modules each pulls in
+  - resident memory once the app has started
+  - first-request latency of each blueprint's index route
+
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/startup_benchmark.py --output before.json
+    git checkout other-branch
+    python benchmarks/startup_benchmark.py --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import statistics
+import subprocess
+import tempfile
+from typing import Optional, List, Dict, Any
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# State the app creates on startup or first use, redirected into a scratch directory
+STATE_PATHS = {
+    "REPO_HISTORY_DB_PATH": "history.sqlite",
+    "REPO_CLASSIFY_CACHE_PATH": "classifications.sqlite",
+    "GEMINI_RESPONSE_CACHE_PATH": "responses.sqlite",
+    "REPO_SNAPSHOT_DIR": "snapshots",
+    "REPO_MIRROR_DIR": "repo_mirrors",
+    "REPO_WORKSPACE_DIR": "repo_cache"
+}
+
+def _rss_mb() -> Dict[str, Optional[float]]:
+    """Current and peak resident set size of this process, in MiB."""
+    current = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    return {
+        "rss_mb": round(current, 1) if current is not None else None,
+        "peak_rss_mb": round(peak, 1) if peak is not None else None
+    }
+
+def child_startup() -> Dict[str, Any]:
+    """Runs in a fresh interpreter: create the app, then hit every blueprint's index once."""
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    app = app_module.create_app()
+    created = time.perf_counter()
+    result = {
+        "import_app_ms": (imported - started) * 1000,
+        "create_app_ms": (created - started) * 1000,
+        **_rss_mb(),
+        "first_request_ms": {}
+    }
+    client = app.test_client()
+    for name, blueprint in sorted(app.blueprints.items()):
+        path = (blueprint.url_prefix or "") + "/"
+        started = time.perf_counter()
+        response = client.get(path)
+        result["first_request_ms"][name] = {
+            "path": path,
+            "status": response.status_code,
+            "ms": (time.perf_counter() - started) * 1000
+        }
+    result.update({"after_requests_" + key: value for key, value in _rss_mb().items()})
+    try:
+        from utils.utils_lazy import lazy_imports
+        result["lazy_imports"] = lazy_imports.report()
+    except ImportError:
+        pass
+    return result
+
+def _run_child(args: List[str], workdir: str) -> subprocess.CompletedProcess:
+    """Run a Python child from the repository root, as the app expects, with its state kept in `workdir`."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    for name, path in STATE_PATHS.items():
+        env[name] = os.path.join(workdir, path)
+    return subprocess.run([sys.executable] + args, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+
+def measure_startup(runs: int, workdir: str) -> Dict[str, Any]:
+    """Cold start of the whole app, `runs` times, each in a new interpreter."""
+    samples = []
+    for _ in range(runs):
+        proc = _run_child([os.path.abspath(__file__), "--child"], workdir)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Startup child failed:\n{proc.stderr}")
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    def summarize(values: List[float]) -> Dict[str, float]:
+        return {
+            "median": round(statistics.median(values), 1),
+            "min": round(min(values), 1),
+            "max": round(max(values), 1)
+        }
+
+    first_requests = {}
+    for name in samples[0]["first_request_ms"]:
+        entries = [sample["first_request_ms"][name] for sample in samples]
+        first_requests[name] = {
+            "path": entries[0]["path"],
+            "status": entries[0]["status"],
+            **summarize([entry["ms"] for entry in entries])
+        }
+    return {
+        "runs": runs,
+        "import_app_ms": summarize([sample["import_app_ms"] for sample in samples]),
+        "create_app_ms": summarize([sample["create_app_ms"] for sample in samples]),
+        "rss_mb": summarize([sample["rss_mb"] for sample in samples if sample["rss_mb"] is not None] or [0]),
+        "peak_rss_mb": summarize([sample["peak_rss_mb"] for sample in samples if sample["peak_rss_mb"] is not None] or [0]),
+        "after_requests_rss_mb": summarize([sample["after_requests_rss_mb"] for sample in samples
+                                            if sample["after_requests_rss_mb"] is not None] or [0]),
+        "first_request_ms": first_requests,
+        "lazy_imports": samples[-1].get("lazy_imports")
+    }
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse `-X importtime` output into {module, depth, self_us, cumulative_us} rows."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+    return rows
+
+def measure_imports(modules: List[str], workdir: str, top: int) -> Dict[str, Any]:
+    """Import cost of each module on its own, in a new interpreter, with its `top` heaviest dependencies."""
+    results = {}
+    for module in modules:
+        proc = _run_child(["-X", "importtime", "-c", f"import {module}"], workdir)
+        if proc.returncode != 0:
+            results[module] = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+            continue
+        rows = parse_importtime(proc.stderr)
+        target = next((row for row in rows if row["module"] == module), None)
+        heaviest = sorted(rows, key=lambda row: row["self_us"], reverse=True)[:top]
+        results[module] = {
+            "cumulative_ms": round(target["cumulative_us"] / 1000, 1) if target else None,
+            "modules_imported": len(rows),
+            "heaviest": [{"module": row["module"], "self_ms": round(row["self_us"] / 1000, 1),
+                          "cumulative_ms": round(row["cumulative_us"] / 1000, 1)} for row in heaviest]
+        }
+    return results
+
+def default_modules() -> List[str]:
+    """utils.utils_vertex and the routes module of every app."""
+    apps_dir = os.path.join(REPO_ROOT, "apps")
+    routes = sorted(
+        f"apps.{name}.routes" for name in os.listdir(apps_dir)
+        if os.path.isfile(os.path.join(apps_dir, name, "routes.py"))
+    )
+    return ["utils.utils_vertex"] + routes
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Lines describing how the headline numbers moved against a baseline result."""
+    lines = [f"Compared with {(baseline.get('commit') or 'baseline')[:12]}:"]
+
+    def delta(label: str, new: Optional[float], old: Optional[float], unit: str):
+        if new is None or old is None:
+            return
+        change = f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+        lines.append(f"  {label}: {old:.1f} -> {new:.1f} {unit}{change}")
+
+    delta("create_app median", current["startup"]["create_app_ms"]["median"],
+          baseline["startup"]["create_app_ms"]["median"], "ms")
+    delta("RSS median", current["startup"]["rss_mb"]["median"], baseline["startup"]["rss_mb"]["median"], "MiB")
+    for module, entry in current["imports"].items():
+        old = baseline.get("imports", {}).get(module, {})
+        delta(f"import {module}", entry.get("cumulative_ms"), old.get("cumulative_ms"), "ms")
+    for name, entry in current["startup"]["first_request_ms"].items():
+        old = baseline["startup"]["first_request_ms"].get(name, {})
+        delta(f"first request {entry['path']}", entry["median"], old.get("median"), "ms")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app startup time, import cost, memory and first-request latency.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure (default 5)")
+    parser.add_argument("--modules", nargs="*", help="Modules to measure with -X importtime "
+                                                     "(default utils.utils_vertex and every apps.*.routes)")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest dependencies listed per module (default 10)")
+    parser.add_argument("--output", help="Write the results as JSON to this file (default stdout)")
+    parser.add_argument("--compare", help="Earlier JSON result to print deltas against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child_startup()))
+        return
+
+    # History, snapshots and caches created while measuring go to a scratch directory, not the repository
+    with tempfile.TemporaryDirectory(prefix="startup-benchmark-") as workdir:
+        result = {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "startup": measure_startup(args.runs, workdir),
+            "imports": measure_imports(args.modules or default_modules(), workdir, args.top)
+        }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        startup = result["startup"]
+        print(f"create_app: {startup['create_app_ms']['median']} ms median over {args.runs} runs, "
+              f"RSS {startup['rss_mb']['median']} MiB; results written to {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(result, baseline)), file=sys.stderr if not args.output else sys.stdout)
+
+if __name__ == "__main__":
+    main()
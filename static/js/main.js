@@ -80,6 +80,162 @@ async function loadPage(pageId) {
     }
 }
 
+// Streams a generate route over Server-Sent Events. onUpdate receives the
+// accumulated content and the prompt each time a chunk arrives. Resolves to
+// the same shape as the JSON endpoints: { content, prompt, ... } or { error }.
+async function streamGeneration(url, data, onUpdate) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify(data)
+    });
+
+    // Validation errors still come back as plain JSON
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream')) {
+        return await response.json();
+    }
+
+    const result = { content: '' };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseSseFrame(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+
+            if (event.type === 'meta') {
+                Object.assign(result, event.data);
+            } else if (event.type === 'chunk') {
+                result.content += event.data.text;
+                onUpdate(result.content, result.prompt);
+            } else if (event.type === 'error') {
+                return { ...result, error: event.data.error };
+            }
+        }
+    }
+    return result;
+}
+
+// Starts a background job and returns its ID
+async function startJob(url, data) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(data)
+    });
+    const job = await response.json();
+    if (!response.ok) {
+        throw new Error(job.error || 'Unknown error occurred.');
+    }
+    return job.job_id;
+}
+
+// Follows a background job's progress events; resolves with its result
+function followJob(baseUrl, jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`${baseUrl}/jobs/${jobId}/events`);
+        source.addEventListener('progress', e => onProgress(JSON.parse(e.data)));
+        source.addEventListener('done', e => {
+            source.close();
+            resolve(JSON.parse(e.data).result);
+        });
+        source.addEventListener('failed', e => {
+            source.close();
+            reject(new Error(JSON.parse(e.data).error || 'Job failed.'));
+        });
+        source.addEventListener('cancelled', () => {
+            source.close();
+            reject(new Error('Cancelled.'));
+        });
+        source.onerror = () => {
+            // EventSource reconnects on its own unless the server refused the stream
+            if (source.readyState === EventSource.CLOSED) {
+                reject(new Error('Lost connection to the job.'));
+            }
+        };
+    });
+}
+
+async function cancelJob(baseUrl, jobId) {
+    await fetch(`${baseUrl}/jobs/${jobId}/cancel`, { method: 'POST' });
+}
+
+function describeJobProgress(job) {
+    const progress = job.progress || {};
+    if (job.state === 'queued') return 'Waiting for a free worker...';
+    switch (progress.stage) {
+        case 'resolving': return 'Checking the repository...';
+        case 'cloning': return 'Cloning repository...';
+        case 'extracting':
+            return `Indexing: ${(progress.files_scanned || 0).toLocaleString()} files scanned, ` +
+                `${(progress.files_classified || 0).toLocaleString()} classified, ` +
+                `${((progress.bytes_read || 0) / 1048576).toFixed(1)} MB read...`;
+        case 'embedding':
+            return `Building search index: ${(progress.chunks_embedded || 0).toLocaleString()} chunks embedded...`;
+        case 'caching': return 'Creating context cache...';
+        default: return 'Working...';
+    }
+}
+
+// Shows a job's live progress with a cancel button in container; resolves with the job's result
+function describeMapReduce(report) {
+    const slowest = Math.max(0, ...report.shards.map(shard => shard.seconds));
+    let text = `Map-reduce over ${report.shard_count} shard(s) at concurrency ${report.concurrency}: ` +
+        `map ${report.map_seconds}s (slowest shard ${slowest}s), reduce ${report.reduce_seconds}s`;
+    if (report.failed_shards) {
+        text += `; ${report.failed_shards} shard(s) failed and were left out`;
+    }
+    return text;
+}
+
+async function runJobWithProgress(container, baseUrl, url, data) {
+    const jobId = await startJob(url, data);
+    container.innerHTML = `<p class="job-progress placeholder-text">Queued...</p>
+        <button class="action-button button-danger cancel-job-btn"><i class="fas fa-stop"></i> Cancel</button>`;
+    const progressText = container.querySelector('.job-progress');
+    const cancelBtn = container.querySelector('.cancel-job-btn');
+    cancelBtn.addEventListener('click', () => {
+        cancelBtn.disabled = true;
+        cancelJob(baseUrl, jobId);
+    });
+    return followJob(baseUrl, jobId, job => {
+        progressText.textContent = describeJobProgress(job);
+    });
+}
+
+function parseSseFrame(frame) {
+    let type = 'message';
+    const dataLines = [];
+    frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    });
+    return { type, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+}
+
+// Re-renders a streamed result's markdown at most once per animation frame
+const pendingMarkdownRenders = new Map();
+
+function updateStreamedResult(type, content) {
+    const target = document.querySelector(`#result-${type} .markdown-content`);
+    if (!target) return;
+    if (!pendingMarkdownRenders.has(target)) {
+        requestAnimationFrame(() => {
+            target.innerHTML = marked.parse(pendingMarkdownRenders.get(target));
+            pendingMarkdownRenders.delete(target);
+        });
+    }
+    pendingMarkdownRenders.set(target, content);
+}
+
 function initializeAccessibilityApp() {
     // State management
     let generatedWcagAnalysis = '';
@@ -177,12 +333,15 @@ function initializeAccessibilityApp() {
         if (type === 'test_plan') data.implementation = generatedImplementation;
 
         try {
-            const response = await fetch(`/accessibility/generate/${type}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
+            let streamed = false;
+            const result = await streamGeneration(`/accessibility/generate/${type}`, data, (content, prompt) => {
+                if (!streamed) {
+                    displayResult(type, content, prompt);
+                    streamed = true;
+                } else {
+                    updateStreamedResult(type, content);
+                }
             });
-            const result = await response.json();
 
             if (result.error) {
                 alert(`Error: ${result.error}`);
@@ -195,7 +354,11 @@ function initializeAccessibilityApp() {
             if (type === 'user_stories') generatedUserStories = result.content;
             if (type === 'implementation') generatedImplementation = result.content;
 
-            displayResult(type, result.content, result.prompt);
+            if (streamed) {
+                updateStreamedResult(type, result.content);
+            } else {
+                displayResult(type, result.content, result.prompt);
+            }
             updateButton(current.btn, current.regen, current.nextBtn);
 
         } catch (error) {
@@ -406,12 +569,15 @@ function initializeStoryToDataApp() {
         if (type === 'bigquery') data.dw_content = generatedDw;
 
         try {
-            const response = await fetch(`/story_to_data/generate/${type}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
+            let streamed = false;
+            const result = await streamGeneration(`/story_to_data/generate/${type}`, data, (content, prompt) => {
+                if (!streamed) {
+                    displayResult(type, content, prompt);
+                    streamed = true;
+                } else {
+                    updateStreamedResult(type, content);
+                }
             });
-            const result = await response.json();
 
             if (result.error) {
                 alert(`Error: ${result.error}`);
@@ -423,7 +589,11 @@ function initializeStoryToDataApp() {
             if (type === 'tasks') generatedTasks = result.content;
             if (type === 'dw') generatedDw = result.content;
 
-            displayResult(type, result.content, result.prompt);
+            if (streamed) {
+                updateStreamedResult(type, result.content);
+            } else {
+                displayResult(type, result.content, result.prompt);
+            }
             updateButton(current.btn, current.regen, current.nextBtn);
 
         } catch (error) {
@@ -782,12 +952,15 @@ function initializeImageToCodeApp() {
         if (type === 'selenium') data.test_cases_content = generatedTestCases;
 
         try {
-            const response = await fetch(`/image_to_code/generate/${type}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
+            let streamed = false;
+            const result = await streamGeneration(`/image_to_code/generate/${type}`, data, (content, prompt) => {
+                if (!streamed) {
+                    displayResult(type, content, prompt);
+                    streamed = true;
+                } else {
+                    updateStreamedResult(type, content);
+                }
             });
-            const result = await response.json();
 
             if (result.error) {
                 alert(`Error: ${result.error}`);
@@ -802,7 +975,11 @@ function initializeImageToCodeApp() {
             if (type === 'test_cases') generatedTestCases = result.content;
             if (type === 'test_script') generatedTestScript = result.content;
 
-            displayResult(type, result.content, result.prompt);
+            if (streamed) {
+                updateStreamedResult(type, result.content);
+            } else {
+                displayResult(type, result.content, result.prompt);
+            }
             updateButton(btn, regenBtn, getNextButton(type));
 
         } catch (error) {
@@ -1021,12 +1198,15 @@ function initializeStoryToApiApp() {
         if (type === 'apigee') data.openapi_content = generatedOpenapi;
 
         try {
-            const response = await fetch(`/story_to_api/generate/${type}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
+            let streamed = false;
+            const result = await streamGeneration(`/story_to_api/generate/${type}`, data, (content, prompt) => {
+                if (!streamed) {
+                    displayResult(type, content, prompt);
+                    streamed = true;
+                } else {
+                    updateStreamedResult(type, content);
+                }
             });
-            const result = await response.json();
 
             if (result.error) {
                 alert(`Error: ${result.error}`);
@@ -1038,7 +1218,11 @@ function initializeStoryToApiApp() {
             if (type === 'tasks') generatedTasks = result.content;
             if (type === 'openapi') generatedOpenapi = result.content;
 
-            displayResult(type, result.content, result.prompt);
+            if (streamed) {
+                updateStreamedResult(type, result.content);
+            } else {
+                displayResult(type, result.content, result.prompt);
+            }
             updateButton(current.btn, current.regen, current.nextBtn);
 
         } catch (error) {
@@ -1157,8 +1341,7 @@ function initializeRepoInspectionApp() {
     const clearAllBtn = document.getElementById('clear_all_btn');
 
     let analysisOptions = {};
-    let codeIndex = null;
-    let codeText = null;
+    let snapshotId = null;
 
     initializeTabs();
 
@@ -1218,23 +1401,19 @@ function initializeRepoInspectionApp() {
 
 
         try {
-            const response = await fetch('/repo_inspection/clone_and_index', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ repo_url: repoUrl }),
-            });
-
-            const data = await response.json();
+            const data = await runJobWithProgress(resultsContainer, '/repo_inspection',
+                '/repo_inspection/clone_and_index', { repo_url: repoUrl });
 
-            if (response.ok) {
-                codeIndex = data.index;
-                codeText = data.text;
-                resultsContainer.innerHTML = `<p>${data.message}</p><p>Found ${codeIndex.length} files.</p>`;
-                setButtonState(cloneBtn, 'success', 'regen_clone_btn');
-                setButtonState(generateBtn, 'ready');
-            } else {
-                throw new Error(data.error || 'Unknown error occurred.');
+            snapshotId = data.snapshot_id;
+            resultsContainer.innerHTML = `<p>${data.message}</p><p>Found ${data.file_count} files (${data.char_count.toLocaleString()} characters) at commit ${data.commit_sha.substring(0, 12)}.</p>`;
+            if (data.classification && data.classification.files) {
+                resultsContainer.innerHTML += `<p>Classified ${data.classification.files} files (${data.classification.cached} from cache, ${data.classification.prefiltered} by extension, ${data.classification.model} by Magika) at ${data.classification.files_per_second} files/s.</p>`;
             }
+            if (data.truncated) {
+                resultsContainer.innerHTML += `<p>Size budget reached: ${data.skipped_files} file(s) were indexed but their content was left out.</p>`;
+            }
+            setButtonState(cloneBtn, 'success', 'regen_clone_btn');
+            setButtonState(generateBtn, 'ready');
         } catch (error) {
             resultsContainer.innerHTML = `<p class="error">Error: ${error.message}</p>`;
             setButtonState(cloneBtn, 'ready');
@@ -1255,7 +1434,7 @@ function initializeRepoInspectionApp() {
             return;
         }
 
-        if (!codeIndex || !codeText) {
+        if (!snapshotId) {
             alert('Please clone and index a repository first.');
             return;
         }
@@ -1271,15 +1450,16 @@ function initializeRepoInspectionApp() {
                 body: JSON.stringify({
                     model_name: modelName,
                     question: question,
-                    code_index: codeIndex,
-                    code_text: codeText,
+                    snapshot_id: snapshotId,
+                    mode: document.getElementById('analysis_mode').value,
                 }),
             });
 
             const data = await response.json();
 
             if (response.ok) {
-                displayResult('analysis', data.content, data.prompt);
+                const prompt = data.map_reduce ? `${data.prompt}\n\n${describeMapReduce(data.map_reduce)}` : data.prompt;
+                displayResult('analysis', data.content, prompt);
                 setButtonState(generateBtn, 'success', 'regen_analysis_btn');
             } else {
                 throw new Error(data.error || 'Unknown error occurred.');
@@ -1291,8 +1471,7 @@ function initializeRepoInspectionApp() {
     }
     
     function clearAll() {
-        codeIndex = null;
-        codeText = null;
+        snapshotId = null;
         resultsContainer.innerHTML = '<p style="text-align: center; color: var(--text-secondary); font-style: italic;">Generated content will appear here...</p>';
         setButtonState(cloneBtn, 'ready');
         setButtonState(generateBtn, 'waiting');
@@ -1404,9 +1583,11 @@ function initializeRepoCacheAnalysisApp() {
     // State
     let sessionCache = {
         name: null,
+        model: null,
         char_count: 0,
-        code_index: null,
-        code_text: null,
+        snapshot_id: null,
+        cache_snapshot_id: null,
+        repo_url: null,
         costs: []
     };
 
@@ -1415,6 +1596,7 @@ function initializeRepoCacheAnalysisApp() {
     const generateAnalysisBtn = document.getElementById('generate_analysis_btn');
     const listCachesBtn = document.getElementById('list_caches_btn');
     const deleteCacheBtn = document.getElementById('delete_cache_btn');
+    const extendCacheBtn = document.getElementById('extend_cache_btn');
     const cacheTtlSlider = document.getElementById('cache_ttl');
     const cacheTtlValue = document.getElementById('cache_ttl_value');
     const analysisTypeSelect = document.getElementById('analysis_type');
@@ -1473,12 +1655,24 @@ function initializeRepoCacheAnalysisApp() {
         if (generateAnalysisBtn) generateAnalysisBtn.addEventListener('click', handleGenerateAnalysis);
         if (listCachesBtn) listCachesBtn.addEventListener('click', handleListCaches);
         if (deleteCacheBtn) deleteCacheBtn.addEventListener('click', handleDeleteCache);
+        if (extendCacheBtn) extendCacheBtn.addEventListener('click', handleExtendCache);
         
         // Add event listener for the history tab
         const historyTab = document.querySelector('.tab[data-tab="history"]');
         if (historyTab) {
             historyTab.addEventListener('click', handleLoadHistory);
         }
+        const historyForm = document.getElementById('history-form');
+        if (historyForm) {
+            historyForm.addEventListener('submit', (event) => {
+                event.preventDefault();
+                handleLoadHistory(event);
+            });
+        }
+        const historyMoreBtn = document.getElementById('history_more_btn');
+        if (historyMoreBtn) {
+            historyMoreBtn.addEventListener('click', (event) => handleLoadHistory(event, true));
+        }
     }
 
     function updateAnalysisDescription() {
@@ -1522,29 +1716,29 @@ function initializeRepoCacheAnalysisApp() {
         resultsContainer.innerHTML = `<p class="placeholder-text">Cloning, indexing, and caching repository... This may take a moment.</p>`;
 
         try {
-            const response = await fetch('/repo_cache_analysis/process', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    repo_url: repoUrl,
-                    cache_ttl: parseInt(cacheTtlSlider.value, 10)
-                })
+            // Re-processing the same repository keeps its cache if the code barely changed
+            const sameRepo = sessionCache.repo_url === repoUrl;
+            const data = await runJobWithProgress(resultsContainer, '/repo_cache_analysis', '/repo_cache_analysis/process', {
+                repo_url: repoUrl,
+                model_name: document.getElementById('model_name').value,
+                cache_ttl: parseInt(cacheTtlSlider.value, 10),
+                cache_name: sameRepo ? sessionCache.name : null,
+                cache_model: sameRepo ? sessionCache.model : null,
+                cache_snapshot_id: sameRepo ? sessionCache.cache_snapshot_id : null
             });
-            const data = await response.json();
 
-            if (response.ok) {
-                sessionCache.char_count = data.char_count;
-                sessionCache.code_index = data.code_index;
-                sessionCache.code_text = data.code_text;
-                sessionCache.costs = []; // Reset costs for new repo
-
-                resultsContainer.innerHTML = `<p class="placeholder-text" style="color: var(--success-color);">${data.message}</p>`;
-                setButtonState(processRepoBtn, 'completed');
-                setButtonState(generateAnalysisBtn, 'ready');
-                updateCostsDisplay();
-            } else {
-                throw new Error(data.error || 'An unknown error occurred.');
-            }
+            sessionCache.name = data.cache ? data.cache.name : null;
+            sessionCache.model = data.cache ? data.cache.modelName : null;
+            sessionCache.char_count = data.char_count;
+            sessionCache.snapshot_id = data.snapshot_id;
+            sessionCache.cache_snapshot_id = data.cache_snapshot_id;
+            sessionCache.repo_url = repoUrl;
+            sessionCache.costs = []; // Reset costs for new repo
+
+            resultsContainer.innerHTML = `<p class="placeholder-text" style="color: var(--success-color);">${data.message}</p>`;
+            setButtonState(processRepoBtn, 'completed');
+            setButtonState(generateAnalysisBtn, 'ready');
+            updateCostsDisplay();
         } catch (error) {
             resultsContainer.innerHTML = `<p class="placeholder-text" style="color: var(--danger-color);">Error: ${error.message}</p>`;
             setButtonState(processRepoBtn, 'ready');
@@ -1552,7 +1746,7 @@ function initializeRepoCacheAnalysisApp() {
     }
 
     async function handleGenerateAnalysis() {
-        if (!sessionCache.code_index) {
+        if (!sessionCache.snapshot_id) {
             alert('Please process a repository first.');
             return;
         }
@@ -1575,10 +1769,13 @@ function initializeRepoCacheAnalysisApp() {
                 body: JSON.stringify({
                     question: question,
                     model_name: document.getElementById('model_name').value,
-                    code_index: sessionCache.code_index,
-                    code_text: sessionCache.code_text,
+                    cache_name: sessionCache.name,
+                    cache_model: sessionCache.model,
+                    cache_snapshot_id: sessionCache.cache_snapshot_id,
+                    snapshot_id: sessionCache.snapshot_id,
                     repo_url: document.getElementById('repo_url').value,
-                    analysis_type: analysisType
+                    analysis_type: analysisType,
+                    mode: document.getElementById('analysis_mode').value
                 })
             });
             const data = await response.json();
@@ -1586,6 +1783,9 @@ function initializeRepoCacheAnalysisApp() {
             if (response.ok) {
                 const analysisHtml = marked.parse(data.analysis);
                 resultsContainer.innerHTML = `<div class="markdown-content">${analysisHtml}</div>`;
+                if (data.map_reduce) {
+                    resultsContainer.insertAdjacentHTML('beforeend', `<p class="placeholder-text">${describeMapReduce(data.map_reduce)}</p>`);
+                }
                 
                 // Simple cost calculation for display
                 const isFirstRequest = sessionCache.costs.length === 0;
@@ -1644,11 +1844,13 @@ function initializeRepoCacheAnalysisApp() {
                     cacheSelect.innerHTML = caches.filter(c => c.name).map(c => `<option value="${c.name}">${c.name.split('/').pop()}</option>`).join('');
                     cacheSelect.style.display = 'block';
                     deleteCacheBtn.style.display = 'block';
+                    if (extendCacheBtn) extendCacheBtn.style.display = 'block';
 
                 } else {
                     cachesListContainer.innerHTML = `<p class="placeholder-text">No active caches found.</p>`;
                     cacheSelect.style.display = 'none';
                     deleteCacheBtn.style.display = 'none';
+                    if (extendCacheBtn) extendCacheBtn.style.display = 'none';
                 }
             } else {
                 throw new Error(caches.error || 'Failed to list caches.');
@@ -1676,6 +1878,11 @@ function initializeRepoCacheAnalysisApp() {
             const data = await response.json();
 
             if (response.ok) {
+                if (selectedCacheName === sessionCache.name) {
+                    // Fall back to sending the code inline for this session
+                    sessionCache.name = null;
+                    sessionCache.model = null;
+                }
                 alert(data.message);
                 handleListCaches(); // Refresh the list
             } else {
@@ -1685,6 +1892,32 @@ function initializeRepoCacheAnalysisApp() {
             alert(`Error: ${error.message}`);
         }
     }
+
+    async function handleExtendCache() {
+        const selectedCacheName = cacheSelect.value;
+        if (!selectedCacheName) {
+            alert('Please select a cache to extend.');
+            return;
+        }
+
+        try {
+            const response = await fetch(`/repo_cache_analysis/caches/${encodeURIComponent(selectedCacheName)}/ttl`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ttl_hours: parseInt(cacheTtlSlider.value, 10) })
+            });
+            const data = await response.json();
+
+            if (response.ok) {
+                alert(data.message);
+                handleListCaches(); // Refresh the list
+            } else {
+                throw new Error(data.error || 'Failed to extend cache.');
+            }
+        } catch (error) {
+            alert(`Error: ${error.message}`);
+        }
+    }
     
     function calculateCacheCost(cachedChars, storageHours, numRequests, inputChars, outputChars, isFirstRequest) {
         const cacheCreationCost = isFirstRequest ? cachedChars * (0.0003125 / 1000) : 0;
@@ -1704,18 +1937,30 @@ function initializeRepoCacheAnalysisApp() {
         };
     }
 
-    async function handleLoadHistory() {
-        const historyContainer = document.getElementById('tab-history');
-        historyContainer.innerHTML = `<p class="placeholder-text">Loading history...</p>`;
+    // Cursor of the next history page; null once the last page is shown
+    let historyBefore = null;
+
+    async function handleLoadHistory(event, append = false) {
+        const historyContainer = document.getElementById('history_results');
+        const moreBtn = document.getElementById('history_more_btn');
+        if (!append) {
+            historyBefore = null;
+            historyContainer.innerHTML = `<p class="placeholder-text">Loading history...</p>`;
+        }
+
+        const params = new URLSearchParams();
+        const search = document.getElementById('history_search').value.trim();
+        if (search) params.set('q', search);
+        if (historyBefore) params.set('before', historyBefore);
 
         try {
-            const response = await fetch('/repo_cache_analysis/history');
-            const history = await response.json();
+            const response = await fetch(`/repo_cache_analysis/history?${params}`);
+            const page = await response.json();
 
             if (response.ok) {
-                if (history.length > 0) {
-                    let historyHtml = '<div class="history-list">';
-                    history.forEach(item => {
+                if (page.entries.length > 0) {
+                    let historyHtml = '';
+                    page.entries.forEach(item => {
                         historyHtml += `
                             <div class="history-item">
                                 <div class="history-header">
@@ -1729,24 +1974,33 @@ function initializeRepoCacheAnalysisApp() {
                             </div>
                         `;
                     });
-                    historyHtml += '</div>';
-                    historyContainer.innerHTML = historyHtml;
+                    let list = historyContainer.querySelector('.history-list');
+                    if (!append || !list) {
+                        historyContainer.innerHTML = '<div class="history-list"></div>';
+                        list = historyContainer.querySelector('.history-list');
+                    }
+                    const added = document.createElement('div');
+                    added.innerHTML = historyHtml;
 
                     // Add event listeners to new history items
-                    historyContainer.querySelectorAll('.history-header').forEach(header => {
+                    added.querySelectorAll('.history-header').forEach(header => {
                         header.addEventListener('click', () => {
                             header.parentElement.classList.toggle('expanded');
                         });
                     });
+                    list.append(...added.children);
 
-                } else {
-                    historyContainer.innerHTML = `<p class="placeholder-text">No analysis history found.</p>`;
+                } else if (!append) {
+                    historyContainer.innerHTML = `<p class="placeholder-text">${search ? 'No analyses match your search.' : 'No analysis history found.'}</p>`;
                 }
+                historyBefore = page.next_before;
+                moreBtn.style.display = historyBefore ? '' : 'none';
             } else {
-                throw new Error(history.error || 'Failed to load history.');
+                throw new Error(page.error || 'Failed to load history.');
             }
         } catch (error) {
             historyContainer.innerHTML = `<p class="placeholder-text" style="color: var(--danger-color);">Error: ${error.message}</p>`;
+            moreBtn.style.display = 'none';
         }
     }
 
@@ -1905,12 +2159,15 @@ function initializeStoryToCodeApp() {
         if (type === 'test') data.code_content = generatedCode;
 
         try {
-            const response = await fetch(`/story_to_code/generate/${type}`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
+            let streamed = false;
+            const result = await streamGeneration(`/story_to_code/generate/${type}`, data, (content, prompt) => {
+                if (!streamed) {
+                    displayResult(type, content, prompt);
+                    streamed = true;
+                } else {
+                    updateStreamedResult(type, content);
+                }
             });
-            const result = await response.json();
 
             if (result.error) {
                 alert(`Error: ${result.error}`);
@@ -1922,7 +2179,11 @@ function initializeStoryToCodeApp() {
             if (type === 'tasks') generatedTasks = result.content;
             if (type === 'code') generatedCode = result.content;
 
-            displayResult(type, result.content, result.prompt);
+            if (streamed) {
+                updateStreamedResult(type, result.content);
+            } else {
+                displayResult(type, result.content, result.prompt);
+            }
             updateButton(current.btn, current.regen, current.nextBtn);
 
         } catch (error) {
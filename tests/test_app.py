@@ -0,0 +1,110 @@
+import time
+import importlib
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from google.auth import jwt
+from google.auth.crypt import es256
+
+from utils import utils_vertex
+from utils.utils_vertex import TokenCount, set_usage_labels, usage_tracker
+
+AUDIENCE = "/projects/123/global/backendServices/456"
+FORGED = {"X-Goog-Authenticated-User-Email": "accounts.google.com:admin@example.com"}
+
+
+def load_app(monkeypatch, **env):
+    monkeypatch.setenv("USAGE_ADMIN_TOKEN", "secret-token")
+    monkeypatch.setenv("USAGE_ADMIN_EMAILS", "admin@example.com")
+    for name in ("IAP_AUDIENCE", "TRUST_IAP_HEADERS"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    import app
+    return importlib.reload(app)
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    return load_app(monkeypatch)
+
+
+@pytest.fixture
+def iap_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo)
+    return es256.ES256Signer.from_string(private_pem, key_id="iap-key"), {"iap-key": public_pem.decode()}
+
+
+def iap_assertion(signer, email, audience=AUDIENCE, issuer="https://cloud.google.com/iap"):
+    now = int(time.time())
+    return jwt.encode(signer, {"iss": issuer, "aud": audience, "email": email,
+                               "sub": "accounts.google.com:1", "iat": now, "exp": now + 600}).decode()
+
+
+@pytest.fixture
+def recorded_usage():
+    set_usage_labels(route="story_to_code.generate", user="alice@example.com")
+    usage_tracker.record("gemini-test", TokenCount(prompt_tokens=10, completion_tokens=5, total_tokens=15))
+    set_usage_labels()
+
+
+def usage_body(app_module, headers):
+    return app_module.create_app().test_client().get("/usage", headers=headers).get_data(as_text=True)
+
+
+def test_usage_hides_user_identities_from_anonymous_callers(app_module, recorded_usage):
+    body = usage_body(app_module, {})
+    assert "alice@example.com" not in body
+    assert usage_tracker.pseudonym("alice@example.com") in body
+
+
+def test_usage_identifies_users_for_bearer_token_admins(app_module, recorded_usage):
+    assert "alice@example.com" in usage_body(app_module, {"Authorization": "Bearer secret-token"})
+    assert "alice@example.com" not in usage_body(app_module, {"Authorization": "Bearer wrong"})
+
+
+def test_unsigned_iap_header_is_ignored_by_default(app_module, recorded_usage):
+    assert "alice@example.com" not in usage_body(app_module, FORGED)
+
+
+def test_unsigned_iap_header_is_trusted_only_when_opted_in(monkeypatch, recorded_usage):
+    app_module = load_app(monkeypatch, TRUST_IAP_HEADERS="true")
+    assert "alice@example.com" in usage_body(app_module, FORGED)
+
+
+def test_signed_iap_assertion_identifies_admins(monkeypatch, recorded_usage, iap_key):
+    signer, certs = iap_key
+    app_module = load_app(monkeypatch, IAP_AUDIENCE=AUDIENCE, TRUST_IAP_HEADERS="true")
+    monkeypatch.setattr(app_module, "fetch_iap_certs", lambda: certs)
+
+    assert "alice@example.com" in usage_body(
+        app_module, {"X-Goog-IAP-JWT-Assertion": iap_assertion(signer, "admin@example.com")})
+    # With an audience configured, the unsigned header is not enough on its own
+    assert "alice@example.com" not in usage_body(app_module, FORGED)
+    for assertion in (iap_assertion(signer, "admin@example.com", audience="/projects/999/apps/other"),
+                      iap_assertion(signer, "admin@example.com", issuer="https://evil.example.com"),
+                      iap_assertion(signer, "admin@example.com")[:-4] + "AAAA"):
+        assert "alice@example.com" not in usage_body(app_module, {"X-Goog-IAP-JWT-Assertion": assertion})
+
+
+def test_usage_is_labelled_with_the_client_address_unless_the_user_is_verified(monkeypatch, iap_key):
+    signer, certs = iap_key
+    app_module = load_app(monkeypatch)
+    flask_app = app_module.create_app()
+    with flask_app.test_request_context("/", headers=FORGED, environ_base={"REMOTE_ADDR": "203.0.113.7"}):
+        flask_app.preprocess_request()
+        assert utils_vertex._usage_labels.get()["user"] == "203.0.113.7"
+
+    app_module = load_app(monkeypatch, IAP_AUDIENCE=AUDIENCE)
+    monkeypatch.setattr(app_module, "fetch_iap_certs", lambda: certs)
+    flask_app = app_module.create_app()
+    headers = {"X-Goog-IAP-JWT-Assertion": iap_assertion(signer, "bob@example.com")}
+    with flask_app.test_request_context("/", headers=headers, environ_base={"REMOTE_ADDR": "203.0.113.7"}):
+        flask_app.preprocess_request()
+        assert utils_vertex._usage_labels.get()["user"] == "bob@example.com"
+    set_usage_labels()
@@ -0,0 +1,263 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+import apps.image_to_code.routes as image_routes
+import apps.repo_cache_analysis.routes as cache_routes
+import apps.repo_inspection.routes as inspection_routes
+import utils.utils_sse as sse
+from utils.utils_params import ParamError, number_param
+from utils.utils_repo import SnapshotStore
+from utils.utils_vertex import TokenCount
+
+
+@pytest.fixture
+def client():
+    flask_app = app_module.create_app()
+    flask_app.config["VERTEXAI_INITIALIZED"] = True
+    return flask_app.test_client()
+
+
+def test_number_param_clamps_and_rejects_non_numbers():
+    assert number_param({}, "top_k", 20, 1, 200) == 20
+    assert number_param({"top_k": ""}, "top_k", 20, 1, 200) == 20
+    assert number_param({"top_k": "50"}, "top_k", 20, 1, 200) == 50
+    assert number_param({"top_k": -3}, "top_k", 20, 1, 200) == 1
+    assert number_param({"top_k": 10 ** 9}, "top_k", 20, 1, 200) == 200
+    assert number_param({"ttl": "1.5"}, "ttl", 1, 0.1, 168, cast=float) == 1.5
+    for value in ("abc", [1], True, "nan", "inf"):
+        with pytest.raises(ParamError):
+            number_param({"top_k": value}, "top_k", 20, 1, 200)
+
+
+@pytest.mark.parametrize("path,body", [
+    ("/repo_inspection/generate_analysis",
+     {"model_name": "m", "question": "q", "snapshot_id": "abc", "concurrency": "lots"}),
+    ("/repo_cache_analysis/analyze",
+     {"question": "q", "repo_url": "u", "analysis_type": "t", "snapshot_id": "abc", "top_k": "many"}),
+    ("/repo_cache_analysis/process", {"repo_url": "u", "token_budget": "big"}),
+    ("/repo_cache_analysis/caches/projects/p/cachedContents/c/ttl", {"ttl_hours": "soon"}),
+])
+def test_malformed_numbers_are_rejected_with_400(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert "must be a number" in response.get_json()["error"]
+
+
+def test_out_of_range_numbers_are_clamped_not_500(client):
+    response = client.post("/repo_inspection/generate_analysis", json={
+        "model_name": "m", "question": "q", "snapshot_id": "abc", "concurrency": -4, "top_k": 0
+    })
+    # Validation passes; the snapshot simply does not exist
+    assert response.status_code == 404
+
+
+def test_map_reduce_mode_does_not_pack_the_whole_repository(client, tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    with store.writer("https://example.com/repo", "a" * 40) as pending:
+        pending.file.write("")
+    monkeypatch.setattr(inspection_routes, "snapshot_store", store)
+
+    def fail_pack(*args, **kwargs):
+        raise AssertionError("pack_files called in map_reduce mode")
+    monkeypatch.setattr(inspection_routes, "pack_files", fail_pack)
+    calls = []
+
+    def fake_map_reduce(client, question, plan, model, max_concurrency):
+        calls.append(max_concurrency)
+        return SimpleNamespace(answer="merged", report=lambda: {})
+    monkeypatch.setattr(inspection_routes, "map_reduce_analysis", fake_map_reduce)
+    monkeypatch.setattr(inspection_routes, "get_default_client", lambda: None)
+
+    response = client.post("/repo_inspection/generate_analysis", json={
+        "model_name": "m", "question": "q", "snapshot_id": pending.snapshot.snapshot_id,
+        "mode": "map_reduce", "concurrency": 1000
+    })
+    assert response.status_code == 200
+    assert response.get_json()["content"] == "merged"
+    assert calls == [inspection_routes.MAX_MAP_CONCURRENCY]
+
+
+@pytest.fixture
+def stored_snapshot(tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    with store.writer("https://example.com/repo", "a" * 40) as pending:
+        pending.file.write("")
+    monkeypatch.setattr(inspection_routes, "snapshot_store", store)
+    return pending.snapshot
+
+
+def failing_send_prompt(*args, **kwargs):
+    raise RuntimeError("model unavailable")
+
+
+def test_retrieval_model_errors_are_returned_as_json(client, stored_snapshot, monkeypatch):
+    monkeypatch.setattr(inspection_routes, "retrieve", lambda snapshot, question, top_k: SimpleNamespace(
+        index=[], text="", chunks=[], tokens=0, report=lambda: {}))
+    monkeypatch.setattr(inspection_routes, "sendPrompt", failing_send_prompt)
+
+    response = client.post("/repo_inspection/generate_analysis", json={
+        "model_name": "m", "question": "q", "snapshot_id": stored_snapshot.snapshot_id, "mode": "retrieval"
+    })
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "Failed to generate analysis: model unavailable"}
+
+
+def test_delta_model_errors_are_returned_as_json(client, stored_snapshot, monkeypatch):
+    store = inspection_routes.snapshot_store
+    with store.writer("https://example.com/repo", "b" * 40) as pending:
+        pending.file.write("")
+    monkeypatch.setattr(inspection_routes, "diff_snapshots", lambda since, snapshot: SimpleNamespace(
+        changed=1, old_commit="a" * 40, new_commit="b" * 40, summary=lambda: {}))
+    monkeypatch.setattr(inspection_routes, "pack_changes", lambda diff, since, snapshot, budget: SimpleNamespace(
+        text="", tokens=0, report=lambda: {}))
+    monkeypatch.setattr(inspection_routes, "sendPrompt", failing_send_prompt)
+
+    response = client.post("/repo_inspection/generate_analysis", json={
+        "model_name": "m", "question": "q", "snapshot_id": pending.snapshot.snapshot_id, "mode": "delta",
+        "since_snapshot_id": stored_snapshot.snapshot_id
+    })
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "Failed to generate analysis: model unavailable"}
+
+
+BACKEND_BODY = {"model_name": "m", "story_lang": "English", "description_content": "d"}
+
+
+def parse_events(body):
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+@pytest.mark.parametrize("path,headers", [
+    ("/image_to_code/generate/backend", {"Accept": "text/event-stream"}),
+    ("/image_to_code/generate/backend?stream=1", {}),
+])
+def test_generate_routes_stream_server_sent_events(client, monkeypatch, path, headers):
+    monkeypatch.setattr(sse, "streamPrompt", lambda prompt, model: iter(["Hello", " world"]))
+
+    response = client.post(path, json=BACKEND_BODY, headers=headers)
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = parse_events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ["meta", "chunk", "chunk", "done"]
+    assert "Create a complete Flask backend" in events[0][1]["prompt"]
+    assert [data["text"] for name, data in events if name == "chunk"] == ["Hello", " world"]
+
+
+def test_stream_failure_ends_with_an_error_event(client, monkeypatch):
+    def failing_stream(prompt, model):
+        yield "partial"
+        raise RuntimeError("model unavailable")
+    monkeypatch.setattr(sse, "streamPrompt", failing_stream)
+
+    response = client.post("/image_to_code/generate/backend", json=BACKEND_BODY,
+                           headers={"Accept": "text/event-stream"})
+
+    events = parse_events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ["meta", "chunk", "error"]
+    assert events[-1][1] == {"error": "model unavailable"}
+
+
+def test_generate_routes_still_answer_json_without_a_stream_request(client, monkeypatch):
+    monkeypatch.setattr(image_routes, "sendPrompt", lambda prompt, model: "backend code")
+
+    response = client.post("/image_to_code/generate/backend", json=BACKEND_BODY)
+
+    assert response.mimetype == "application/json"
+    assert response.get_json()["content"] == "backend code"
+
+
+class FakeCacheClient:
+    """Stands in for GeminiClient in the context-cache helpers and the cached analysis path."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.created = []
+        self.generated = []
+
+    def count_tokens(self, contents, model=None):
+        return TokenCount(prompt_tokens=self.tokens, completion_tokens=0, total_tokens=self.tokens)
+
+    def create_cache(self, **kwargs):
+        self.created.append(kwargs)
+        return SimpleNamespace(name="projects/p/locations/us-central1/cachedContents/c1")
+
+    def generate_content(self, contents, model, generation_config, count_tokens):
+        self.generated.append((contents, generation_config))
+        return "answer", TokenCount(prompt_tokens=10, completion_tokens=5, total_tokens=15, cached_tokens=9000)
+
+
+def test_small_codebases_are_not_cached():
+    client = FakeCacheClient(tokens=cache_routes.MIN_CACHE_TOKENS - 1)
+
+    cache, tokens = cache_routes.create_repo_cache(client, "https://example.com/repo", "m", "index", "code", 1)
+
+    assert cache is None
+    assert tokens == cache_routes.MIN_CACHE_TOKENS - 1
+    assert client.created == []
+
+
+def test_large_codebases_are_cached_with_the_requested_ttl():
+    client = FakeCacheClient(tokens=cache_routes.MIN_CACHE_TOKENS)
+
+    cache, _ = cache_routes.create_repo_cache(client, "https://example.com/repo", "m", "index", "code", 1.5)
+
+    assert cache.name.endswith("/cachedContents/c1")
+    (created,) = client.created
+    assert created["ttl_seconds"] == 5400
+    assert created["display_name"] == "https___example_com_repo"
+    assert created["system_instruction"] == cache_routes.CODE_ANALYZER_INSTRUCTION
+    assert "code" in created["contents"][0].parts[0].text
+
+
+def test_cached_analysis_sends_only_the_question(client, monkeypatch):
+    gemini = FakeCacheClient(tokens=0)
+    monkeypatch.setattr(cache_routes, "get_gemini_client", lambda: gemini)
+    monkeypatch.setattr(cache_routes, "save_analysis", lambda *args: None)
+    cache_name = "projects/p/locations/us-central1/cachedContents/c1"
+
+    response = client.post("/repo_cache_analysis/analyze", json={
+        "question": "What does it do?", "repo_url": "https://example.com/repo", "analysis_type": "summary",
+        "model_name": "m", "cache_name": cache_name, "cache_model": "publishers/google/models/m"
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["used_cache"] is True
+    assert body["usage"]["cached_tokens"] == 9000
+    ((contents, config),) = gemini.generated
+    assert config.cached_content == cache_name
+    prompt = contents[0].parts[0].text
+    assert "What does it do?" in prompt
+    assert "index of all the files" not in prompt
+
+
+def test_cache_built_for_another_model_is_not_used(client, monkeypatch):
+    monkeypatch.setattr(cache_routes, "get_gemini_client", lambda: FakeCacheClient(tokens=0))
+
+    response = client.post("/repo_cache_analysis/analyze", json={
+        "question": "q", "repo_url": "https://example.com/repo", "analysis_type": "summary",
+        "model_name": "m", "cache_name": "projects/p/locations/l/cachedContents/c1", "cache_model": "other"
+    })
+
+    # Without a usable cache the request needs a snapshot to send inline
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("method,path", [
+    ("get", "/repo_cache_analysis/jobs/missing"),
+    ("get", "/repo_cache_analysis/jobs/missing/events"),
+    ("post", "/repo_cache_analysis/jobs/missing/cancel"),
+])
+def test_unknown_jobs_are_404(client, method, path):
+    response = getattr(client, method)(path)
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Unknown job"}
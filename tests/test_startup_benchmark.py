@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+from benchmarks.startup_benchmark import compare, measure_imports, measure_startup, parse_importtime
+
+
+def test_parse_importtime_reads_real_interpreter_output():
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import json"],
+                            capture_output=True, text=True, check=True).stderr
+
+    rows = {row["module"]: row for row in parse_importtime(stderr)}
+
+    assert rows["json"]["depth"] == 0
+    assert rows["json.decoder"]["depth"] >= 1
+    assert rows["json"]["cumulative_us"] >= rows["json.decoder"]["cumulative_us"]
+    assert all(row["self_us"] >= 0 for row in rows.values())
+
+
+def test_measure_imports_reports_cost_and_failures(tmp_path):
+    results = measure_imports(["json", "no_such_module_here"], str(tmp_path), top=3)
+
+    assert results["json"]["cumulative_ms"] >= 0
+    assert len(results["json"]["heaviest"]) <= 3
+    assert "No module named" in results["no_such_module_here"]["error"]
+
+
+def test_measure_startup_runs_the_app_in_a_fresh_interpreter(tmp_path):
+    startup = measure_startup(1, str(tmp_path))
+
+    assert startup["runs"] == 1
+    assert startup["create_app_ms"]["median"] > 0
+    assert all(entry["status"] == 200 for entry in startup["first_request_ms"].values())
+    # Nothing heavy is imported before the first model call
+    assert startup["lazy_imports"]["loaded"] == {}
+
+
+def test_compare_prints_deltas_against_a_baseline():
+    def result(create_app_ms, import_ms, commit=None):
+        return {
+            "commit": commit,
+            "startup": {
+                "create_app_ms": {"median": create_app_ms},
+                "rss_mb": {"median": None},
+                "first_request_ms": {"index": {"path": "/", "median": 10.0}}
+            },
+            "imports": {"app": {"cumulative_ms": import_ms}}
+        }
+
+    lines = compare(result(50.0, 30.0), result(200.0, 120.0, commit="0123456789abcdef"))
+
+    assert lines == [
+        "Compared with 0123456789ab:",
+        "  create_app median: 200.0 -> 50.0 ms (-75%)",
+        "  import app: 120.0 -> 30.0 ms (-75%)",
+        "  first request /: 10.0 -> 10.0 ms (+0%)"
+    ]
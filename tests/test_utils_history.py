@@ -0,0 +1,55 @@
+import json
+import threading
+
+import utils.utils_history as utils_history
+from utils.utils_history import HistoryStore
+
+
+def write_history_files(directory, count):
+    directory.mkdir(exist_ok=True)
+    for i in range(count):
+        (directory / f"analysis_{i}.json").write_text(json.dumps({
+            "type": "summary", "repo_url": f"https://example.com/repo{i}",
+            "text": f"analysis {i}", "timestamp": f"20240101_00000{i}"
+        }))
+
+
+def test_import_is_idempotent_across_stores(tmp_path):
+    history_dir = tmp_path / "history"
+    write_history_files(history_dir, 3)
+    db_path = str(tmp_path / "history.sqlite")
+    first, second = HistoryStore(db_path), HistoryStore(db_path)
+    # Both stores see the database before either has marked the import done
+    results = []
+    threads = [threading.Thread(target=lambda s=s: results.append(s.import_json_dir(str(history_dir))))
+               for s in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(results) == 3
+    assert first.import_json_dir(str(history_dir)) == 0
+    assert len(first.query().entries) == 3
+    assert [entry["text"] for entry in first.query().entries] == ["analysis 2", "analysis 1", "analysis 0"]
+
+
+def test_import_skips_files_already_imported(tmp_path):
+    history_dir = tmp_path / "history"
+    write_history_files(history_dir, 2)
+    store = HistoryStore(str(tmp_path / "history.sqlite"))
+    assert store.import_json_dir(str(history_dir)) == 2
+    store._db.execute("DELETE FROM meta")
+    write_history_files(history_dir, 3)
+    assert store.import_json_dir(str(history_dir)) == 1
+    assert len(store.query().entries) == 3
+
+
+def test_store_is_created_on_first_use(tmp_path, monkeypatch):
+    db_path = tmp_path / "state" / "history.sqlite"
+    monkeypatch.setattr(utils_history, "HISTORY_DB_PATH", str(db_path))
+    monkeypatch.setattr(utils_history, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(utils_history, "_history_store", None)
+    assert not db_path.exists()
+    store = utils_history.get_history_store()
+    assert db_path.exists()
+    assert utils_history.get_history_store() is store
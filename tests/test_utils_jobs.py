@@ -0,0 +1,109 @@
+import contextvars
+import json
+import threading
+
+import pytest
+
+from utils.utils_jobs import JobQueue
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(workers=1)
+
+
+def wait_finished(job, timeout=5):
+    version = job.version
+    while not job.finished:
+        version = job.wait_for_change(version, timeout)
+    return job
+
+
+def test_job_publishes_progress_and_its_result(queue):
+    def work(job):
+        job.update(stage="cloning")
+        job.update(files_scanned=3)
+        return {"snapshot_id": "abc"}
+
+    job = wait_finished(queue.submit("process", work))
+
+    snapshot = job.to_dict()
+    assert snapshot["state"] == "done"
+    assert snapshot["progress"] == {"stage": "cloning", "files_scanned": 3}
+    assert snapshot["result"] == {"snapshot_id": "abc"}
+    assert snapshot["finished_at"] is not None
+    assert queue.get(job.job_id) is job
+
+
+def test_failed_job_keeps_its_error(queue):
+    def work(job):
+        raise ValueError("clone failed")
+
+    job = wait_finished(queue.submit("process", work))
+
+    assert job.state == "failed"
+    assert job.error == "clone failed"
+    assert job.to_dict()["result"] is None
+
+
+def test_running_job_stops_at_its_next_update(queue):
+    started = threading.Event()
+    release = threading.Event()
+
+    def work(job):
+        started.set()
+        release.wait(5)
+        job.update(stage="indexing")
+        raise AssertionError("kept running after cancel")
+
+    job = queue.submit("process", work)
+    started.wait(5)
+    assert job.cancel()
+    release.set()
+
+    assert wait_finished(job).state == "cancelled"
+    assert not job.cancel()
+
+
+def test_queued_job_is_cancelled_without_running(queue):
+    release = threading.Event()
+    blocker = queue.submit("process", lambda job: release.wait(5))
+    ran = []
+    job = queue.submit("process", lambda job: ran.append(True))
+
+    assert job.cancel()
+    assert job.state == "cancelled"
+    release.set()
+    wait_finished(blocker)
+    assert ran == []
+
+
+def test_jobs_run_in_the_submitting_context(queue):
+    label = contextvars.ContextVar("label", default=None)
+    label.set("route-a")
+
+    job = wait_finished(queue.submit("process", lambda job: label.get()))
+
+    assert job.result == "route-a"
+
+
+def test_events_stream_progress_then_the_final_state(queue):
+    release = threading.Event()
+
+    def work(job):
+        release.wait(5)
+        job.update(stage="indexing")
+        return "ok"
+
+    job = queue.submit("process", work)
+    events = queue.events(job, keepalive=0.05)
+    frames = [next(events)]
+    release.set()
+    frames.extend(events)
+
+    names = [frame.split("\n")[0] for frame in frames if not frame.startswith(":")]
+    assert names[-1] == "event: done"
+    assert set(names[:-1]) == {"event: progress"}
+    final = json.loads(frames[-1].split("data: ", 1)[1])
+    assert final["result"] == "ok"
+
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+from utils.utils_lazy import LazyImports
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("google.genai", "google.cloud.aiplatform", "git", "magika", "numpy")
+
+
+def test_creating_the_app_imports_no_heavy_dependency(tmp_path):
+    script = (
+        "import sys, app\n"
+        "app.create_app()\n"
+        f"print('imported:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": REPO_ROOT}, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    # The app may print configuration warnings first
+    assert result.stdout.splitlines()[-1] == "imported:"
+
+
+def test_lazy_module_imports_on_first_attribute_access():
+    registry = LazyImports()
+    colorsys = registry.module("colorsys")
+
+    assert "not loaded" in repr(colorsys)
+    assert registry.report() == {"loaded": {}, "pending": ["colorsys"]}
+
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert "(loaded)" in repr(colorsys)
+    assert list(registry.report()["loaded"]) == ["colorsys"]
+    assert registry.report()["pending"] == []
+
+
+def test_warm_up_loads_every_module_and_survives_failing_hooks():
+    registry = LazyImports()
+    registry.module("colorsys")
+    ran = []
+
+    def broken():
+        raise RuntimeError("model download failed")
+
+    registry.register_warm_up(broken)
+    registry.register_warm_up(lambda: ran.append(True))
+
+    registry.start_warm_up().join(10)
+
+    assert ran == [True]
+    assert list(registry.report()["loaded"]) == ["colorsys"]
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from utils.utils_map_reduce import map_reduce_analysis
+from utils.utils_packing import Shard, ShardPlan
+from utils.utils_vertex import ClientPool, GeminiClient, RegionRouter, SingleFlight
+
+
+class AsyncFakeModels:
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_content(self, model, contents, config):
+        self.prompts.append(contents[0].parts[0].text)
+        return SimpleNamespace(text="x" * 400, usage_metadata=None)
+
+
+class LoopRecordingPool(ClientPool):
+    """Records the event loop every async client is requested for."""
+
+    def __init__(self):
+        super().__init__()
+        self.models = AsyncFakeModels()
+        self.loops = []
+
+    def get(self, project_id, region, loop=None):
+        self.loops.append(loop)
+        return SimpleNamespace(aio=SimpleNamespace(models=self.models))
+
+
+def test_map_and_every_reduce_round_share_one_event_loop():
+    pool = LoopRecordingPool()
+    client = GeminiClient(project_id="test-project", pool=pool, router=RegionRouter(), flights=SingleFlight())
+    plan = ShardPlan(token_budget=1000, shards=[
+        Shard(number=i + 1, paths=[f"file{i}.py"], text=f"code {i}", tokens=10) for i in range(6)
+    ])
+
+    # Six 100-token notes against a 250-token budget need intermediate reduce rounds
+    result = map_reduce_analysis(client, "What does it do?", plan, "test-model", reduce_token_budget=250)
+
+    assert result.reduce_rounds >= 2
+    assert len(pool.models.prompts) > len(plan.shards) + 1
+    assert len(pool.loops) == len(pool.models.prompts)
+    assert None not in pool.loops
+    assert len(set(map(id, pool.loops))) == 1
@@ -0,0 +1,150 @@
+import difflib
+from types import SimpleNamespace
+
+import pytest
+
+from utils.utils_packing import (
+    GitIgnore, estimate_tokens, exclusion_reason, pack_changes, pack_files, shard_files
+)
+
+OLD_GITIGNORE = "dist/\n"
+NEW_GITIGNORE = "dist/\ngenerated_site/\n"
+
+
+def fake_snapshot(files):
+    return SimpleNamespace(
+        code_index=sorted(files),
+        read_files=lambda paths: [(path, files[path]) for path in paths if path in files]
+    )
+
+
+def test_pack_changes_reads_gitignore_rules_from_the_new_snapshot():
+    old = fake_snapshot({".gitignore": OLD_GITIGNORE, "docs/.gitignore": "*.tmp\n", "src/app.py": "a = 1\n"})
+    new = fake_snapshot({".gitignore": NEW_GITIGNORE, "docs/.gitignore": "*.tmp\n", "src/app.py": "a = 2\n",
+                         "generated_site/out.js": "bundle", "docs/notes.tmp": "scratch", "src/new.py": "b = 1\n"})
+    patches = {
+        ".gitignore": "".join(difflib.unified_diff(OLD_GITIGNORE.splitlines(True), NEW_GITIGNORE.splitlines(True),
+                                                   "a/.gitignore", "b/.gitignore")),
+        "generated_site/out.js": "bundle",
+        "docs/notes.tmp": "scratch",
+        "src/app.py": "-a = 1\n+a = 2\n",
+        "src/new.py": "b = 1\n"
+    }
+    diff = SimpleNamespace(added=["generated_site/out.js", "docs/notes.tmp", "src/new.py"], modified=[".gitignore", "src/app.py"],
+                           deleted=[], iter_patches=lambda old, new: sorted(patches.items()))
+
+    packed = pack_changes(diff, old, new)
+
+    assert {drop["path"]: drop["reason"] for drop in packed.dropped} == {
+        "generated_site/out.js": "gitignored", "docs/notes.tmp": "gitignored"
+    }
+    assert packed.included == [".gitignore", "src/app.py", "src/new.py"]
+
+
+@pytest.mark.parametrize("pattern,ignored,kept", [
+    ("/build/", ["build/x", "build/sub/y"], ["src/build/x", "build"]),
+    ("build/", ["build/x", "src/build/x"], ["build", "src/builder/x"]),
+    ("/build", ["build", "build/x"], ["src/build/x"]),
+    ("docs/*.tmp", ["docs/a.tmp"], ["src/docs/a.tmp", "docs/sub/a.tmp"]),
+])
+def test_gitignore_anchoring(pattern, ignored, kept):
+    gitignore = GitIgnore()
+    gitignore.add("", pattern + "\n")
+    assert [path for path in ignored if not gitignore.ignored(path)] == []
+    assert [path for path in kept if gitignore.ignored(path)] == []
+
+
+def test_gitignore_anchored_directory_in_a_subdirectory_gitignore():
+    gitignore = GitIgnore()
+    gitignore.add("web", "/dist/\n")
+    assert gitignore.ignored("web/dist/app.js")
+    assert not gitignore.ignored("web/src/dist/app.js")
+    assert not gitignore.ignored("dist/app.js")
+
+
+@pytest.mark.parametrize("path,reason", [
+    ("package-lock.json", "lockfile"),
+    ("web/node_modules/react/index.js", "vendored"),
+    ("static/app.min.js", "generated"),
+    ("proto/service_pb2.py", "generated"),
+    ("src/app.py", None),
+    ("distribution/notes.py", None),
+])
+def test_exclusion_reason(path, reason):
+    assert exclusion_reason(path) == reason
+
+
+def test_pack_files_keeps_the_most_relevant_files_within_budget():
+    body = "x = 1\n" * 40
+    files = [
+        ("tests/test_app.py", body),
+        ("src/core.py", body),
+        ("README.md", body),
+        ("yarn.lock", body),
+        ("main.py", body),
+        ("examples/demo.py", body),
+    ]
+    block_tokens = estimate_tokens(f"----- File: src/core.py -----\n{body}\n-------------------------\n")
+
+    packed = pack_files(files, token_budget=3 * block_tokens + 15)
+
+    # README, entry point and source beat tests and examples; output keeps the original order
+    assert packed.included == ["src/core.py", "README.md", "main.py"]
+    assert packed.text.index("src/core.py") < packed.text.index("README.md")
+    assert packed.tokens <= packed.token_budget
+    assert packed.over_budget_count == 2
+    assert {drop["path"]: drop["reason"] for drop in packed.dropped} == {
+        "yarn.lock": "lockfile", "tests/test_app.py": "over budget", "examples/demo.py": "over budget"
+    }
+
+
+@pytest.mark.parametrize("code_index", [None, [f"src/file_{i}.py" for i in range(2000)]])
+def test_pack_files_counts_the_listed_paths_against_the_budget(code_index):
+    files = [(f"src/module_{i}.py", "x = 1\n") for i in range(200)]
+
+    packed = pack_files(files, token_budget=1000, code_index=code_index)
+
+    assert packed.included
+    assert packed.index == packed.included
+    assert packed.tokens <= packed.token_budget
+
+
+def test_pack_files_lists_only_packed_files_when_the_index_is_too_big():
+    files = [(f"src/m{i}.py", "x = 1\n") for i in range(3)]
+    code_index = [f"src/file_{i}.py" for i in range(2000)]
+
+    small = pack_files(files, token_budget=100000, code_index=code_index)
+    tight = pack_files(files, token_budget=2000, code_index=code_index)
+
+    assert small.index == code_index
+    assert tight.index == tight.included == [path for path, _ in files]
+    assert tight.tokens <= tight.token_budget
+
+
+def test_shard_files_keeps_directories_together_within_the_budget():
+    body = "x = 1\n" * 30
+    files = [(f"{directory}/m{i}.py", body) for directory in ("api", "core", "web") for i in range(3)]
+    files.append(("node_modules/lib/index.js", body))
+    block_tokens = estimate_tokens(f"----- File: api/m0.py -----\n{body}\n-------------------------\n")
+
+    plan = shard_files(files, shard_token_budget=4 * block_tokens)
+
+    assert [shard.directories for shard in plan.shards] == [["api"], ["core"], ["web"]]
+    assert all(shard.tokens <= plan.token_budget for shard in plan.shards)
+    assert sorted(path for shard in plan.shards for path in shard.paths) == sorted(path for path, _ in files[:-1])
+    assert [(drop["path"], drop["reason"]) for drop in plan.dropped] == [("node_modules/lib/index.js", "vendored")]
+
+
+def test_shard_files_splits_a_file_larger_than_a_shard_at_line_breaks():
+    lines = [f"line_{i} = {i}\n" for i in range(400)]
+
+    plan = shard_files([("big.py", "".join(lines))], shard_token_budget=500)
+
+    assert len(plan.shards) > 1
+    assert all(shard.paths == ["big.py"] for shard in plan.shards)
+    assert all(shard.tokens <= 500 for shard in plan.shards)
+    count = len(plan.shards)
+    assert plan.shards[0].text.startswith(f"----- File: big.py (part 1/{count}) -----\nline_0 = 0\n")
+    rebuilt = "".join(shard.text.split(" -----\n", 1)[1].rsplit("\n-------------------------\n", 1)[0]
+                      for shard in plan.shards)
+    assert rebuilt == "".join(lines)
@@ -0,0 +1,427 @@
+import io
+import os
+import threading
+import time
+from pathlib import Path
+
+import git
+import pytest
+
+from utils.utils_repo import (
+    ClassificationCache, ClassificationStats, CloneManager, FileClassifier, SnapshotStore, WorkspaceManager,
+    diff_snapshots, extract_code, extract_tree, glob_filter
+)
+
+
+def test_constructors_touch_nothing_on_disk(tmp_path):
+    old_job = tmp_path / "workspaces" / "job-abandoned"
+    old_job.mkdir(parents=True)
+    os.utime(old_job, (0, 0))
+    cache = ClassificationCache(str(tmp_path / "cache" / "classifications.sqlite"))
+    clones = CloneManager(str(tmp_path / "mirrors"))
+    WorkspaceManager(str(tmp_path / "workspaces"), clones)
+    store = SnapshotStore(str(tmp_path / "snapshots"), quota_bytes=0)
+    assert sorted(os.listdir(tmp_path)) == ["workspaces"]
+    # Abandoned workspaces are only swept before the first checkout
+    assert old_job.exists()
+    assert store.collect() == []
+    assert store.latest("https://example.com/repo") is None
+    assert cache.path and not os.path.exists(cache.path)
+
+
+def test_classification_cache_opens_on_first_use(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "cache" / "classifications.sqlite"))
+    cache.put_many([("sha1", "code", "python"), ("sha2", "code", "oversized")])
+    assert os.path.exists(cache.path)
+    assert cache.get_many(["sha1", "sha2"]) == {"sha1": ("code", "python", None)}
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+def test_snapshot_store_creates_its_root_when_writing(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    with store.writer("https://example.com/repo", "a" * 40) as pending:
+        pending.file.write("code")
+    assert pending.snapshot is not None
+    assert store.latest("https://example.com/repo") == pending.snapshot.snapshot_id
+
+
+def write_tree(root, files):
+    for path, content in files.items():
+        full = root / path
+        full.parent.mkdir(parents=True, exist_ok=True)
+        full.write_bytes(content)
+
+
+def test_extract_code_streams_text_files_with_their_offsets(tmp_path):
+    write_tree(tmp_path, {
+        "main.py": b"print('h\xc3\xa9llo')\n",
+        "docs/README.md": b"# Title\n",
+        "logo.png": b"\x89PNG\r\n",
+        ".git/config": b"[core]\n",
+    })
+    out = io.StringIO()
+
+    stats = extract_code(str(tmp_path), out, classifier=FileClassifier())
+
+    assert sorted(stats.code_index) == ["docs/README.md", "logo.png", "main.py"]
+    assert stats.included_files == 2
+    assert not stats.truncated
+    assert "----- File: main.py -----\nprint('héllo')\n\n" in out.getvalue()
+    assert "logo.png -----" not in out.getvalue()
+    written = out.getvalue().encode("utf-8")
+    for path, offset, length in stats.files:
+        assert written[offset:offset + length] == (tmp_path / path).read_bytes()
+
+
+def test_extract_code_stops_reading_once_the_budget_is_spent(tmp_path):
+    write_tree(tmp_path, {f"m{i}.py": b"x = 1\n" * 10 for i in range(4)})
+    out = io.StringIO()
+
+    stats = extract_code(str(tmp_path), out, classifier=FileClassifier(), max_bytes=150)
+
+    # Every file stays in the index, but only the first two fit the budget
+    assert len(stats.code_index) == 4
+    assert stats.included_files == 2
+    assert stats.byte_count == 120
+    assert stats.truncated
+    assert stats.skipped_files == 2
+    assert out.getvalue().count("----- File:") == 2
+
+
+def test_extract_code_reports_progress_and_can_be_aborted(tmp_path):
+    write_tree(tmp_path, {f"m{i}.py": b"x = 1\n" for i in range(5)})
+    seen = []
+
+    def progress(stats):
+        seen.append(len(stats.code_index))
+        if len(seen) == 2:
+            raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        extract_code(str(tmp_path), io.StringIO(), classifier=FileClassifier(), progress=progress, progress_every=2)
+    assert seen == [2, 4]
+
+
+class RecordingClassifier(FileClassifier):
+    """Answers model lookups from the file name and records which batches ran on which threads."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def _identify_batch(self, paths):
+        time.sleep(0.01)
+        self.batches.append(([os.path.basename(p) for p in paths], threading.current_thread().name))
+        return [("code", os.path.basename(p)) for p in paths]
+
+
+def test_classify_batches_model_lookups_across_threads_and_keeps_order(tmp_path):
+    write_tree(tmp_path, {f"f{i}": b"data" for i in range(7)})
+    write_tree(tmp_path, {"a.py": b"x = 1\n", "b.png": b"\x89PNG", "empty": b""})
+    names = ["f0", "a.py", "f1", "f2", "b.png", "f3", "empty", "f4", "f5", "f6"]
+    files = [(str(tmp_path / name), (tmp_path / name).stat().st_size) for name in names]
+    classifier = RecordingClassifier(workers=4, batch_size=2)
+    stats = ClassificationStats()
+
+    results = classifier.classify(files, stats)
+
+    assert results[:6] == [("code", "f0"), ("code", "python"), ("code", "f1"), ("code", "f2"),
+                           ("image", "png"), ("code", "f3")]
+    assert results[6:] == [("inode", "empty"), ("code", "f4"), ("code", "f5"), ("code", "f6")]
+    assert sorted(len(batch) for batch, _ in classifier.batches) == [1, 2, 2, 2]
+    assert all(thread.startswith("magika") for _, thread in classifier.batches)
+    assert (stats.files, stats.prefiltered, stats.model) == (10, 3, 7)
+
+
+def test_classify_sends_unknown_and_suspicious_files_to_magika(tmp_path):
+    script = b"#!/usr/bin/env python\nimport os\n\nfor name in os.listdir('.'):\n    print(name)\n" * 3
+    write_tree(tmp_path, {"run": script, "fake.py": b"\x00\x01\x02" * 100})
+    files = [(str(tmp_path / name), (tmp_path / name).stat().st_size) for name in ("run", "fake.py")]
+    stats = ClassificationStats()
+
+    results = FileClassifier().classify(files, stats)
+
+    assert results[0] == ("code", "python")
+    # A NUL byte in a .py file means the extension cannot be trusted
+    assert results[1][0] not in ("code", "text")
+    assert stats.model == 2
+
+
+def commit_files(repo, files, message="update"):
+    """Write `files` into repo's worktree and commit them; returns the commit sha."""
+    write_tree(Path(repo.working_tree_dir), files)
+    repo.index.add(list(files))
+    actor = git.Actor("Test", "test@example.com")
+    return repo.index.commit(message, author=actor, committer=actor).hexsha
+
+
+def make_repo(path, files):
+    """Create a git repository at path with one commit of `files`; returns (repo, commit sha)."""
+    repo = git.Repo.init(path)
+    return repo, commit_files(repo, files, "initial")
+
+
+def test_classification_cache_answers_unchanged_blobs_without_magika(tmp_path):
+    make_repo(tmp_path / "repo", {f"f{i}": f"data {i}".encode() for i in range(3)})
+    cache = ClassificationCache(str(tmp_path / "classifications.sqlite"))
+    first = RecordingClassifier(cache=cache)
+    extract_code(str(tmp_path / "repo"), io.StringIO(), classifier=first)
+
+    second = RecordingClassifier(cache=cache)
+    stats = extract_code(str(tmp_path / "repo"), io.StringIO(), classifier=second)
+
+    assert len(first.batches) == 1
+    assert second.batches == []
+    assert stats.classification.cached == 3
+    assert stats.included_files == 3
+    assert cache.stats()["entries"] == 3
+    sha = git.Repo(tmp_path / "repo").git.rev_parse("HEAD:f0")
+    assert cache.get_many([sha]) == {sha: ("code", "f0", len("data 0"))}
+
+
+
+def test_clone_manager_keeps_a_shallow_bare_mirror_and_refreshes_it(tmp_path):
+    upstream, first = make_repo(tmp_path / "upstream", {"a.py": b"x = 1\n"})
+    second = commit_files(upstream, {"a.py": b"x = 2\n"})
+    url = (tmp_path / "upstream").as_uri()
+    clones = CloneManager(str(tmp_path / "mirrors"))
+
+    mirror, sha = clones.mirror(url)
+
+    assert sha == second
+    assert mirror.bare
+    assert mirror.git_dir == clones.mirror_path(url)
+    # Depth 1: the earlier commit was never transferred
+    assert mirror.git.rev_list("--count", "HEAD") == "1"
+
+    third = commit_files(upstream, {"b.py": b"y = 1\n"})
+    refreshed, sha = clones.mirror(url)
+    assert sha == third
+    assert refreshed.git_dir == mirror.git_dir
+    assert first not in refreshed.git.rev_list("--all")
+
+
+def test_clone_manager_checks_out_a_worktree_from_the_mirror(tmp_path):
+    _, sha = make_repo(tmp_path / "upstream", {"src/a.py": b"x = 1\n"})
+    clones = CloneManager(str(tmp_path / "mirrors"))
+    dest = tmp_path / "checkout"
+    dest.mkdir()
+    (dest / "stale.txt").write_text("left over")
+
+    assert clones.checkout((tmp_path / "upstream").as_uri(), str(dest)) == sha
+
+    assert (dest / "src" / "a.py").read_bytes() == b"x = 1\n"
+    assert not (dest / "stale.txt").exists()
+
+
+def test_clone_manager_reclones_a_broken_mirror(tmp_path):
+    _, sha = make_repo(tmp_path / "upstream", {"a.py": b"x = 1\n"})
+    url = (tmp_path / "upstream").as_uri()
+    clones = CloneManager(str(tmp_path / "mirrors"))
+    clones.mirror(url)
+    (Path(clones.mirror_path(url)) / "config").write_text("[remote \"origin\"]\n\turl = /nonexistent\n")
+
+    mirror, refreshed = clones.mirror(url)
+
+    assert refreshed == sha
+    assert mirror.remotes.origin.url == url
+
+
+def test_concurrent_workspaces_are_private_and_removed_afterwards(tmp_path):
+    _, sha = make_repo(tmp_path / "upstream", {"a.py": b"x = 1\n"})
+    url = (tmp_path / "upstream").as_uri()
+    workspaces = WorkspaceManager(str(tmp_path / "workspaces"), CloneManager(str(tmp_path / "mirrors")))
+    both_open = threading.Barrier(2, timeout=10)
+    seen = []
+
+    def ingest():
+        with workspaces.checkout(url) as workspace:
+            (Path(workspace.path) / "scratch").write_text(workspace.path)
+            both_open.wait()
+            seen.append((workspace.path, workspace.commit_sha, (Path(workspace.path) / "scratch").read_text()))
+
+    threads = [threading.Thread(target=ingest) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(seen) == 2
+    assert seen[0][0] != seen[1][0]
+    # Neither job saw the other's files
+    assert all(path == scratch and commit == sha for path, commit, scratch in seen)
+    assert os.listdir(tmp_path / "workspaces") == []
+    assert workspaces.active == 0
+
+
+def test_workspace_is_removed_when_the_job_fails(tmp_path):
+    make_repo(tmp_path / "upstream", {"a.py": b"x = 1\n"})
+    workspaces = WorkspaceManager(str(tmp_path / "workspaces"), CloneManager(str(tmp_path / "mirrors")))
+
+    with pytest.raises(RuntimeError):
+        with workspaces.checkout((tmp_path / "upstream").as_uri()):
+            raise RuntimeError("extraction failed")
+
+    assert os.listdir(tmp_path / "workspaces") == []
+
+
+def test_first_checkout_sweeps_only_abandoned_workspaces(tmp_path):
+    make_repo(tmp_path / "upstream", {"a.py": b"x = 1\n"})
+    root = tmp_path / "workspaces"
+    abandoned, recent, unrelated = root / "job-old", root / "job-new", root / "keep"
+    for path in (abandoned, recent, unrelated):
+        path.mkdir(parents=True)
+    os.utime(abandoned, (0, 0))
+    os.utime(unrelated, (0, 0))
+    workspaces = WorkspaceManager(str(root), CloneManager(str(tmp_path / "mirrors")), max_age=3600)
+
+    with workspaces.checkout((tmp_path / "upstream").as_uri()):
+        pass
+
+    assert sorted(os.listdir(root)) == ["job-new", "keep"]
+
+
+TREE = {
+    "README.md": b"# Demo\n",
+    "src/app.py": "print('h\u00e9llo')\n".encode(),
+    "src/empty.py": b"",
+    "assets/logo.png": b"\x89PNG\r\n",
+    "docs/guide.md": b"Guide\n" * 50,
+}
+
+
+
+def file_texts(out, stats):
+    """Map each included path to the bytes extract_code/extract_tree wrote for it."""
+    written = out.getvalue().encode("utf-8")
+    return {path: written[offset:offset + length] for path, offset, length in stats.files}
+
+
+def test_extract_tree_matches_extract_code_on_a_checkout(tmp_path):
+    repo, sha = make_repo(tmp_path / "repo", TREE)
+    from_checkout, from_tree = io.StringIO(), io.StringIO()
+
+    checkout_stats = extract_code(str(tmp_path / "repo"), from_checkout, classifier=FileClassifier())
+    tree_stats = extract_tree(repo, sha, from_tree, classifier=FileClassifier())
+
+    assert file_texts(from_tree, tree_stats) == file_texts(from_checkout, checkout_stats)
+    assert sorted(file_texts(from_tree, tree_stats)) == ["README.md", "docs/guide.md", "src/app.py"]
+    assert sorted(tree_stats.code_index) == sorted(checkout_stats.code_index)
+    assert tree_stats.byte_count == checkout_stats.byte_count
+    assert tree_stats.blob_shas["src/app.py"] == repo.git.rev_parse(f"{sha}:src/app.py")
+
+
+def test_extract_tree_reads_a_bare_mirror_without_a_worktree(tmp_path):
+    make_repo(tmp_path / "upstream", TREE)
+    mirror, sha = CloneManager(str(tmp_path / "mirrors")).mirror((tmp_path / "upstream").as_uri())
+    out = io.StringIO()
+
+    stats = extract_tree(mirror, sha, out, classifier=FileClassifier(), path_filter=glob_filter(["src/"]))
+
+    assert mirror.bare
+    assert sorted(stats.code_index) == ["src/app.py", "src/empty.py"]
+    assert file_texts(out, stats) == {"src/app.py": TREE["src/app.py"]}
+
+
+def test_extract_tree_never_reads_blobs_settled_by_name(tmp_path, monkeypatch):
+    repo, sha = make_repo(tmp_path / "repo", TREE)
+    read = []
+    get_object_data = git.Git.get_object_data
+    monkeypatch.setattr(git.Git, "get_object_data", lambda self, ref: read.append(ref) or get_object_data(self, ref))
+
+    extract_tree(repo, sha, io.StringIO(), classifier=FileClassifier())
+
+    # The empty file and the PNG are classified from their size and extension alone
+    assert sorted(read) == sorted(repo.git.rev_parse(f"{sha}:{path}")
+                                  for path in ("README.md", "src/app.py", "docs/guide.md"))
+
+
+def snapshot_commit(store, repo, sha, base=None):
+    with store.writer("https://example.com/repo", sha) as pending:
+        pending.stats = extract_tree(repo, sha, pending.file, classifier=FileClassifier(), base=base)
+    return pending.snapshot
+
+
+def test_incremental_extraction_reads_only_changed_blobs(tmp_path, monkeypatch):
+    repo, first = make_repo(tmp_path / "repo", TREE)
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    base = snapshot_commit(store, repo, first)
+    repo.index.remove(["docs/guide.md"], working_tree=True)
+    second = commit_files(repo, {"src/app.py": b"print('changed')\n", "src/new.py": b"y = 2\n"})
+    read = []
+    get_object_data = git.Git.get_object_data
+    monkeypatch.setattr(git.Git, "get_object_data", lambda self, ref: read.append(ref) or get_object_data(self, ref))
+
+    snapshot = snapshot_commit(store, repo, second, base=base)
+
+    assert sorted(read) == sorted(repo.git.rev_parse(f"{second}:{path}") for path in ("src/app.py", "src/new.py"))
+    assert snapshot.changes == {
+        "base_snapshot_id": base.snapshot_id, "base_commit": first,
+        "added": ["src/new.py"], "modified": ["src/app.py"], "deleted": ["docs/guide.md"]
+    }
+    assert snapshot.reused_files == 1
+    # The result is the same as a full extraction of the new commit
+    monkeypatch.undo()
+    full = io.StringIO()
+    extract_tree(repo, second, full, classifier=FileClassifier())
+    assert snapshot.read_text() == full.getvalue()
+
+
+def test_diff_snapshots_uses_the_recorded_changes(tmp_path):
+    repo, first = make_repo(tmp_path / "repo", TREE)
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    base = snapshot_commit(store, repo, first)
+    second = commit_files(repo, {"README.md": b"# Demo v2\n"})
+    snapshot = snapshot_commit(store, repo, second, base=base)
+
+    diff = diff_snapshots(base, snapshot)
+
+    assert (diff.added, diff.modified, diff.deleted) == ([], ["README.md"], [])
+    assert diff.changed_bytes == len(b"# Demo v2\n")
+    ((path, patch),) = diff.iter_patches(base, snapshot)
+    assert path == "README.md"
+    assert "-# Demo\n+# Demo v2\n" in patch
+    # Snapshots taken independently are compared by blob SHA and give the same answer
+    fresh = SnapshotStore(str(tmp_path / "fresh"))
+    independent = diff_snapshots(snapshot_commit(fresh, repo, first), snapshot_commit(fresh, repo, second))
+    assert independent.modified == ["README.md"]
+
+
+def test_snapshot_reads_files_back_from_a_reopened_store(tmp_path):
+    make_repo(tmp_path / "repo", TREE)
+    with SnapshotStore(str(tmp_path / "snapshots")).writer("https://example.com/repo", "a" * 40) as pending:
+        pending.stats = extract_code(str(tmp_path / "repo"), pending.file, classifier=FileClassifier())
+
+    # A new store (e.g. another worker process) finds the snapshot on disk
+    snapshot = SnapshotStore(str(tmp_path / "snapshots")).find("https://example.com/repo", "a" * 40)
+
+    assert dict(snapshot.iter_files())["src/app.py"] == TREE["src/app.py"].decode()
+    assert dict(snapshot.read_files(["README.md"])) == {"README.md": "# Demo\n"}
+    assert snapshot.file_bytes("assets/logo.png") is None
+    assert snapshot.summary()["file_count"] == len(TREE)
+    assert "code_text" not in snapshot.summary()
+
+
+def test_snapshot_store_rejects_ids_that_are_not_its_own():
+    store = SnapshotStore("/nonexistent")
+    for snapshot_id in ("", "../etc", "ABC", "a/b"):
+        assert store.get(snapshot_id) is None
+
+
+def test_collection_deletes_least_recently_used_snapshots_but_not_held_ones(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    ids = []
+    for i, commit in enumerate(("a", "b", "c")):
+        with store.writer("https://example.com/repo", commit * 40) as pending:
+            pending.file.write("x" * 1000)
+        ids.append(pending.snapshot.snapshot_id)
+        os.utime(os.path.join(pending.snapshot.path, "meta.json"), (i, i))
+    store.quota_bytes = store.disk_usage() - 1
+
+    with store.use(ids[0]):
+        removed = store.collect()
+
+    # The oldest snapshot is in use, so the next oldest goes instead
+    assert removed == [ids[1]]
+    assert store.get(ids[1]) is None
+    assert store.get(ids[0]) is not None and store.get(ids[2]) is not None
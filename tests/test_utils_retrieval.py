@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from utils.utils_retrieval import (
+    Embedder, EmbeddingIndex, HashingEmbedder, chunk_text, ensure_index, retrieve
+)
+
+
+class FakeSnapshot:
+    """The parts of utils_repo.Snapshot that retrieval uses, over an in-memory file map."""
+
+    def __init__(self, snapshot_id, path, files, changes=None):
+        self.snapshot_id = snapshot_id
+        self.path = str(path)
+        self.files = files
+        self.changes = changes
+        path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def code_index(self):
+        return sorted(self.files)
+
+    def included_paths(self):
+        return set(self.files)
+
+    def iter_files(self):
+        return list(self.files.items())
+
+    def read_files(self, paths):
+        return [(path, text) for path, text in self.files.items() if path in set(paths)]
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dimension=256)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(text.split("\n", 1)[0] for text in texts)
+        return super().embed_documents(texts)
+
+
+FILES = {
+    "src/clone_manager.py": "class CloneManager:\n    def mirror(self, repo_url):\n        return fetch(repo_url)\n",
+    "src/history.py": "class HistoryStore:\n    def query(self, search):\n        return sqlite_search(search)\n",
+    "src/packing.py": "def pack_files(files, token_budget):\n    return greedy(files, token_budget)\n",
+}
+
+
+def test_embedder_is_abstract():
+    with pytest.raises(TypeError):
+        Embedder()
+
+    class Incomplete(Embedder):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_chunk_text_splits_on_whole_lines_and_cuts_long_lines():
+    text = "".join(f"line {i}\n" for i in range(1, 11)) + "x" * 25 + "\nlast\n"
+    chunks = chunk_text("a.py", text, max_chars=20)
+
+    # Chunks tile the text without gaps or overlaps
+    assert chunks[0].start == 0 and chunks[-1].end == len(text)
+    assert all(prev.end == nxt.start for prev, nxt in zip(chunks, chunks[1:]))
+    assert all(chunk.end - chunk.start <= 20 for chunk in chunks)
+    assert (chunks[0].start_line, chunks[0].end_line) == (1, 2)
+    long_line = [chunk for chunk in chunks if chunk.start_line == 11]
+    assert len(long_line) == 2 and all(chunk.end_line == 11 for chunk in long_line)
+    assert chunks[-1].start_line == chunks[-1].end_line == 12
+
+
+def test_index_save_and_load_round_trip(tmp_path):
+    index = EmbeddingIndex.build(FILES.items(), HashingEmbedder(dimension=64), max_chars=40)
+    index.save(str(tmp_path))
+
+    loaded = EmbeddingIndex.load(str(tmp_path))
+    assert loaded.embedder_name == "hashing-64"
+    assert loaded.chunks == index.chunks
+    np.testing.assert_array_equal(np.asarray(loaded.vectors), index.vectors)
+    assert EmbeddingIndex.load(str(tmp_path / "missing")) is None
+
+
+def test_ensure_index_patches_the_base_index_for_an_incremental_snapshot(tmp_path):
+    embedder = CountingEmbedder()
+    base = FakeSnapshot("base", tmp_path / "base", FILES)
+    base_index = ensure_index(base, embedder)
+    embedder.embedded.clear()
+
+    files = dict(FILES)
+    files["src/history.py"] = "class HistoryStore:\n    def prune(self):\n        return delete_old_rows()\n"
+    files["src/retrieval.py"] = "def retrieve(snapshot, question):\n    return search(question)\n"
+    del files["src/packing.py"]
+    snapshot = FakeSnapshot("new", tmp_path / "new", files, changes={
+        "base_snapshot_id": "base", "added": ["src/retrieval.py"],
+        "modified": ["src/history.py"], "deleted": ["src/packing.py"]
+    })
+
+    index = ensure_index(snapshot, embedder, base=base)
+
+    # Only the added and modified files were embedded again
+    assert sorted(embedder.embedded) == ["src/history.py", "src/retrieval.py"]
+    assert sorted({chunk.path for chunk in index.chunks}) == sorted(files)
+    kept = [i for i, chunk in enumerate(base_index.chunks) if chunk.path == "src/clone_manager.py"]
+    np.testing.assert_array_equal(np.asarray(index.vectors[:len(kept)]), np.asarray(base_index.vectors[kept]))
+    # Same chunks and vectors as building from scratch, and persisted
+    full = EmbeddingIndex.build(files.items(), HashingEmbedder(dimension=256))
+    assert sorted(index.chunks, key=lambda c: (c.path, c.start)) == sorted(full.chunks, key=lambda c: (c.path, c.start))
+    assert EmbeddingIndex.load(snapshot.path).chunks == index.chunks
+
+
+def test_retrieve_ranks_the_relevant_file_first(tmp_path):
+    snapshot = FakeSnapshot("snap", tmp_path / "snap", FILES)
+
+    result = retrieve(snapshot, "How does the clone manager mirror a repository?", top_k=3,
+                      embedder=HashingEmbedder(dimension=256))
+
+    best = max(result.chunks, key=lambda chunk: chunk["score"])
+    assert best["path"] == "src/clone_manager.py"
+    assert "----- File: src/clone_manager.py (lines 1-3) -----" in result.text
+    assert result.index == sorted(FILES)
+
+    result = retrieve(snapshot, "clone manager", top_k=1, embedder=HashingEmbedder(dimension=256))
+    assert [chunk["path"] for chunk in result.chunks] == ["src/clone_manager.py"]
@@ -0,0 +1,664 @@
+import json
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors as genai_errors
+from google.genai import types
+
+from utils.utils_vertex import (
+    ClientPool, GeminiClient, HedgePolicy, RegionRouter, ResponseCache, SingleFlight, is_region_failure
+)
+
+
+class FakeModels:
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+        self.configs = []
+
+    def generate_content(self, model, contents, config):
+        self.calls.append(model)
+        self.configs.append(config)
+        return self.handler()
+
+
+class FakePool(ClientPool):
+    """Hands out fake genai clients that all share one generate_content handler."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.models = FakeModels(handler)
+        self.regions = []
+
+    def _create_client(self, project_id, region):
+        self.regions.append(region)
+        return SimpleNamespace(models=self.models)
+
+    def get(self, project_id, region, loop=None):
+        self.regions.append(region)
+        return SimpleNamespace(models=self.models)
+
+
+def api_error(code, status):
+    return genai_errors.APIError(code, {"error": {"code": code, "message": status, "status": status}})
+
+
+def make_client(handler, cache=None):
+    return GeminiClient(project_id="test-project", pool=FakePool(handler), router=RegionRouter(),
+                        cache=cache, flights=SingleFlight())
+
+
+def user_contents(text="question"):
+    return [types.Content(role="user", parts=[types.Part(text=text)])]
+
+
+# --- Client pool ---
+
+class CountingPool(ClientPool):
+    """Builds a fresh marker object per client and remembers which ones were closed."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.created = []
+        self.closed = []
+
+    def _create_client(self, project_id, region):
+        client = SimpleNamespace(region=region, close=lambda: self.closed.append(client))
+        self.created.append(client)
+        return client
+
+
+def test_client_pool_reuses_one_client_per_project_and_region():
+    pool = CountingPool()
+
+    first = pool.get("p", "us-central1")
+    assert pool.get("p", "us-central1") is first
+    assert pool.get("p", "europe-west4") is not first
+    assert pool.get("other", "us-central1") is not first
+    assert len(pool.created) == 3
+
+
+def test_client_pool_rebuilds_unhealthy_clients():
+    pool = CountingPool()
+    first = pool.get("p", "us-central1")
+
+    pool.mark_unhealthy("p", "us-central1")
+    second = pool.get("p", "us-central1")
+
+    assert second is not first
+    assert pool.closed == [first]
+    assert pool.get("p", "us-central1") is second
+
+
+def test_client_pool_evicts_idle_clients():
+    pool = CountingPool(idle_timeout=0.01)
+    first = pool.get("p", "us-central1")
+    time.sleep(0.02)
+
+    assert pool.get("p", "us-central1") is not first
+    assert pool.closed == [first]
+
+
+def test_client_pool_keys_async_clients_by_event_loop():
+    pool = CountingPool()
+    loop = asyncio.new_event_loop()
+    try:
+        sync_client = pool.get("p", "us-central1")
+        loop_client = pool.get("p", "us-central1", loop=loop)
+        assert loop_client is not sync_client
+        assert pool.get("p", "us-central1", loop=loop) is loop_client
+    finally:
+        loop.close()
+
+    # A closed loop's client is dropped rather than handed to another loop
+    assert pool.get("p", "us-central1", loop=loop) is not loop_client
+    assert loop_client in pool.closed
+    assert pool.get("p", "us-central1") is sync_client
+
+
+def test_client_pool_close_all_closes_every_client():
+    pool = CountingPool()
+    clients = [pool.get("p", region) for region in ("r1", "r2")]
+
+    pool.close_all()
+
+    assert pool.closed == clients
+    assert pool.stats() == []
+
+
+# --- Response cache ---
+
+@pytest.mark.parametrize("path", [None, "disk"])
+def test_response_cache_hits_are_independent_copies(tmp_path, path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite") if path else None)
+    cache.set("key", {"result": {"a": [1, 2]}, "tokens": None})
+
+    hit, first = cache.get("key")
+    assert hit
+    first["result"]["a"].append(99)
+
+    hit, second = cache.get("key")
+    assert hit
+    assert second == {"result": {"a": [1, 2]}, "tokens": None}
+
+
+def test_response_cache_disk_hit_promoted_to_memory_is_a_copy(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path=path).set("key", {"a": [1, 2]})
+
+    cache = ResponseCache(path=path)
+    hit, first = cache.get("key")
+    first["a"].append(99)
+    hit, second = cache.get("key")
+    assert cache.memory_hits == 1
+    assert second == {"a": [1, 2]}
+
+
+def test_generate_content_cached_json_result_cannot_be_mutated_by_caller():
+    client = make_client(lambda: SimpleNamespace(text='{"a": [1, 2]}', usage_metadata=None),
+                         cache=ResponseCache())
+    config = types.GenerateContentConfig(temperature=0)
+
+    first = client.generate_content(user_contents(), generation_config=config, model="m", return_json=True)
+    first["a"].append(99)
+    second = client.generate_content(user_contents(), generation_config=config, model="m", return_json=True)
+
+    assert second == {"a": [1, 2]}
+    assert len(client.pool.models.calls) == 1
+
+
+def test_single_flight_gives_leader_and_waiters_separate_copies():
+    flights = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def slow():
+        release.wait(5)
+        return {"a": [1, 2]}
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", slow))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()["coalesced"] < 2:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    results[0]["a"].append(99)
+    assert [r for r in results[1:]] == [{"a": [1, 2]}, {"a": [1, 2]}]
+    assert len({id(r) for r in results}) == 3
+
+
+def test_single_flight_async_copies_per_caller():
+    flights = SingleFlight()
+
+    async def main():
+        async def slow():
+            await asyncio.sleep(0.05)
+            return {"a": [1]}
+        return await asyncio.gather(*(flights.do_async("k", slow) for _ in range(3)))
+
+    results = asyncio.run(main())
+    results[0]["a"].append(99)
+    assert results[1] == results[2] == {"a": [1]}
+
+
+def run_concurrently(client, count, **kwargs):
+    """Start `count` threads that each call generate_content; returns (threads, results, errors)."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(client.generate_content(user_contents(), model="m", **kwargs))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_identical_concurrent_prompts_share_one_upstream_call():
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return SimpleNamespace(text="ok", usage_metadata=None)
+    client = make_client(slow)
+
+    threads, results, errors = run_concurrently(client, 3)
+    while client.flights.stats()["coalesced"] < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["ok"] * 3 and errors == []
+    assert len(client.pool.models.calls) == 1
+    assert client.get_single_flight_stats() == {"leaders": 1, "coalesced": 2, "in_flight": 0}
+
+
+def test_coalesced_callers_share_the_leaders_error_and_later_calls_start_afresh():
+    release = threading.Event()
+    outcomes = iter([api_error(400, "INVALID_ARGUMENT"), SimpleNamespace(text="ok", usage_metadata=None)])
+
+    def handler():
+        release.wait(5)
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    client = make_client(handler)
+
+    threads, results, errors = run_concurrently(client, 2)
+    while client.flights.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [] and [e.code for e in errors] == [400, 400]
+    assert client.generate_content(user_contents(), model="m") == "ok"
+
+
+def test_joined_stream_replays_every_chunk_from_the_start():
+    flights = SingleFlight()
+    pulled = []
+
+    def source():
+        for chunk in ("a", "b", "c"):
+            pulled.append(chunk)
+            yield chunk
+
+    first = flights.stream("k", source)
+    assert next(first) == "a"
+    second = flights.stream("k", lambda: iter(["never used"]))
+
+    assert list(second) == ["a", "b", "c"]
+    assert list(first) == ["b", "c"]
+    assert pulled == ["a", "b", "c"]
+    assert flights.stats() == {"leaders": 1, "coalesced": 1, "in_flight": 0}
+
+
+# --- Region router ---
+
+def test_is_region_failure_classification():
+    assert is_region_failure(api_error(429, "RESOURCE_EXHAUSTED"))
+    assert is_region_failure(api_error(503, "UNAVAILABLE"))
+    assert is_region_failure(TimeoutError())
+    assert is_region_failure(ConnectionError())
+    assert not is_region_failure(api_error(400, "INVALID_ARGUMENT"))
+    assert not is_region_failure(api_error(403, "PERMISSION_DENIED"))
+    assert not is_region_failure(ValueError("bad input"))
+
+
+def test_caller_errors_do_not_trip_the_circuit_breaker():
+    router = RegionRouter(failure_threshold=3, cooldown=30)
+    for _ in range(10):
+        router.record_failure("r1", api_error(400, "INVALID_ARGUMENT"))
+    assert router.ordered_regions(["r1", "r2"]) == ["r1", "r2"]
+    assert router.scores()["r1"]["failures"] == 0
+    assert not router.scores()["r1"]["circuit_open"]
+
+
+def test_region_failures_open_the_circuit():
+    router = RegionRouter(failure_threshold=3, cooldown=30)
+    for _ in range(3):
+        router.record_failure("r1", api_error(503, "UNAVAILABLE"))
+    assert router.ordered_regions(["r1", "r2"]) == ["r2"]
+    assert router.scores()["r1"]["circuit_open"]
+
+
+def open_then_cool_down(router, *regions):
+    """Trip the breaker of each region, then let its cooldown expire so it is half-open."""
+    for region in regions:
+        for _ in range(router.failure_threshold):
+            router.record_failure(region, api_error(503, "UNAVAILABLE"))
+        router._stats[region].open_until = 0.0
+
+
+def test_half_open_allows_one_probe_and_reopens_on_failure():
+    router = RegionRouter(failure_threshold=2, cooldown=30)
+    open_then_cool_down(router, "r1")
+
+    assert "r1" in router.ordered_regions(["r1", "r2"])
+    assert router.begin_attempt("r1")
+    # The probe is in flight: nobody else gets the region
+    assert not router.begin_attempt("r1")
+    assert router.ordered_regions(["r1", "r2"]) == ["r2"]
+    assert router.scores()["r1"]["half_open"]
+
+    router.record_failure("r1", api_error(503, "UNAVAILABLE"))
+    assert router.ordered_regions(["r1", "r2"]) == ["r2"]
+    assert router.scores()["r1"]["circuit_open"]
+
+
+def test_half_open_probe_success_closes_the_circuit():
+    router = RegionRouter(failure_threshold=2, cooldown=30)
+    open_then_cool_down(router, "r1")
+
+    assert router.begin_attempt("r1")
+    router.record_success("r1", 0.1)
+    assert router.begin_attempt("r1") and router.begin_attempt("r1")
+    assert "r1" in router.ordered_regions(["r1", "r2"])
+    assert not router.scores()["r1"]["half_open"]
+
+
+def test_listing_half_open_regions_does_not_claim_their_probe():
+    router = RegionRouter(failure_threshold=2, cooldown=30)
+    open_then_cool_down(router, "r1", "r2")
+
+    # Callers usually only attempt the first region they are given
+    for _ in range(3):
+        assert router.ordered_regions(["r1", "r2"]) == ["r1", "r2"]
+    assert router.begin_attempt("r1")
+    router.record_success("r1", 0.1)
+    assert "r2" in router.ordered_regions(["r1", "r2"])
+    assert router.begin_attempt("r2")
+
+
+def test_probe_ending_in_a_caller_error_frees_the_region():
+    router = RegionRouter(failure_threshold=2, cooldown=30)
+    open_then_cool_down(router, "r1")
+
+    assert router.begin_attempt("r1")
+    router.record_failure("r1", api_error(400, "INVALID_ARGUMENT"))
+    # The region's health is unknown still, so the next caller gets the probe
+    assert "r1" in router.ordered_regions(["r1", "r2"])
+    assert router.begin_attempt("r1")
+
+
+def test_generate_only_probes_the_half_open_region_it_attempts():
+    client = make_client(lambda: SimpleNamespace(text="ok", usage_metadata=None))
+    client.regions = ["r1", "r2"]
+    open_then_cool_down(client.router, "r1", "r2")
+
+    assert client.generate_content(user_contents(), model="m", coalesce=False) == "ok"
+    assert client.pool.regions == ["r1"]
+    # r2 was listed but never attempted: its probe is still free
+    assert client.router.begin_attempt("r2")
+    assert not client.router.scores()["r1"]["half_open"]
+
+
+def test_generate_skips_a_half_open_region_whose_probe_is_taken():
+    client = make_client(lambda: SimpleNamespace(text="ok", usage_metadata=None))
+    client.regions = ["r1", "r2"]
+    open_then_cool_down(client.router, "r1")
+    assert client.router.begin_attempt("r1")
+
+    assert client.generate_content(user_contents(), model="m", coalesce=False) == "ok"
+    assert client.pool.regions == ["r2"]
+
+
+def test_malformed_request_fails_fast_without_touching_region_health():
+    def reject():
+        raise api_error(400, "INVALID_ARGUMENT")
+    client = make_client(reject)
+
+    with pytest.raises(genai_errors.APIError) as error:
+        client.generate_content(user_contents(), model="m")
+
+    assert error.value.code == 400
+    # One attempt in one region: no fallback to other regions and no tenacity retries
+    assert len(client.pool.models.calls) == 1
+    assert not any(stats["circuit_open"] or stats["failures"] for stats in client.router.scores().values())
+
+
+# --- Hedging ---
+
+class RegionalPool(ClientPool):
+    """Hands out fake genai clients that answer with a per-region handler."""
+
+    def __init__(self, handlers):
+        super().__init__()
+        self.handlers = handlers
+        self.calls = []
+
+    def get(self, project_id, region, loop=None):
+        def generate_content(model, contents, config):
+            self.calls.append(region)
+            return self.handlers[region]()
+        return SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+
+
+def make_hedging_client(handlers, burst=1.0):
+    hedging = HedgePolicy(min_samples=1, min_delay=0.05, burst=burst)
+    # One fast sample makes the hedge delay its 0.05s floor
+    hedging.observe("m", 0.01)
+    client = GeminiClient(project_id="test-project", pool=RegionalPool(handlers), router=RegionRouter(),
+                          hedging=hedging, flights=SingleFlight())
+    client.regions = list(handlers)
+    return client
+
+
+def answer(text, after=None):
+    def handler():
+        if after is not None:
+            after.wait(2)
+        return SimpleNamespace(text=text, usage_metadata=None)
+    return handler
+
+
+def test_hedge_delay_tracks_the_latency_tail():
+    policy = HedgePolicy(percentile=0.9, min_samples=10, min_delay=0.25)
+    for latency in range(1, 10):
+        policy.observe("m", float(latency))
+    assert policy.hedge_delay("m") is None
+
+    policy.observe("m", 10.0)
+    assert policy.hedge_delay("m") == 10.0
+    assert policy.hedge_delay("other") is None
+
+    fast = HedgePolicy(min_samples=1, min_delay=0.25)
+    fast.observe("m", 0.01)
+    assert fast.hedge_delay("m") == 0.25
+
+
+def test_hedge_budget_earns_tokens_per_request():
+    policy = HedgePolicy(max_hedge_ratio=0.5, burst=1.0)
+
+    assert policy.try_acquire()
+    assert not policy.try_acquire()
+    policy.record_request()
+    assert not policy.try_acquire()
+    policy.record_request()
+    assert policy.try_acquire()
+    assert policy.stats()["hedges_fired"] == 2
+    assert policy.stats()["hedges_suppressed"] == 2
+
+
+def test_slow_primary_is_hedged_to_the_secondary_region():
+    release = threading.Event()
+    client = make_hedging_client({"r1": answer("slow", after=release), "r2": answer("fast")})
+    try:
+        result = client.generate_content(user_contents(), model="m", hedge=True, coalesce=False)
+    finally:
+        release.set()
+
+    assert result == "fast"
+    assert client.pool.calls == ["r1", "r2"]
+    assert client.get_hedge_stats()["hedges_won"] == 1
+
+
+def test_hedge_is_not_sent_without_budget():
+    release = threading.Event()
+    threading.Timer(0.2, release.set).start()
+    client = make_hedging_client({"r1": answer("slow", after=release), "r2": answer("fast")}, burst=0.0)
+
+    result = client.generate_content(user_contents(), model="m", hedge=True, coalesce=False)
+
+    assert result == "slow"
+    assert client.pool.calls == ["r1"]
+    assert client.get_hedge_stats()["hedges_suppressed"] == 1
+
+
+def test_primary_region_failure_before_the_hedge_delay_falls_back():
+    def unavailable():
+        raise api_error(503, "UNAVAILABLE")
+    client = make_hedging_client({"r1": unavailable, "r2": answer("fallback")})
+
+    result = client.generate_content(user_contents(), model="m", hedge=True, coalesce=False)
+
+    assert result == "fallback"
+    assert client.pool.calls == ["r1", "r2"]
+    assert client.get_hedge_stats()["hedges_fired"] == 0
+
+
+# --- Async generation ---
+
+class AsyncRegionalPool(ClientPool):
+    """Hands out fake genai clients whose `aio` surface awaits a per-region coroutine."""
+
+    def __init__(self, handlers):
+        super().__init__()
+        self.handlers = handlers
+        self.calls = []
+
+    def get(self, project_id, region, loop=None):
+        async def generate_content(model, contents, config):
+            self.calls.append((region, loop, threading.get_ident()))
+            return await self.handlers[region]()
+        return SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=generate_content)))
+
+
+def make_async_client(handlers, hedging=None):
+    client = GeminiClient(project_id="test-project", pool=AsyncRegionalPool(handlers), router=RegionRouter(),
+                          hedging=hedging or HedgePolicy(), flights=SingleFlight())
+    client.regions = list(handlers)
+    return client
+
+
+def answer_async(text, delay=0.0):
+    async def handler():
+        await asyncio.sleep(delay)
+        return SimpleNamespace(text=text, usage_metadata=None)
+    return handler
+
+
+def test_generate_content_async_awaits_the_aio_client_on_the_running_loop():
+    client = make_async_client({"r1": answer_async("ok")})
+
+    async def main():
+        result = await client.generate_content_async(user_contents(), model="m", coalesce=False)
+        return result, asyncio.get_running_loop()
+
+    result, loop = asyncio.run(main())
+
+    assert result == "ok"
+    # No executor hop: the call ran on the event loop's own thread, with a client bound to that loop
+    assert client.pool.calls == [("r1", loop, threading.get_ident())]
+
+
+def test_generate_content_async_falls_back_on_region_failure():
+    async def unavailable():
+        raise api_error(503, "UNAVAILABLE")
+    client = make_async_client({"r1": unavailable, "r2": answer_async("fallback")})
+
+    result = asyncio.run(client.generate_content_async(user_contents(), model="m", coalesce=False))
+
+    assert result == "fallback"
+    assert [region for region, _, _ in client.pool.calls] == ["r1", "r2"]
+    assert client.router.scores()["r1"]["failures"] == 1
+
+
+def test_async_hedge_cancels_the_losing_request():
+    cancelled = []
+
+    async def stuck():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    hedging = HedgePolicy(min_samples=1, min_delay=0.05, burst=1)
+    hedging.observe("m", 0.01)
+    client = make_async_client({"r1": stuck, "r2": answer_async("fast")}, hedging=hedging)
+
+    started = time.monotonic()
+    result = asyncio.run(client.generate_content_async(user_contents(), model="m", hedge=True, coalesce=False))
+
+    assert result == "fast"
+    assert time.monotonic() - started < 2
+    assert cancelled == [True]
+    assert client.get_hedge_stats()["hedges_won"] == 1
+
+
+# --- Batch deadlines ---
+
+class EchoModels:
+    """Answers each prompt with its upper-cased text and tracks how many calls overlap."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def generate_content(self, model, contents, config):
+        text = contents[0].parts[0].text
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.05)
+            if text == "bad":
+                raise api_error(400, "INVALID_ARGUMENT")
+            return SimpleNamespace(text=text.upper(), usage_metadata=None)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def test_batch_runs_items_concurrently_and_keeps_input_order():
+    client = make_client(None)
+    client.pool.models = EchoModels()
+    prompts = ["a", "b", "bad", "c", "d", "e"]
+
+    results = client.batch_generate_content([user_contents(text) for text in prompts], model="m", max_concurrency=3)
+
+    assert results[:2] + results[3:] == ["A", "B", "C", "D", "E"]
+    assert "error" in results[2]
+    assert client.pool.models.peak == 3
+
+
+def test_iter_generate_content_tags_each_result_with_its_index():
+    client = make_client(None)
+    client.pool.models = EchoModels()
+
+    results = list(client.iter_generate_content([user_contents(t) for t in "xyz"], model="m", max_concurrency=3))
+
+    assert sorted(results) == [(0, "X"), (1, "Y"), (2, "Z")]
+
+
+def test_timed_out_batch_item_stops_retrying_at_its_deadline():
+    def unavailable():
+        time.sleep(0.05)
+        raise api_error(503, "UNAVAILABLE")
+    client = make_client(unavailable)
+
+    results = list(client.iter_generate_content([user_contents()], model="m", timeout=0.5))
+
+    assert results[0][0] == 0 and "error" in results[0][1]
+    # Every HTTP attempt was capped at the time left before the deadline
+    assert all(0 < config.http_options.timeout <= 500 for config in client.pool.models.configs)
+    # The tenacity backoff (2s at least) would start after the deadline, so no retry follows
+    calls = len(client.pool.models.calls)
+    time.sleep(2.5)
+    assert len(client.pool.models.calls) == calls
+    assert calls <= len(client.regions)
+
+
+def test_batch_item_within_deadline_keeps_caller_http_timeout():
+    client = make_client(lambda: SimpleNamespace(text="ok", usage_metadata=None))
+    config = types.GenerateContentConfig(http_options=types.HttpOptions(timeout=1000))
+
+    results = list(client.iter_generate_content([user_contents()], generation_config=config,
+                                                model="m", timeout=30))
+
+    assert results == [(0, "ok")]
+    assert client.pool.models.configs[0].http_options.timeout == 1000
@@ -0,0 +1,232 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import logging
+import datetime
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any
+
+# Directory the analysis history used to be written to, one JSON file per analysis
+HISTORY_DIR = "./history"
+# SQLite database holding the analysis history
+HISTORY_DB_PATH = os.environ.get("REPO_HISTORY_DB_PATH", os.path.join(HISTORY_DIR, "history.sqlite"))
+# Oldest analyses beyond this count are deleted (0 keeps them all)
+HISTORY_MAX_ENTRIES = int(os.environ.get("REPO_HISTORY_MAX_ENTRIES", "1000"))
+# Analyses older than this many days are deleted (0 keeps them regardless of age)
+HISTORY_MAX_AGE_DAYS = int(os.environ.get("REPO_HISTORY_MAX_AGE_DAYS", "0"))
+# Default and maximum number of analyses returned per history page
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+@dataclass
+class HistoryPage:
+    """One page of analyses, newest first."""
+    entries: List[Dict[str, Any]] = field(default_factory=list)
+    # Pass as `before` to fetch the next page; None on the last page
+    next_before: Optional[int] = None
+
+    def report(self) -> Dict[str, Any]:
+        return {"entries": self.entries, "next_before": self.next_before}
+
+class HistoryStore:
+    """
+    Analysis history backed by SQLite.
+
+    Analyses are indexed by repository URL, analysis type and time, and their
+    text is searchable through an FTS5 index when SQLite provides one. Pages
+    are fetched by keyset on the row ID, so loading a page costs the same
+    however long the history grows. Retention limits are applied on insert.
+    """
+
+    def __init__(self, path: str,
+                 max_entries: int = HISTORY_MAX_ENTRIES,
+                 max_age_days: int = HISTORY_MAX_AGE_DAYS,
+                 logger: Optional[logging.Logger] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, repo_url TEXT NOT NULL,"
+            " text TEXT NOT NULL, created_at TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS analyses_repo_url ON analyses (repo_url, id);"
+            "CREATE INDEX IF NOT EXISTS analyses_type ON analyses (type, id);"
+            "CREATE INDEX IF NOT EXISTS analyses_created_at ON analyses (created_at);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        if "source" not in [row[1] for row in self._db.execute("PRAGMA table_info(analyses)")]:
+            # Name of the JSON file an imported analysis came from; NULL for analyses recorded here
+            self._db.execute("ALTER TABLE analyses ADD COLUMN source TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS analyses_source ON analyses (source)")
+        self.full_text = self._create_fts()
+        self._db.commit()
+
+    def _create_fts(self) -> bool:
+        """Create the full-text index and the triggers keeping it in sync; False if FTS5 is unavailable."""
+        try:
+            self._db.executescript(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5("
+                " text, content='analyses', content_rowid='id');"
+                "CREATE TRIGGER IF NOT EXISTS analyses_fts_insert AFTER INSERT ON analyses BEGIN"
+                " INSERT INTO analyses_fts (rowid, text) VALUES (new.id, new.text); END;"
+                "CREATE TRIGGER IF NOT EXISTS analyses_fts_delete AFTER DELETE ON analyses BEGIN"
+                " INSERT INTO analyses_fts (analyses_fts, rowid, text) VALUES ('delete', old.id, old.text); END;"
+            )
+            return True
+        except sqlite3.OperationalError as e:
+            self.logger.warning(f"SQLite has no FTS5 ({e}); history search falls back to substring matching")
+            return False
+
+    def add(self, analysis_type: str, text: str, repo_url: str,
+            created_at: Optional[datetime.datetime] = None) -> int:
+        """Record an analysis, apply the retention limits and return its ID."""
+        created_at = (created_at or datetime.datetime.now()).isoformat(timespec="seconds")
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO analyses (type, repo_url, text, created_at) VALUES (?, ?, ?, ?)",
+                (analysis_type, repo_url, text, created_at)
+            )
+            self._prune()
+            self._db.commit()
+            return cursor.lastrowid
+
+    def _prune(self):
+        """Delete analyses beyond the retention limits. Called with the lock held."""
+        if self.max_entries > 0:
+            # IDs grow with insertion, so everything at or below the (max+1)-th newest ID goes
+            self._db.execute(
+                "DELETE FROM analyses WHERE id <= "
+                "(SELECT id FROM analyses ORDER BY id DESC LIMIT 1 OFFSET ?)", (self.max_entries,)
+            )
+        if self.max_age_days > 0:
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=self.max_age_days)
+            self._db.execute("DELETE FROM analyses WHERE created_at < ?", (cutoff.isoformat(timespec="seconds"),))
+
+    def query(self, repo_url: Optional[str] = None,
+              analysis_type: Optional[str] = None,
+              search: Optional[str] = None,
+              before: Optional[int] = None,
+              limit: int = HISTORY_PAGE_SIZE) -> HistoryPage:
+        """
+        Return a page of analyses, newest first.
+
+        Args:
+            repo_url: Only analyses of this repository
+            analysis_type: Only analyses of this type
+            search: Only analyses whose text contains all of these words
+            before: Only analyses with a lower ID, i.e. the `next_before` of the previous page
+            limit: Page size, capped at HISTORY_MAX_PAGE_SIZE
+
+        Returns:
+            HistoryPage: The analyses and the cursor of the next page
+        """
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        where, params = [], []
+        if repo_url:
+            where.append("a.repo_url = ?")
+            params.append(repo_url)
+        if analysis_type:
+            where.append("a.type = ?")
+            params.append(analysis_type)
+        if before:
+            where.append("a.id < ?")
+            params.append(before)
+        source = "analyses a"
+        words = re.findall(r"\w+", search or "")
+        if words and self.full_text:
+            # Quote each word so user input is never parsed as FTS query syntax
+            source += " JOIN analyses_fts ON analyses_fts.rowid = a.id"
+            where.append("analyses_fts MATCH ?")
+            params.append(" ".join(f'"{word}"' for word in words))
+        else:
+            for word in words:
+                where.append("a.text LIKE ?")
+                params.append(f"%{word}%")
+        sql = (f"SELECT a.id, a.type, a.repo_url, a.text, a.created_at FROM {source}"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY a.id DESC LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+        page = HistoryPage(entries=[
+            {"id": row[0], "type": row[1], "repo_url": row[2], "text": row[3], "timestamp": row[4]}
+            for row in rows[:limit]
+        ])
+        if len(rows) > limit:
+            page.next_before = rows[limit - 1][0]
+        return page
+
+    def import_json_dir(self, directory: str) -> int:
+        """
+        Import the per-analysis JSON files the history used to be stored as.
+
+        Runs once per database: later calls return 0 without reading the
+        directory. Each file is recorded under its name and inserted only if
+        that name is new, so processes importing at the same time cannot
+        duplicate it. The files are left in place. Returns the number imported.
+        """
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return 0
+        records = []
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(directory, name), "r") as f:
+                        data = json.load(f)
+                    created_at = datetime.datetime.strptime(data["timestamp"], "%Y%m%d_%H%M%S")
+                    records.append((data["type"], data.get("repo_url") or "", data.get("text") or "",
+                                    created_at.isoformat(timespec="seconds"), name))
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    self.logger.warning(f"Skipping unreadable history file {name}: {e}")
+        # Oldest first, so row IDs follow time order
+        records.sort(key=lambda record: record[3])
+        with self._lock:
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO analyses (type, repo_url, text, created_at, source) VALUES (?, ?, ?, ?, ?)",
+                records
+            )
+            imported = max(cursor.rowcount, 0)
+            self._prune()
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)",
+                             (datetime.datetime.now().isoformat(timespec="seconds"),))
+            self._db.commit()
+        if imported:
+            self.logger.info(f"Imported {imported} analyses from {directory} into {self.path}")
+        return imported
+
+_history_store: Optional[HistoryStore] = None
+_history_store_lock = threading.Lock()
+
+def get_history_store() -> HistoryStore:
+    """Return the shared history, opening the database and importing HISTORY_DIR on first use."""
+    global _history_store
+    with _history_store_lock:
+        if _history_store is None:
+            store = HistoryStore(HISTORY_DB_PATH)
+            store.import_json_dir(HISTORY_DIR)
+            _history_store = store
+        return _history_store
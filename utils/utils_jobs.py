@@ -0,0 +1,200 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, Any, Callable, Iterator
+from flask import jsonify
+from utils.utils_sse import sse_event, sse_response
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been asked to stop."""
+
+class Job:
+    """
+    A unit of background work with observable progress.
+
+    The job function receives the Job and should call `update(...)` to publish
+    progress and `check_cancelled()` at safe points.
+    """
+
+    TERMINAL_STATES = ("done", "failed", "cancelled")
+
+    def __init__(self, kind: str):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+        self.future: Optional[Future] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in self.TERMINAL_STATES
+
+    def _set(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def update(self, **progress):
+        """Merge progress fields (stage, files_scanned, ...) and wake up watchers."""
+        self.check_cancelled()
+        with self._changed:
+            self.progress.update(progress)
+            self.version += 1
+            self._changed.notify_all()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> bool:
+        """Ask the job to stop. Returns False if it had already finished."""
+        if self.finished:
+            return False
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            # Never started
+            self._set(state="cancelled", finished_at=time.time())
+        return True
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Block until the job changes past `version` or `timeout` elapses; return the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._changed:
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "state": self.state,
+                "progress": dict(self.progress),
+                "result": self.result if self.state == "done" else None,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at
+            }
+
+class JobQueue:
+    """
+    Runs jobs on a local thread pool and keeps them around for polling.
+
+    Jobs run in a copy of the submitting context, so context variables such
+    as the Gemini usage labels follow the work. Finished jobs are forgotten
+    `retention` seconds after they end.
+    """
+
+    def __init__(self, workers: int = 2, retention: float = 3600, logger: Optional[logging.Logger] = None):
+        self.retention = retention
+        self.logger = logger or logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="repo-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [j.job_id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]):
+        if job.finished:
+            return
+        job._set(state="running")
+        try:
+            job.check_cancelled()
+            result = fn(job)
+            job._set(state="done", result=result, finished_at=time.time())
+        except JobCancelled:
+            job._set(state="cancelled", finished_at=time.time())
+        except Exception as e:
+            self.logger.error(f"Job {job.job_id} ({job.kind}) failed: {e}", exc_info=True)
+            job._set(state="failed", error=str(e), finished_at=time.time())
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Job:
+        """Queue fn(job) and return the Job immediately."""
+        self._prune()
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        context = contextvars.copy_context()
+        job.future = self._executor.submit(context.run, self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def events(self, job: Job, keepalive: float = 15.0) -> Iterator[str]:
+        """Yield a `progress` SSE event on every change, then a final `done`, `failed` or `cancelled` event."""
+        version = -1
+        while True:
+            current = job.wait_for_change(version, timeout=keepalive)
+            if current == version:
+                # Comment frame keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            version = current
+            snapshot = job.to_dict()
+            if job.finished:
+                yield sse_event(snapshot, event=snapshot["state"])
+                return
+            yield sse_event(snapshot, event="progress")
+
+# Shared queue for repository ingestion
+job_queue = JobQueue(
+    workers=int(os.environ.get("REPO_JOB_WORKERS", "2")),
+    retention=float(os.environ.get("REPO_JOB_RETENTION", "3600"))
+)
+
+def job_status_response(job_id: str):
+    """JSON view of a job for the apps' polling endpoints."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+def job_events_response(job_id: str):
+    """Server-Sent Events view of a job for the apps' progress streams."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return sse_response(job_queue.events(job))
+
+def job_cancel_response(job_id: str):
+    """Cancel a job for the apps' cancel endpoints."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not job.cancel():
+        return jsonify({'error': f'Job already {job.state}'}), 409
+    return jsonify({'message': 'Cancellation requested', 'job_id': job_id})
@@ -0,0 +1,123 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+import os
+import time
+import logging
+import importlib
+import threading
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+# Startup slower than this many milliseconds is logged as a warning (0 disables the check)
+STARTUP_BUDGET_MS = float(os.environ.get("APP_STARTUP_BUDGET_MS", "1000"))
+# Load the lazy dependencies in a background thread as soon as the app has started
+WARM_UP = os.environ.get("APP_WARM_UP", "false").lower() == "true"
+
+class LazyImports:
+    """
+    Process-wide registry of heavy dependencies that are imported on first use.
+
+    Records how long each import took, so startup and first-request costs can
+    be measured, and runs the warm-up hooks that preload them on request.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._names: List[str] = []
+        self._seconds: Dict[str, float] = {}
+        self._hooks: List[Callable[[], Any]] = []
+
+    def module(self, name: str) -> "LazyModule":
+        """Return a stand-in for the module `name` that imports it on first attribute access."""
+        with self._lock:
+            if name not in self._names:
+                self._names.append(name)
+        return LazyModule(name, self)
+
+    def load(self, name: str) -> ModuleType:
+        """Import a module, timing the first import."""
+        with self._lock:
+            if name in self._seconds:
+                return importlib.import_module(name)
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            self._seconds[name] = time.perf_counter() - started
+        self.logger.info(f"Imported {name} in {self._seconds[name] * 1000:.0f} ms")
+        return module
+
+    def register_warm_up(self, hook: Callable[[], Any]):
+        """Add a function to run on warm-up after the lazy modules are imported, e.g. to load a model."""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def warm_up(self) -> Dict[str, Any]:
+        """Import every registered module and run the warm-up hooks. Returns report()."""
+        started = time.perf_counter()
+        for name in list(self._names):
+            self.load(name)
+        for hook in list(self._hooks):
+            try:
+                hook()
+            except Exception as e:
+                self.logger.warning(f"Warm-up hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+        self.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+        return self.report()
+
+    def start_warm_up(self) -> threading.Thread:
+        """Run warm_up() in a daemon thread, so the server can accept requests meanwhile."""
+        thread = threading.Thread(target=self.warm_up, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": {name: round(seconds * 1000, 1) for name, seconds in self._seconds.items()},
+                "pending": [name for name in self._names if name not in self._seconds]
+            }
+
+class LazyModule:
+    """
+    Stand-in for a module, imported through LazyImports on first attribute access.
+
+    Heavy SDKs can then be bound at module level, used in `except` clauses and
+    (with `from __future__ import annotations`) in type hints, without being
+    imported until a request actually needs them.
+    """
+
+    def __init__(self, name: str, registry: LazyImports):
+        self.__dict__["_name"] = name
+        self.__dict__["_registry"] = registry
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self._registry.load(self._name)
+            self.__dict__["_module"] = module
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+lazy_imports = LazyImports()
+
+def lazy_import(name: str) -> LazyModule:
+    """Shorthand for lazy_imports.module(name)."""
+    return lazy_imports.module(name)
@@ -0,0 +1,246 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any
+from utils.utils_vertex import GeminiClient, TokenCount, types
+from utils.utils_packing import ShardPlan, estimate_tokens, TOKEN_BUDGET
+
+# Shards analysed at the same time during the map step
+MAP_CONCURRENCY = int(os.environ.get("REPO_MAP_CONCURRENCY", "5"))
+# Highest map concurrency a request may ask for
+MAX_MAP_CONCURRENCY = 32
+
+def get_map_prompt(question: str, shard_number: int, shard_count: int, paths: List[str], code_text: str) -> str:
+    """Formats the prompt that asks the question of one shard."""
+    return f"""
+    Task: {question}
+
+    Context:
+    - You are an expert code analyzer and technical writer.
+    - The codebase is too large to read at once, so it has been split into {shard_count} parts.
+    - This is part {shard_number} of {shard_count}. It contains these files:
+      \n\n{paths}\n\n
+    - The content of each file is concatenated below:
+      \n\n{code_text}\n\n
+
+    Instructions:
+    1. Analyze only the code in this part.
+    2. Extract everything relevant to the task: findings, components, file paths and short code snippets.
+    3. Your notes will be merged with the notes on the other parts, so do not write introductions or conclusions.
+    4. If nothing in this part is relevant, reply "Nothing relevant in this part."
+
+    Notes:
+    """
+
+def get_reduce_prompt(question: str, partials: List[str]) -> str:
+    """Formats the prompt that merges partial answers into the final one."""
+    notes = "\n\n".join(f"--- Notes on part {i} ---\n{text}" for i, text in enumerate(partials, 1))
+    return f"""
+    Task: {question}
+
+    Context:
+    - You are an expert code analyzer and technical writer.
+    - The codebase was split into parts and each part was analyzed separately for this task.
+    - The notes on each part are below:
+      \n\n{notes}\n\n
+
+    Instructions:
+    1. Combine the notes into a single answer to the task, as if you had read the whole codebase.
+    2. Merge duplicates and resolve overlaps between parts.
+    3. Provide a comprehensive and well-structured response.
+    4. Use markdown formatting to enhance readability.
+    5. Keep relevant code snippets and file paths from the notes.
+
+    Response:
+    """
+
+@dataclass
+class MapReduceResult:
+    """The final answer of a map-reduce analysis and how it was produced."""
+    answer: str
+    concurrency: int
+    shards: List[Dict[str, Any]] = field(default_factory=list)
+    map_seconds: float = 0.0
+    reduce_seconds: float = 0.0
+    reduce_rounds: int = 0
+    usage: TokenCount = field(default_factory=lambda: TokenCount(prompt_tokens=0, completion_tokens=0, total_tokens=0))
+
+    def report(self) -> Dict[str, Any]:
+        """Summary for API responses, including per-shard timings for throughput tuning."""
+        return {
+            "shard_count": len(self.shards),
+            "concurrency": self.concurrency,
+            "map_seconds": round(self.map_seconds, 3),
+            "reduce_seconds": round(self.reduce_seconds, 3),
+            "reduce_rounds": self.reduce_rounds,
+            "failed_shards": sum(1 for shard in self.shards if shard.get("error")),
+            "shards": self.shards
+        }
+
+def _user_contents(prompt: str) -> List[types.Content]:
+    return [types.Content(role="user", parts=[types.Part(text=prompt)])]
+
+def _add_usage(total: TokenCount, usage: TokenCount):
+    total.prompt_tokens += usage.prompt_tokens
+    total.completion_tokens += usage.completion_tokens
+    total.total_tokens += usage.total_tokens
+    total.cached_tokens += usage.cached_tokens
+
+def map_reduce_analysis(client: GeminiClient,
+                        question: str,
+                        plan: ShardPlan,
+                        model: str,
+                        generation_config: Optional[types.GenerateContentConfig] = None,
+                        max_concurrency: int = MAP_CONCURRENCY,
+                        reduce_token_budget: int = TOKEN_BUDGET,
+                        logger: Optional[logging.Logger] = None) -> MapReduceResult:
+    """
+    Answer a question over a repository that does not fit in one prompt.
+
+    The map step asks the question of every shard concurrently through
+    GeminiClient.batch_generate_content_async. The reduce step merges the
+    partial answers with one more call; if the partial answers themselves
+    exceed `reduce_token_budget`, they are reduced in groups first, round by
+    round, until they fit. Failed shards are reported and left out of the
+    reduce step.
+
+    Args:
+        client: GeminiClient to send the requests with
+        question: The analysis question
+        plan: Shards from utils_packing.shard_files
+        model: Model name to use for both steps
+        generation_config: Optional custom generation config
+        max_concurrency: Maximum number of shards analysed at the same time
+        reduce_token_budget: Maximum estimated tokens of notes in one reduce prompt
+        logger: Optional logger
+
+    Returns:
+        MapReduceResult: The merged answer, per-shard timings and total token usage
+
+    Raises:
+        RuntimeError: If every shard failed
+    """
+    return asyncio.run(map_reduce_analysis_async(client, question, plan, model, generation_config,
+                                                 max_concurrency, reduce_token_budget, logger))
+
+async def map_reduce_analysis_async(client: GeminiClient,
+                                    question: str,
+                                    plan: ShardPlan,
+                                    model: str,
+                                    generation_config: Optional[types.GenerateContentConfig] = None,
+                                    max_concurrency: int = MAP_CONCURRENCY,
+                                    reduce_token_budget: int = TOKEN_BUDGET,
+                                    logger: Optional[logging.Logger] = None) -> MapReduceResult:
+    """
+    Asynchronous version of map_reduce_analysis.
+
+    The map step and every reduce round run on the caller's event loop, so
+    the async clients the client pool creates for that loop are reused
+    across rounds instead of being rebuilt for each one.
+    """
+    logger = logger or logging.getLogger(__name__)
+    result = MapReduceResult(answer="", concurrency=max_concurrency)
+    shard_count = len(plan.shards)
+
+    async def run_batch(prompts: List[str], timings: List[Dict[str, float]]) -> List[Any]:
+        return await client.batch_generate_content_async(
+            contents_list=[_user_contents(prompt) for prompt in prompts],
+            generation_config=generation_config,
+            model=model,
+            count_tokens=True,
+            max_concurrency=max_concurrency,
+            timings=timings
+        )
+
+    prompts = [get_map_prompt(question, shard.number, shard_count, shard.paths, shard.text) for shard in plan.shards]
+    timings: List[Dict[str, float]] = []
+    started = time.monotonic()
+    responses = await run_batch(prompts, timings)
+    result.map_seconds = time.monotonic() - started
+
+    partials = []
+    for shard, response, timing in zip(plan.shards, responses, timings):
+        entry = {
+            "shard": shard.number,
+            "directories": shard.directories,
+            "files": len(shard.paths),
+            "tokens": shard.tokens,
+            "queued_seconds": round(timing["queued"], 3),
+            "seconds": round(timing["seconds"], 3)
+        }
+        if isinstance(response, dict) and "error" in response:
+            entry["error"] = response["error"]
+        else:
+            text, usage = response
+            _add_usage(result.usage, usage)
+            entry["output_tokens"] = usage.completion_tokens
+            partials.append(text)
+        result.shards.append(entry)
+    logger.info(f"Map step: {shard_count} shards in {result.map_seconds:.1f}s at concurrency {max_concurrency}")
+
+    if not partials:
+        raise RuntimeError(f"All {shard_count} shards failed: {result.shards[0].get('error') if result.shards else 'no shards'}")
+
+    started = time.monotonic()
+    # Reduce in groups until the remaining notes fit in one prompt
+    while len(partials) > 1 and estimate_tokens("".join(partials)) > reduce_token_budget:
+        groups, group, group_tokens = [], [], 0
+        for text in partials:
+            tokens = estimate_tokens(text)
+            if group and group_tokens + tokens > reduce_token_budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(text)
+            group_tokens += tokens
+        groups.append(group)
+        if len(groups) == len(partials):
+            # Every note fills a prompt on its own; merging pairwise is the best we can do
+            groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+
+        result.reduce_rounds += 1
+        responses = await run_batch([get_reduce_prompt(question, group) for group in groups], [])
+        merged = []
+        for group, response in zip(groups, responses):
+            if isinstance(response, dict) and "error" in response:
+                logger.error(f"Reduce round {result.reduce_rounds} group failed: {response['error']}")
+                # Keep the notes rather than lose the shards behind them
+                merged.append("\n\n".join(group))
+            else:
+                text, usage = response
+                _add_usage(result.usage, usage)
+                merged.append(text)
+        if len(merged) >= len(partials):
+            break
+        partials = merged
+
+    result.reduce_rounds += 1
+    answer, usage = await client.generate_content_async(
+        contents=_user_contents(get_reduce_prompt(question, partials)),
+        generation_config=generation_config,
+        model=model,
+        count_tokens=True
+    )
+    _add_usage(result.usage, usage)
+    result.answer = answer
+    result.reduce_seconds = time.monotonic() - started
+    return result
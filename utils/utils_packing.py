@@ -0,0 +1,431 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+import os
+import re
+import fnmatch
+import posixpath
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+# Default token budget for the code part of a whole-repository prompt
+TOKEN_BUDGET = int(os.environ.get("REPO_PACK_TOKEN_BUDGET", "800000"))
+# Default token budget for each shard of a map-reduce analysis
+SHARD_TOKEN_BUDGET = int(os.environ.get("REPO_SHARD_TOKEN_BUDGET", "200000"))
+# Range a token budget requested by the browser is clamped to
+MIN_TOKEN_BUDGET = 1000
+MAX_TOKEN_BUDGET = 2000000
+# Rough characters-per-token ratio used to estimate prompt size without an API call
+CHARS_PER_TOKEN = float(os.environ.get("REPO_PACK_CHARS_PER_TOKEN", "4"))
+# Dropped files listed in reports; the rest are only counted
+MAX_REPORTED_DROPS = 200
+# Largest share of the budget the full file index may take before it is cut down to the packed files
+INDEX_SHARE = 0.1
+
+LOCKFILES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "npm-shrinkwrap.json", "poetry.lock",
+    "pipfile.lock", "cargo.lock", "go.sum", "composer.lock", "gemfile.lock", "podfile.lock",
+    "packages.lock.json", "mix.lock", "pubspec.lock", "flake.lock", "uv.lock"
+}
+VENDOR_DIRS = {
+    "vendor", "vendors", "node_modules", "third_party", "third-party", "external", "bower_components",
+    ".venv", "venv", "site-packages", "__pycache__", "dist", "build", "out", "target", ".next", ".nuxt",
+    "coverage", ".idea", ".vscode"
+}
+GENERATED_PATTERNS = [
+    "*.min.js", "*.min.css", "*.map", "*.bundle.js", "*.pb.go", "*_pb2.py", "*_pb2_grpc.py", "*.pb.cc",
+    "*.pb.h", "*.generated.*", "*.g.dart", "*.snap", "*.svg", "*.lock"
+]
+ENTRY_POINTS = {
+    "main.py", "app.py", "__main__.py", "manage.py", "wsgi.py", "asgi.py", "server.py", "cli.py",
+    "index.js", "index.ts", "main.js", "main.ts", "server.js", "app.js", "app.ts", "main.go",
+    "main.rs", "lib.rs", "main.java", "application.java", "program.cs", "main.c", "main.cpp"
+}
+MANIFESTS = {
+    "setup.py", "setup.cfg", "pyproject.toml", "requirements.txt", "package.json", "go.mod",
+    "cargo.toml", "pom.xml", "build.gradle", "dockerfile", "makefile", "docker-compose.yml",
+    "docker-compose.yaml", "tsconfig.json", "cmakelists.txt", "gemfile", "app.yaml", "cloudbuild.yaml"
+}
+TEST_DIRS = {"test", "tests", "__tests__", "spec", "specs", "testing", "testdata", "fixtures", "e2e"}
+DOC_DIRS = {"docs", "doc", "documentation"}
+EXAMPLE_DIRS = {"examples", "example", "samples", "sample", "demo", "demos"}
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text from its length."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+class GitIgnore:
+    """
+    Minimal .gitignore matcher covering the common syntax: globs, `**`,
+    directory-only patterns (trailing /), anchored patterns (leading or inner
+    /) and negation (!). Patterns are scoped to the directory of their file.
+    """
+
+    def __init__(self):
+        # (base directory, compiled regex, negated, directory only)
+        self.rules: List[Tuple[str, re.Pattern, bool, bool]] = []
+
+    @staticmethod
+    def _compile(pattern: str, anchored: bool) -> re.Pattern:
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            else:
+                char = pattern[i]
+                regex += "[^/]*" if char == "*" else "[^/]" if char == "?" else re.escape(char)
+                i += 1
+        return re.compile(("^" if anchored else "^(?:.*/)?") + regex + "$")
+
+    def add(self, base: str, text: str):
+        """Add the rules of a .gitignore located in directory `base` ('' for the root)."""
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            # A leading or inner slash anchors the pattern; the trailing one only marks a directory
+            anchored = "/" in line
+            self.rules.append((base, self._compile(line.lstrip("/"), anchored), negated, dir_only))
+
+    def ignored(self, path: str) -> bool:
+        """True if a file path (posix, relative to the repository root) is ignored."""
+        parts = path.split("/")
+        # A file is ignored if it or any parent directory matches
+        candidates = [("/".join(parts[:i]), True) for i in range(1, len(parts))] + [(path, False)]
+        for candidate, is_dir in candidates:
+            result = None
+            for base, regex, negated, dir_only in self.rules:
+                if base and not candidate.startswith(base + "/"):
+                    continue
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(candidate[len(base) + 1:] if base else candidate):
+                    result = not negated
+            if result:
+                return True
+        return False
+
+def exclusion_reason(path: str) -> Optional[str]:
+    """Why a file should never be packed (lockfile, vendored, generated), or None."""
+    path = path.replace(os.sep, "/")
+    name = posixpath.basename(path).lower()
+    if name in LOCKFILES:
+        return "lockfile"
+    if any(part.lower() in VENDOR_DIRS for part in path.split("/")[:-1]):
+        return "vendored"
+    if any(fnmatch.fnmatch(name, pattern) for pattern in GENERATED_PATTERNS):
+        return "generated"
+    return None
+
+def relevance(path: str) -> float:
+    """Score how useful a file is for understanding the repository; higher is better."""
+    path = path.replace(os.sep, "/")
+    parts = [part.lower() for part in path.split("/")]
+    name = parts[-1]
+    depth = len(parts) - 1
+    dirs = set(parts[:-1])
+
+    if name.startswith("readme"):
+        score = 100 if depth == 0 else 60
+    elif name in ENTRY_POINTS:
+        score = 85
+    elif name in MANIFESTS:
+        score = 75
+    elif dirs & TEST_DIRS or name.startswith("test_") or re.search(r"[._-](test|spec)\.", name):
+        score = 20
+    elif dirs & EXAMPLE_DIRS:
+        score = 25
+    elif dirs & DOC_DIRS or name.endswith((".md", ".rst", ".txt")):
+        score = 35
+    else:
+        score = 55
+    # Prefer files near the top of the tree
+    return score - min(depth, 10) * 2
+
+@dataclass
+class PackResult:
+    """The files chosen for a prompt and what was left out."""
+    text: str
+    token_budget: int
+    tokens: int = 0
+    index: List[str] = field(default_factory=list)
+    included: List[str] = field(default_factory=list)
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+    dropped_count: int = 0
+    dropped_tokens: int = 0
+    # Files that were worth packing but did not fit
+    over_budget_count: int = 0
+
+    def report(self) -> Dict[str, Any]:
+        """Summary for API responses."""
+        return {
+            "token_budget": self.token_budget,
+            "tokens": self.tokens,
+            "included_files": len(self.included),
+            "dropped_files": self.dropped_count,
+            "over_budget_files": self.over_budget_count,
+            "dropped_tokens": self.dropped_tokens,
+            "dropped": self.dropped
+        }
+
+def _file_block(path: str, text: str) -> str:
+    return f"----- File: {path} -----\n{text}\n-------------------------\n"
+
+def _record_drop(result, path: str, reason: str, tokens: int):
+    """Count a left-out file on a PackResult or ShardPlan, listing the first MAX_REPORTED_DROPS."""
+    result.dropped_count += 1
+    result.dropped_tokens += tokens
+    if len(result.dropped) < MAX_REPORTED_DROPS:
+        result.dropped.append({"path": path, "reason": reason, "tokens": tokens})
+
+def _read_gitignores(files: Iterable[Tuple[str, str]]) -> GitIgnore:
+    """Collect the rules of every .gitignore among (path, text) pairs."""
+    gitignore = GitIgnore()
+    for path, text in files:
+        path = path.replace(os.sep, "/")
+        if posixpath.basename(path) == ".gitignore":
+            gitignore.add(posixpath.dirname(path), text)
+    return gitignore
+
+def _filter_files(files: Iterable[Tuple[str, str]], result,
+                  gitignore: Optional[GitIgnore] = None) -> List[Tuple[int, str, str]]:
+    """
+    Drop lockfiles, vendored, generated and gitignored files onto `result`
+    and return the remaining (order, path, text) entries. The .gitignore
+    rules are read from `files` unless given.
+    """
+    entries = [(path.replace(os.sep, "/"), text) for path, text in files]
+    if gitignore is None:
+        gitignore = _read_gitignores(entries)
+
+    kept = []
+    for order, (path, text) in enumerate(entries):
+        reason = exclusion_reason(path) or ("gitignored" if gitignore.ignored(path) else None)
+        if reason:
+            _record_drop(result, path, reason, estimate_tokens(_file_block(path, text)))
+        else:
+            kept.append((order, path, text))
+    return kept
+
+def pack_files(files: Iterable[Tuple[str, str]],
+               token_budget: int = TOKEN_BUDGET,
+               code_index: Optional[List[str]] = None,
+               gitignore: Optional[GitIgnore] = None) -> PackResult:
+    """
+    Pick the most relevant files that fit in a token budget.
+
+    Lockfiles, vendored and generated files, and anything matched by the
+    repository's .gitignore files are excluded outright. The rest are ranked
+    by relevance (README, entry points and manifests first, tests and
+    examples last, shallow before deep) and added greedily while they fit.
+    Chosen files are emitted in their original order using the same
+    `----- File: <path> -----` layout as extract_code.
+
+    The file index for the prompt counts against the budget too: the full
+    `code_index` is kept if it needs at most INDEX_SHARE of the budget,
+    otherwise only the packed files are listed.
+
+    Args:
+        files: (path, text) pairs, e.g. Snapshot.iter_files()
+        token_budget: Maximum estimated tokens for the index plus packed text
+        code_index: Optional list of every file in the repository
+        gitignore: Rules to exclude files by, if `files` are not the files
+            themselves; by default the rules of the .gitignore files among `files`
+
+    Returns:
+        PackResult: The packed text plus a report of what was dropped and why
+    """
+    result = PackResult(text="", token_budget=token_budget)
+    full_index_tokens = estimate_tokens(str(code_index)) if code_index else 0
+    keep_full_index = code_index is not None and full_index_tokens <= token_budget * INDEX_SHARE
+    if keep_full_index:
+        result.tokens = full_index_tokens
+
+    candidates = []
+    for order, path, text in _filter_files(files, result, gitignore):
+        block = _file_block(path, text)
+        candidates.append((-relevance(path), estimate_tokens(block), order, path, block))
+
+    chosen = []
+    # Without the full index the packed paths are listed instead, so each file also pays for its index entry
+    index_chars = 0 if keep_full_index else len("[]")
+    for _, tokens, order, path, block in sorted(candidates):
+        entry_chars = 0 if keep_full_index else len(repr(path)) + len(", ")
+        index_tokens = 0 if keep_full_index else int((index_chars + entry_chars) / CHARS_PER_TOKEN) + 1
+        if result.tokens + tokens + index_tokens > token_budget:
+            _record_drop(result, path, "over budget", tokens)
+            result.over_budget_count += 1
+            continue
+        result.tokens += tokens
+        index_chars += entry_chars
+        chosen.append((order, path, block))
+
+    chosen.sort()
+    result.included = [path for _, path, _ in chosen]
+    result.text = "".join(block for _, _, block in chosen)
+    result.index = list(code_index) if keep_full_index else list(result.included)
+    if not keep_full_index:
+        result.tokens += estimate_tokens(str(result.index))
+    return result
+
+@dataclass
+class Shard:
+    """One token-bounded slice of a repository for the map step of an analysis."""
+    number: int
+    directories: List[str] = field(default_factory=list)
+    paths: List[str] = field(default_factory=list)
+    text: str = ""
+    tokens: int = 0
+
+@dataclass
+class ShardPlan:
+    """A repository split into shards, plus what was left out."""
+    token_budget: int
+    shards: List[Shard] = field(default_factory=list)
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+    dropped_count: int = 0
+    dropped_tokens: int = 0
+
+    @property
+    def tokens(self) -> int:
+        return sum(shard.tokens for shard in self.shards)
+
+    def report(self) -> Dict[str, Any]:
+        """Summary for API responses."""
+        return {
+            "shard_token_budget": self.token_budget,
+            "shard_count": len(self.shards),
+            "tokens": self.tokens,
+            "included_files": len({path for shard in self.shards for path in shard.paths}),
+            "dropped_files": self.dropped_count,
+            "dropped_tokens": self.dropped_tokens,
+            "dropped": self.dropped
+        }
+
+def _split_text(text: str, max_chars: int) -> List[str]:
+    """Split text into pieces of at most max_chars, at line breaks where possible."""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind("\n", 0, max_chars) + 1 or max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    pieces.append(text)
+    return pieces
+
+def shard_files(files: Iterable[Tuple[str, str]],
+                shard_token_budget: int = SHARD_TOKEN_BUDGET) -> ShardPlan:
+    """
+    Split a repository into shards of at most `shard_token_budget` tokens.
+
+    Files are excluded exactly as in pack_files, then grouped by directory so
+    related code lands in the same shard: whole directories are added while
+    they fit, a directory larger than a shard continues into the next one,
+    and a single file larger than a shard is cut into
+    `----- File: <path> (part i/n) -----` blocks at line breaks.
+
+    Args:
+        files: (path, text) pairs, e.g. Snapshot.iter_files()
+        shard_token_budget: Maximum estimated tokens of file text per shard
+
+    Returns:
+        ShardPlan: The shards in directory order plus a report of what was dropped
+    """
+    plan = ShardPlan(token_budget=shard_token_budget)
+    # Room for the block header and footer of a split file
+    max_chars = max(1, int((shard_token_budget - 64) * CHARS_PER_TOKEN))
+
+    groups: Dict[str, List[Tuple[str, str, int]]] = {}
+    for _, path, text in _filter_files(files, plan):
+        blocks = _split_text(text, max_chars)
+        if len(blocks) == 1:
+            blocks = [_file_block(path, text)]
+        else:
+            blocks = [_file_block(f"{path} (part {i}/{len(blocks)})", piece) for i, piece in enumerate(blocks, 1)]
+        groups.setdefault(posixpath.dirname(path), []).extend(
+            (path, block, estimate_tokens(block)) for block in blocks
+        )
+
+    current = Shard(number=1)
+    parts: List[str] = []
+
+    def close():
+        nonlocal current, parts
+        if parts:
+            current.text = "".join(parts)
+            plan.shards.append(current)
+            current, parts = Shard(number=len(plan.shards) + 1), []
+
+    for directory in sorted(groups):
+        blocks = groups[directory]
+        group_tokens = sum(tokens for _, _, tokens in blocks)
+        # Start a fresh shard rather than split a directory that would fit in one
+        if current.tokens + group_tokens > shard_token_budget and group_tokens <= shard_token_budget:
+            close()
+        for path, block, tokens in blocks:
+            if current.tokens + tokens > shard_token_budget:
+                close()
+            if directory not in current.directories:
+                current.directories.append(directory)
+            if not current.paths or current.paths[-1] != path:
+                current.paths.append(path)
+            current.tokens += tokens
+            parts.append(block)
+    close()
+    return plan
+
+def pack_changes(diff, old, new, token_budget: int = TOKEN_BUDGET) -> PackResult:
+    """
+    Pack what changed between two snapshots (utils_repo.SnapshotDiff.iter_patches)
+    the way pack_files packs files: diffs of modified files, full text of
+    added ones, a note per deleted one. The index lists the changed paths.
+
+    Files are excluded by the .gitignore files of the new snapshot, read in
+    full: a changed .gitignore appears here as a diff, not as rules.
+    """
+    gitignores = [path for path in new.code_index if posixpath.basename(path.replace(os.sep, "/")) == ".gitignore"]
+    return pack_files(diff.iter_patches(old, new), token_budget,
+                      sorted(diff.added + diff.modified + diff.deleted),
+                      gitignore=_read_gitignores(new.read_files(gitignores)))
+
+def get_delta_prompt(question: str, since_commit: str, commit_sha: str, changes_text: str) -> str:
+    """Formats the prompt for questions about the changes between two commits."""
+    return f"""
+    Task: {question}
+
+    Context:
+    - You are an expert code analyzer and technical writer.
+    - Only the changes to the codebase between commit {since_commit[:12]} and commit {commit_sha[:12]} are provided below.
+    - Modified files are shown as unified diffs, added files in full, and deleted files as a note:
+      \n\n{changes_text}\n\n
+
+    Instructions:
+    1. Answer the task with respect to these changes.
+    2. Explain what changed and why it matters, citing file paths.
+    3. Point out risky or incomplete changes.
+    4. Use markdown formatting to enhance readability.
+
+    Response:
+    """
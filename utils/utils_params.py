@@ -0,0 +1,47 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+
+import math
+from typing import Any, Callable, Dict, Union
+
+class ParamError(ValueError):
+    """A request field has an unusable value; the message is safe to return to the caller."""
+
+def number_param(data: Dict[str, Any], name: str, default: Union[int, float],
+                 minimum: Union[int, float], maximum: Union[int, float],
+                 cast: Callable[[float], Union[int, float]] = int) -> Union[int, float]:
+    """
+    Read a numeric field of a JSON request body, clamped to [minimum, maximum].
+
+    A missing, null or empty field gives `default`. Numeric strings are
+    accepted, as the browser sends form values as text.
+
+    Raises:
+        ParamError: If the field is not a finite number
+    """
+    value = data.get(name)
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        raise ParamError(f"'{name}' must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ParamError(f"'{name}' must be a number") from None
+    if not math.isfinite(number):
+        raise ParamError(f"'{name}' must be a finite number")
+    return cast(min(max(number, minimum), maximum))
@@ -0,0 +1,1373 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import difflib
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+import fnmatch
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Iterator, TextIO, Tuple, Callable
+from utils.utils_lazy import lazy_import, lazy_imports
+from utils.utils_retrieval import ensure_index, EMBEDDER
+
+# Loaded on first use, keeping them off the startup path of every blueprint
+git = lazy_import("git")
+magika = lazy_import("magika")
+
+# Default cap on the code text extracted from one repository
+MAX_CODE_BYTES = int(os.environ.get("REPO_MAX_CODE_BYTES", str(64 * 1024 * 1024)))
+# Files larger than this are never read (generated data, bundles, dumps)
+MAX_FILE_BYTES = int(os.environ.get("REPO_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+# Walk a checked-out worktree instead of reading the mirror's object database
+INGEST_FROM_CHECKOUT = os.environ.get("REPO_INGEST_CHECKOUT", "false").lower() == "true"
+
+# Extensions that are classified without running Magika. Text extensions are
+# still sniffed for NUL bytes before being trusted.
+TEXT_EXTENSIONS = {
+    ".py": "python", ".js": "javascript", ".mjs": "javascript", ".cjs": "javascript", ".jsx": "javascript",
+    ".ts": "typescript", ".tsx": "typescript", ".go": "go", ".java": "java", ".kt": "kotlin",
+    ".scala": "scala", ".rb": "ruby", ".php": "php", ".rs": "rust", ".c": "c", ".h": "c",
+    ".cc": "cpp", ".cpp": "cpp", ".hpp": "cpp", ".cs": "cs", ".swift": "swift", ".m": "objectivec",
+    ".sh": "shell", ".bash": "shell", ".ps1": "powershell", ".sql": "sql", ".html": "html",
+    ".css": "css", ".scss": "scss", ".vue": "vue", ".dart": "dart", ".lua": "lua", ".r": "r",
+    ".proto": "proto", ".tf": "hcl", ".gradle": "groovy", ".md": "markdown", ".rst": "rst",
+    ".txt": "txt", ".json": "json", ".yaml": "yaml", ".yml": "yaml", ".toml": "toml",
+    ".ini": "ini", ".cfg": "ini", ".xml": "xml", ".csv": "csv", ".dockerfile": "dockerfile"
+}
+BINARY_EXTENSIONS = {
+    ".png": "image", ".jpg": "image", ".jpeg": "image", ".gif": "image", ".bmp": "image",
+    ".ico": "image", ".webp": "image", ".tiff": "image", ".psd": "image",
+    ".zip": "archive", ".gz": "archive", ".tgz": "archive", ".bz2": "archive", ".xz": "archive",
+    ".7z": "archive", ".rar": "archive", ".tar": "archive", ".jar": "archive", ".whl": "archive",
+    ".pdf": "document", ".doc": "document", ".docx": "document", ".xls": "document",
+    ".xlsx": "document", ".ppt": "document", ".pptx": "document",
+    ".mp3": "audio", ".wav": "audio", ".ogg": "audio", ".flac": "audio",
+    ".mp4": "video", ".mov": "video", ".avi": "video", ".webm": "video", ".mkv": "video",
+    ".woff": "font", ".woff2": "font", ".ttf": "font", ".otf": "font", ".eot": "font",
+    ".so": "executable", ".dll": "executable", ".exe": "executable", ".dylib": "executable",
+    ".class": "executable", ".pyc": "executable", ".o": "executable", ".a": "executable",
+    ".wasm": "executable", ".bin": "unknown", ".db": "unknown", ".sqlite": "unknown"
+}
+SNIFF_BYTES = 8192
+# Length of the "\n-----...\n" trailer extract_code writes after each file
+FOOTER_BYTES = len("\n-------------------------\n")
+
+@dataclass
+class ClassificationStats:
+    """Counters for one classification pass, reported back to the browser."""
+    files: int = 0
+    cached: int = 0
+    prefiltered: int = 0
+    model: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return round(self.files / self.seconds, 1) if self.seconds else 0.0
+
+class ClassificationCache:
+    """
+    Persistent map of git blob SHA -> (group, label, decoded text length).
+
+    A blob's content never changes, so its Magika result can be reused across
+    re-ingestions, forks and both repository apps. Backed by SQLite; the
+    database is opened on first use.
+    """
+
+    # Results that depend on configuration rather than content are not cached
+    UNCACHEABLE_LABELS = ("oversized", "unreadable")
+
+    def __init__(self, path: str, logger: Optional[logging.Logger] = None):
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database, creating it if needed. Called with the lock held."""
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                "blob_sha TEXT PRIMARY KEY, grp TEXT NOT NULL, label TEXT NOT NULL, text_length INTEGER)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get_many(self, blob_shas: List[str]) -> Dict[str, Tuple[str, str, Optional[int]]]:
+        """Look up many blobs at once; missing blobs are absent from the result."""
+        found: Dict[str, Tuple[str, str, Optional[int]]] = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(blob_shas), 500):
+                batch = blob_shas[i:i + 500]
+                rows = self._connection().execute(
+                    f"SELECT blob_sha, grp, label, text_length FROM classifications "
+                    f"WHERE blob_sha IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for blob_sha, group, label, text_length in rows:
+                    found[blob_sha] = (group, label, text_length)
+            self.hits += len(found)
+            self.misses += len(blob_shas) - len(found)
+        return found
+
+    def put_many(self, entries: List[Tuple[str, str, str]]):
+        """Store (blob_sha, group, label) results."""
+        entries = [e for e in entries if e[1] is not None and e[2] not in self.UNCACHEABLE_LABELS]
+        if not entries:
+            return
+        with self._lock:
+            db = self._connection()
+            db.executemany(
+                "INSERT OR IGNORE INTO classifications (blob_sha, grp, label) VALUES (?, ?, ?)", entries
+            )
+            db.commit()
+
+    def set_text_lengths(self, entries: List[Tuple[int, str]]):
+        """Record (decoded text length, blob_sha) for blobs that were read."""
+        if not entries:
+            return
+        with self._lock:
+            db = self._connection()
+            db.executemany("UPDATE classifications SET text_length = ? WHERE blob_sha = ?", entries)
+            db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+def blob_shas(repo_dir: str) -> Dict[str, str]:
+    """
+    Map each tracked path (relative, OS separators) to its git blob SHA.
+
+    Read from the index with `git ls-files -s`, which is cheap even for large
+    repositories. Only valid for a clean checkout, which is what the clone
+    routes produce. Returns {} if repo_dir is not a git working tree.
+    """
+    try:
+        output = git.Repo(repo_dir).git.ls_files("-s", "-z")
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError, git.GitCommandError):
+        return {}
+    shas = {}
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, sha, _ = meta.split(" ")
+        # Skip submodules (gitlinks) and symlinks
+        if mode.startswith("100"):
+            shas[os.path.normpath(path)] = sha
+    return shas
+
+class FileClassifier:
+    """
+    Classifies files into Magika (group, label) pairs.
+
+    Files whose git blob SHA is in the classification cache are answered
+    from it. Other cheap cases are settled by a pre-filter: empty and
+    oversized files, well-known binary extensions, and well-known text
+    extensions whose first bytes contain no NUL. The rest are sent to Magika
+    in batches (identify_paths) spread over a thread pool; the Magika model
+    is loaded on first use.
+    """
+
+    def __init__(self,
+                 workers: int = 4,
+                 batch_size: int = 128,
+                 max_file_bytes: int = MAX_FILE_BYTES,
+                 cache: Optional[ClassificationCache] = None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_file_bytes = max_file_bytes
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._magika: Optional[magika.Magika] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _model(self) -> magika.Magika:
+        with self._lock:
+            if self._magika is None:
+                self._magika = magika.Magika()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="magika")
+            return self._magika
+
+    def warm_up(self):
+        """Load the Magika model now rather than on the first classification."""
+        self._model()
+
+    def prefilter_by_name(self, path: str, size: int) -> Optional[Tuple[str, str]]:
+        """Return (group, label) from the size and extension alone, or None if the content is needed."""
+        if size == 0:
+            return "inode", "empty"
+        if size > self.max_file_bytes:
+            return "unknown", "oversized"
+        ext = os.path.splitext(path)[1].lower()
+        if ext in BINARY_EXTENSIONS:
+            return BINARY_EXTENSIONS[ext], ext.lstrip(".")
+        return None
+
+    def prefilter(self, path: str, size: int, content: Optional[bytes] = None) -> Optional[Tuple[str, str]]:
+        """
+        Return (group, label) without the model, or None if Magika is needed.
+
+        Text extensions are sniffed from `content` if given, else from the file at `path`.
+        """
+        decided = self.prefilter_by_name(path, size)
+        if decided is not None:
+            return decided
+        ext = os.path.splitext(path)[1].lower()
+        if ext in TEXT_EXTENSIONS:
+            if content is not None:
+                head = content[:SNIFF_BYTES]
+            else:
+                try:
+                    with open(path, "rb") as f:
+                        head = f.read(SNIFF_BYTES)
+                except OSError:
+                    return "unknown", "unreadable"
+            if b"\0" in head:
+                return None
+            label = TEXT_EXTENSIONS[ext]
+            return ("text" if label in ("markdown", "rst", "txt", "csv") else "code"), label
+        return None
+
+    def _identify_batch(self, paths: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+        results = self._model().identify_paths([Path(p) for p in paths])
+        return [(r.output.group, str(r.output.label)) if r.ok else (None, None) for r in results]
+
+    def _identify_contents(self, contents: List[Optional[bytes]]) -> List[Tuple[Optional[str], Optional[str]]]:
+        model = self._model()
+        results = [model.identify_bytes(content) if content is not None else None for content in contents]
+        return [(r.output.group, str(r.output.label)) if r is not None and r.ok else (None, None) for r in results]
+
+    def classify(self, files: List[Tuple[str, int]],
+                 stats: Optional[ClassificationStats] = None,
+                 shas: Optional[List[Optional[str]]] = None,
+                 contents: Optional[List[Optional[bytes]]] = None) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Classify many files at once.
+
+        Args:
+            files: (absolute path, size) pairs; with `contents`, the paths are only used for their extension
+            stats: Optional counters to accumulate into
+            shas: Optional git blob SHA per file, enabling the classification cache
+            contents: Optional bytes per file (e.g. git blobs) to classify instead of reading
+                the paths; None for files that prefilter_by_name settles
+
+        Returns:
+            A (group, label) pair per file, in order; (None, None) if unreadable
+        """
+        started = time.monotonic()
+        results: List[Tuple[Optional[str], Optional[str]]] = [(None, None)] * len(files)
+        use_cache = self.cache is not None and shas is not None
+        cached = self.cache.get_many([sha for sha in shas if sha]) if use_cache else {}
+        pending = []
+        hits = 0
+        for i, (path, size) in enumerate(files):
+            if use_cache and shas[i] in cached:
+                results[i] = cached[shas[i]][:2]
+                hits += 1
+                continue
+            decided = self.prefilter(path, size, contents[i] if contents is not None else None)
+            if decided is None:
+                pending.append(i)
+            else:
+                results[i] = decided
+
+        if pending:
+            self._model()
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            if contents is not None:
+                futures = [self._executor.submit(self._identify_contents, [contents[i] for i in batch])
+                           for batch in batches]
+            else:
+                futures = [self._executor.submit(self._identify_batch, [files[i][0] for i in batch])
+                           for batch in batches]
+            for batch, future in zip(batches, futures):
+                for i, result in zip(batch, future.result()):
+                    results[i] = result
+
+        if use_cache:
+            self.cache.put_many([(shas[i], *results[i]) for i in range(len(files))
+                                 if shas[i] and shas[i] not in cached])
+
+        if stats is not None:
+            stats.files += len(files)
+            stats.cached += hits
+            stats.prefiltered += len(files) - len(pending) - hits
+            stats.model += len(pending)
+            stats.seconds += time.monotonic() - started
+        return results
+
+@dataclass
+class FileRecord:
+    """One file found while walking a repository."""
+    path: str
+    size: int
+    group: Optional[str] = None
+    label: Optional[str] = None
+    content: Optional[bytes] = None
+    blob_sha: Optional[str] = None
+    # True when the byte budget ran out before this file was read
+    over_budget: bool = False
+
+@dataclass
+class ExtractStats:
+    """What extract_code wrote, plus what it left out."""
+    code_index: List[str] = field(default_factory=list)
+    included_files: int = 0
+    char_count: int = 0
+    byte_count: int = 0
+    truncated: bool = False
+    skipped_files: int = 0
+    classification: ClassificationStats = field(default_factory=ClassificationStats)
+    # (path, byte offset, byte length) of each included file's text within the output
+    files: List[Tuple[str, int, int]] = field(default_factory=list)
+    # Git blob SHA of each indexed file, when known; lets the next commit be extracted incrementally
+    blob_shas: Dict[str, str] = field(default_factory=dict)
+    # Files copied unchanged from the base snapshot of an incremental extraction
+    reused_files: int = 0
+    # Set by incremental extraction: base_snapshot_id, base_commit and the added/modified/deleted paths
+    changes: Optional[Dict[str, Any]] = None
+
+def glob_filter(patterns: Optional[List[str]]) -> Optional[Callable[[str], bool]]:
+    """
+    Build a path filter from glob patterns matched against posix paths
+    relative to the repository root (`*` also matches `/`). A pattern ending
+    in `/` selects a whole directory. Returns None for no patterns.
+    """
+    patterns = [p.strip() for p in patterns or [] if p.strip()]
+    if not patterns:
+        return None
+
+    def matches(path: str) -> bool:
+        path = path.replace(os.sep, "/")
+        return any(path.startswith(p) if p.endswith("/") else fnmatch.fnmatch(path, p) for p in patterns)
+    return matches
+
+def _walk(repo_dir: str) -> Iterator[Tuple[str, str, int]]:
+    """Yield (absolute path, relative path, size) for every file outside .git."""
+    for root, dirs, files in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in files:
+            # Worktrees have a .git file pointing at the mirror
+            if name == ".git":
+                continue
+            file_path = os.path.join(root, name)
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            yield file_path, os.path.relpath(file_path, repo_dir), size
+
+def iter_files(repo_dir: str,
+               classifier: Optional[FileClassifier] = None,
+               max_bytes: Optional[int] = None,
+               stats: Optional[ClassificationStats] = None,
+               chunk_size: int = 1024,
+               path_filter: Optional[Callable[[str], bool]] = None) -> Iterator[FileRecord]:
+    """
+    Walk a checkout and yield a FileRecord per file, skipping .git.
+
+    Files are classified `chunk_size` at a time, so Magika sees large batches
+    while memory stays bounded. Files classified as text or code carry their
+    bytes in `content`; everything else is yielded with content None. Once the
+    contents would exceed `max_bytes`, that file and all later ones are still
+    yielded (so the index stays complete) but are not read, and later chunks
+    are not classified.
+
+    Args:
+        repo_dir: Root of the checkout
+        classifier: FileClassifier to use (defaults to the shared one)
+        max_bytes: Optional budget for the total size of yielded contents
+        stats: Optional classification counters to accumulate into
+        chunk_size: Number of files classified per round
+        path_filter: Optional predicate on relative paths; other files are left out entirely
+    """
+    classifier = classifier or file_classifier
+    shas = blob_shas(repo_dir) if classifier.cache is not None else {}
+    used = 0
+    exhausted = False
+    walker = _walk(repo_dir)
+    if path_filter is not None:
+        walker = (entry for entry in walker if path_filter(entry[1]))
+    while True:
+        chunk = list(itertools.islice(walker, chunk_size))
+        if not chunk:
+            return
+        # Once the budget is spent, later chunks are not classified at all
+        chunk_shas = [shas.get(relative_path) for _, relative_path, _ in chunk]
+        labels = [] if exhausted else classifier.classify([(path, size) for path, _, size in chunk], stats, chunk_shas)
+
+        for i, (file_path, relative_path, size) in enumerate(chunk):
+            record = FileRecord(path=relative_path, size=size, blob_sha=chunk_shas[i])
+            if not exhausted:
+                record.group, record.label = labels[i]
+                if record.group in ("text", "code") and max_bytes is not None and used + size > max_bytes:
+                    exhausted = True
+            if exhausted:
+                record.over_budget = True
+            elif record.group in ("text", "code"):
+                try:
+                    with open(file_path, "rb") as f:
+                        record.content = f.read()
+                    used += len(record.content)
+                except OSError:
+                    # Ignore files that can't be read
+                    pass
+            yield record
+
+def _tree_entries(repo: git.Repo, commit_sha: str) -> Iterator[Tuple[str, str, int]]:
+    """Yield (path, blob SHA, size) for every regular file in a commit's tree, from `git ls-tree`."""
+    for entry in repo.git.ls_tree("-r", "-l", "-z", commit_sha).split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, kind, sha, size = meta.split()
+        # Skip submodules (commits) and symlinks
+        if kind == "blob" and mode.startswith("100"):
+            yield path, sha, int(size)
+
+def iter_tree_files(repo: git.Repo,
+                    commit_sha: str,
+                    classifier: Optional[FileClassifier] = None,
+                    max_bytes: Optional[int] = None,
+                    stats: Optional[ClassificationStats] = None,
+                    chunk_size: int = 1024,
+                    path_filter: Optional[Callable[[str], bool]] = None,
+                    base: Optional["Snapshot"] = None,
+                    changes: Optional[Dict[str, List[str]]] = None) -> Iterator[FileRecord]:
+    """
+    Like iter_files, but read a commit straight from the git object database.
+
+    The tree is listed with `git ls-tree` (which also gives every blob's
+    size) and blobs are streamed through GitPython's persistent
+    `git cat-file --batch` process, so no working tree is written or read.
+    Blobs that prefilter_by_name settles (empty, oversized, binary
+    extensions) are never read; the others are read once and the same bytes
+    are classified and, for text and code, yielded. Reading stops for good
+    once the byte budget is spent.
+
+    With a `base` snapshot of an earlier commit (extracted in full, with blob
+    SHAs), files whose blob is unchanged are neither read nor classified:
+    their text is copied from the base and their records carry label
+    "unchanged". The added, modified and deleted paths are collected into
+    `changes` if given.
+
+    Args:
+        repo: Repository (bare mirrors work) containing commit_sha with its blobs
+        commit_sha: Commit to read
+        classifier: FileClassifier to use (defaults to the shared one)
+        max_bytes: Optional budget for the total size of yielded contents
+        stats: Optional classification counters to accumulate into
+        chunk_size: Number of files classified per round
+        path_filter: Optional predicate on relative paths; other files are left out entirely
+        base: Optional snapshot to copy unchanged files from
+        changes: Optional dict to fill with "added", "modified" and "deleted" path lists
+    """
+    classifier = classifier or file_classifier
+    base_shas = base.blob_shas if base is not None else {}
+    base_included = base.included_paths() if base is not None else set()
+    if changes is not None:
+        changes.update(added=[], modified=[], deleted=[])
+    seen = set()
+    used = 0
+    exhausted = False
+    entries = _tree_entries(repo, commit_sha)
+    if path_filter is not None:
+        entries = (entry for entry in entries if path_filter(entry[0]))
+    while True:
+        chunk = list(itertools.islice(entries, chunk_size))
+        if not chunk:
+            break
+        unchanged = [base_shas.get(path) == sha for path, sha, _ in chunk]
+        fresh = [i for i, same in enumerate(unchanged) if not same]
+        labels: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        contents: Dict[int, Optional[bytes]] = {}
+        if not exhausted and fresh:
+            for i in fresh:
+                path, sha, size = chunk[i]
+                contents[i] = repo.git.get_object_data(sha)[3] if classifier.prefilter_by_name(path, size) is None else None
+            results = classifier.classify([(chunk[i][0], chunk[i][2]) for i in fresh], stats,
+                                          [chunk[i][1] for i in fresh], [contents[i] for i in fresh])
+            labels = dict(zip(fresh, results))
+
+        for i, (path, sha, size) in enumerate(chunk):
+            seen.add(path)
+            record = FileRecord(path=path, size=size, blob_sha=sha)
+            if unchanged[i]:
+                record.label = "unchanged"
+                content = base.file_bytes(path) if path in base_included and not exhausted else None
+                if content is not None and max_bytes is not None and used + size > max_bytes:
+                    exhausted = True
+                if not exhausted:
+                    record.content = content
+                    used += size if content is not None else 0
+            else:
+                if changes is not None:
+                    changes["modified" if path in base_shas else "added"].append(path)
+                if not exhausted:
+                    record.group, record.label = labels[i]
+                    if record.group in ("text", "code") and max_bytes is not None and used + size > max_bytes:
+                        exhausted = True
+                if not exhausted and record.group in ("text", "code") and contents.get(i) is not None:
+                    record.content = contents[i]
+                    used += size
+            if exhausted:
+                record.over_budget = True
+            yield record
+
+    if changes is not None:
+        changes["deleted"] = sorted(path for path in base_shas if path not in seen)
+
+def _write_records(records: Iterable[FileRecord],
+                   out: TextIO,
+                   classifier: FileClassifier,
+                   progress: Optional[Callable[[ExtractStats], None]],
+                   progress_every: int,
+                   stats: ExtractStats) -> ExtractStats:
+    """Write FileRecords as `----- File: <path> -----` blocks into `out`, filling in stats."""
+    text_lengths = []
+    offset = 0
+    for record in records:
+        stats.code_index.append(record.path)
+        if record.blob_sha:
+            stats.blob_shas[record.path] = record.blob_sha
+        if progress is not None and len(stats.code_index) % progress_every == 0:
+            progress(stats)
+        if record.over_budget:
+            stats.truncated = True
+            stats.skipped_files += 1
+        if record.content is None:
+            continue
+        text = record.content.decode("utf-8", errors="ignore")
+        header = f"----- File: {record.path} -----\n"
+        block = f"{header}{text}\n-------------------------\n"
+        out.write(block)
+        header_bytes = len(header.encode("utf-8"))
+        block_bytes = len(block.encode("utf-8"))
+        stats.files.append((record.path, offset + header_bytes, block_bytes - header_bytes - FOOTER_BYTES))
+        offset += block_bytes
+        stats.included_files += 1
+        stats.char_count += len(block)
+        stats.byte_count += len(record.content)
+        if record.blob_sha:
+            text_lengths.append((len(text), record.blob_sha))
+    if classifier.cache is not None:
+        classifier.cache.set_text_lengths(text_lengths)
+    if progress is not None:
+        progress(stats)
+    return stats
+
+def extract_code(repo_dir: str,
+                 out: TextIO,
+                 classifier: Optional[FileClassifier] = None,
+                 max_bytes: Optional[int] = MAX_CODE_BYTES,
+                 progress: Optional[Callable[[ExtractStats], None]] = None,
+                 progress_every: int = 256,
+                 path_filter: Optional[Callable[[str], bool]] = None) -> ExtractStats:
+    """
+    Stream a checkout's text and code files into `out` in one pass.
+
+    Each included file is written as a `----- File: <path> -----` block, so
+    memory use is bounded by the largest single file rather than the repo.
+
+    Args:
+        repo_dir: Root of the checkout
+        out: Text stream to write to (a snapshot's spill file, io.StringIO, ...)
+        classifier: FileClassifier to use (defaults to the shared one)
+        max_bytes: Budget for included file contents; None for unlimited
+        progress: Optional callback given the running stats every
+            `progress_every` files and at the end; it may raise to abort
+        path_filter: Optional predicate on relative paths; other files are left out entirely
+
+    Returns:
+        ExtractStats: The file index and size counters
+    """
+    classifier = classifier or file_classifier
+    stats = ExtractStats()
+    records = iter_files(repo_dir, classifier, max_bytes, stats.classification, path_filter=path_filter)
+    return _write_records(records, out, classifier, progress, progress_every, stats)
+
+def extract_tree(repo: git.Repo,
+                 commit_sha: str,
+                 out: TextIO,
+                 classifier: Optional[FileClassifier] = None,
+                 max_bytes: Optional[int] = MAX_CODE_BYTES,
+                 progress: Optional[Callable[[ExtractStats], None]] = None,
+                 progress_every: int = 256,
+                 path_filter: Optional[Callable[[str], bool]] = None,
+                 base: Optional["Snapshot"] = None) -> ExtractStats:
+    """
+    extract_code for a commit in the git object database instead of a checkout.
+
+    Produces the same output and stats as extract_code on a clean checkout
+    of commit_sha (see iter_tree_files). With a `base` snapshot of an earlier
+    commit, unchanged files are copied from it and the stats record the
+    changes since that commit.
+    """
+    classifier = classifier or file_classifier
+    stats = ExtractStats()
+    changes: Optional[Dict[str, Any]] = {} if base is not None else None
+    records = iter_tree_files(repo, commit_sha, classifier, max_bytes, stats.classification,
+                              path_filter=path_filter, base=base, changes=changes)
+
+    def count_reused(records: Iterable[FileRecord]) -> Iterator[FileRecord]:
+        for record in records:
+            if record.label == "unchanged" and record.content is not None:
+                stats.reused_files += 1
+            yield record
+
+    _write_records(count_reused(records), out, classifier, progress, progress_every, stats)
+    if base is not None:
+        stats.changes = {"base_snapshot_id": base.snapshot_id, "base_commit": base.commit_sha, **changes}
+    return stats
+
+class Snapshot:
+    """
+    An extracted repository at a single commit.
+
+    The file index is kept in memory; the concatenated code text stays on disk
+    and is memory-mapped so that many open snapshots cost little resident memory.
+    """
+
+    def __init__(self, snapshot_id: str, path: str, meta: Dict[str, Any]):
+        self.snapshot_id = snapshot_id
+        self.path = path
+        self.repo_url = meta["repo_url"]
+        self.commit_sha = meta["commit_sha"]
+        self.include: Optional[List[str]] = meta.get("include")
+        self.created_at = meta["created_at"]
+        self.code_index: List[str] = meta["code_index"]
+        self.char_count = meta["char_count"]
+        self.included_files = meta.get("included_files", len(self.code_index))
+        self.truncated = meta.get("truncated", False)
+        self.skipped_files = meta.get("skipped_files", 0)
+        self.classification = ClassificationStats(**meta.get("classification", {}))
+        self.files: List[Tuple[str, int, int]] = [tuple(entry) for entry in meta.get("files", [])]
+        self.blob_shas: Dict[str, str] = meta.get("blob_shas", {})
+        self.reused_files = meta.get("reused_files", 0)
+        self.changes: Optional[Dict[str, Any]] = meta.get("changes")
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._offsets: Optional[Dict[str, Tuple[int, int]]] = None
+
+    @property
+    def text_path(self) -> str:
+        return os.path.join(self.path, "code.txt")
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        with self._lock:
+            if self._map is None and os.path.getsize(self.text_path) > 0:
+                with open(self.text_path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+
+    @property
+    def byte_size(self) -> int:
+        return os.path.getsize(self.text_path)
+
+    def read_text(self) -> str:
+        """Return the concatenated code text."""
+        mapped = self._mapped()
+        return mapped[:].decode("utf-8") if mapped is not None else ""
+
+    def iter_files(self) -> Iterator[Tuple[str, str]]:
+        """Yield (path, text) for each included file, in extraction order."""
+        mapped = self._mapped()
+        if mapped is None:
+            return
+        if not self.files:
+            # Snapshots written before per-file offsets were recorded
+            for match in re.finditer(r"^----- File: (.*?) -----\n(.*?)\n-------------------------$",
+                                     mapped[:].decode("utf-8"), re.S | re.M):
+                yield match.group(1), match.group(2)
+            return
+        for path, offset, length in self.files:
+            yield path, mapped[offset:offset + length].decode("utf-8", errors="ignore")
+
+    def included_paths(self) -> set:
+        """Paths whose text is part of the snapshot."""
+        return {path for path, _, _ in self.files}
+
+    def file_bytes(self, path: str) -> Optional[bytes]:
+        """The stored (UTF-8) text of one included file, or None."""
+        if self._offsets is None:
+            self._offsets = {path: (offset, length) for path, offset, length in self.files}
+        span = self._offsets.get(path)
+        mapped = self._mapped()
+        if span is None or mapped is None:
+            return None
+        return mapped[span[0]:span[0] + span[1]]
+
+    def changes_summary(self, max_paths: int = 50) -> Optional[Dict[str, Any]]:
+        """Counts and the first `max_paths` paths of the changes since the base snapshot, if incremental."""
+        if not self.changes:
+            return None
+        changed = self.changes["added"] + self.changes["modified"] + self.changes["deleted"]
+        return {
+            "base_snapshot_id": self.changes["base_snapshot_id"],
+            "base_commit": self.changes["base_commit"],
+            "added": len(self.changes["added"]),
+            "modified": len(self.changes["modified"]),
+            "deleted": len(self.changes["deleted"]),
+            "paths": changed[:max_paths]
+        }
+
+    def read_files(self, paths) -> Iterator[Tuple[str, str]]:
+        """Yield (path, text) for the given paths only, reading just their byte ranges."""
+        paths = set(paths)
+        if not self.files:
+            yield from ((path, text) for path, text in self.iter_files() if path in paths)
+            return
+        mapped = self._mapped()
+        if mapped is None:
+            return
+        for path, offset, length in self.files:
+            if path in paths:
+                yield path, mapped[offset:offset + length].decode("utf-8", errors="ignore")
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    def summary(self) -> Dict[str, Any]:
+        """Stats returned to the browser in place of the code itself."""
+        return {
+            "snapshot_id": self.snapshot_id,
+            "repo_url": self.repo_url,
+            "commit_sha": self.commit_sha,
+            "include": self.include,
+            "created_at": self.created_at,
+            "file_count": len(self.code_index),
+            "char_count": self.char_count,
+            "byte_size": self.byte_size,
+            "included_files": self.included_files,
+            "truncated": self.truncated,
+            "skipped_files": self.skipped_files,
+            "reused_files": self.reused_files,
+            "changes": self.changes_summary(),
+            "classification": {
+                **asdict(self.classification),
+                "files_per_second": self.classification.files_per_second
+            }
+        }
+
+class SnapshotStore:
+    """
+    On-disk store of repository snapshots keyed by repo URL + commit SHA.
+
+    Each snapshot lives in `<root>/<snapshot_id>/` as `meta.json` (index and
+    stats) and `code.txt` (concatenated code). At most `max_open` snapshots are
+    kept open (memory-mapped) at a time; older ones are closed but stay on disk.
+
+    Snapshots in use (see `use`) are reference-counted. When `quota_bytes` is
+    set, each new snapshot triggers a collection that deletes the least
+    recently used unreferenced snapshots until the store fits the quota.
+    Reference counts are per process.
+    """
+
+    def __init__(self, root: str, max_open: int = 32, quota_bytes: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.root = root
+        self.max_open = max_open
+        self.quota_bytes = quota_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, Snapshot]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+
+    @staticmethod
+    def make_id(repo_url: str, commit_sha: str, include: Optional[List[str]] = None) -> str:
+        key = f"{repo_url.strip()}@{commit_sha}"
+        if include:
+            # Path-filtered snapshots of a commit are distinct snapshots
+            key += ":" + ",".join(sorted(include))
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _remember(self, snapshot: Snapshot):
+        """Caller must hold self._lock."""
+        self._open[snapshot.snapshot_id] = snapshot
+        self._open.move_to_end(snapshot.snapshot_id)
+        while len(self._open) > self.max_open:
+            _, evicted = self._open.popitem(last=False)
+            evicted.close()
+
+    def get(self, snapshot_id: str) -> Optional[Snapshot]:
+        """Return a snapshot by ID, or None if it does not exist."""
+        # IDs come from the browser; only accept our own hex format
+        if not snapshot_id or not all(c in "0123456789abcdef" for c in snapshot_id):
+            return None
+        with self._lock:
+            snapshot = self._open.get(snapshot_id)
+            if snapshot is not None:
+                self._open.move_to_end(snapshot_id)
+                return snapshot
+            path = os.path.join(self.root, snapshot_id)
+            try:
+                with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            snapshot = Snapshot(snapshot_id, path, meta)
+            self._remember(snapshot)
+            return snapshot
+
+    def _latest_path(self, repo_url: str, include: Optional[List[str]]) -> str:
+        # Dot-files are not snapshots as far as _entries is concerned
+        return os.path.join(self.root, ".latest-" + self.make_id(repo_url, "", include))
+
+    def latest(self, repo_url: str, include: Optional[List[str]] = None) -> Optional[str]:
+        """ID of the most recently stored snapshot of a repository (with the same path filter), if any."""
+        try:
+            with open(self._latest_path(repo_url, include), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def find(self, repo_url: str, commit_sha: str, include: Optional[List[str]] = None) -> Optional[Snapshot]:
+        """Return the snapshot for a repo at a commit, if it has been extracted before."""
+        return self.get(self.make_id(repo_url, commit_sha, include))
+
+    @contextmanager
+    def hold(self, snapshot_id: str) -> Iterator[None]:
+        """Reference a snapshot ID, which need not exist yet, so garbage collection skips it."""
+        with self._lock:
+            self._refs[snapshot_id] = self._refs.get(snapshot_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._refs[snapshot_id] -= 1
+                if not self._refs[snapshot_id]:
+                    del self._refs[snapshot_id]
+
+    @contextmanager
+    def use(self, snapshot_id: str) -> Iterator[Optional[Snapshot]]:
+        """
+        Hold a reference to a snapshot for the duration of the block.
+
+        Yields None if the snapshot does not exist. Also marks the snapshot as
+        recently used.
+        """
+        with self.hold(snapshot_id):
+            snapshot = self.get(snapshot_id)
+            if snapshot is not None:
+                try:
+                    os.utime(os.path.join(snapshot.path, "meta.json"))
+                except OSError:
+                    pass
+            yield snapshot
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(last used, size in bytes, snapshot_id) for every published snapshot."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                last_used = os.path.getmtime(os.path.join(path, "meta.json"))
+            except OSError:
+                continue
+            entries.append((last_used, size, name))
+        return entries
+
+    def disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def collect(self, keep: Tuple[str, ...] = ()) -> List[str]:
+        """
+        Delete least recently used, unreferenced snapshots until under quota.
+
+        Args:
+            keep: Snapshot IDs that must survive this collection
+
+        Returns:
+            The IDs of the deleted snapshots
+        """
+        if self.quota_bytes is None:
+            return []
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, snapshot_id in entries:
+            if total <= self.quota_bytes:
+                break
+            with self._lock:
+                if self._refs.get(snapshot_id) or snapshot_id in keep:
+                    continue
+                snapshot = self._open.pop(snapshot_id, None)
+                if snapshot is not None:
+                    snapshot.close()
+                shutil.rmtree(os.path.join(self.root, snapshot_id), ignore_errors=True)
+            total -= size
+            removed.append(snapshot_id)
+        if removed:
+            self.logger.info(f"Collected {len(removed)} snapshot(s); store is now {total} bytes")
+        return removed
+
+    @contextmanager
+    def writer(self, repo_url: str, commit_sha: str,
+               include: Optional[List[str]] = None) -> Iterator["PendingSnapshot"]:
+        """
+        Build a snapshot by streaming its code text straight to disk.
+
+        Write the code to `pending.file` and assign `pending.stats` (an
+        ExtractStats) before the block exits; the snapshot is published
+        atomically on success and discarded on error. `include` records the
+        path filter the code was extracted with.
+
+            with store.writer(url, sha) as pending:
+                pending.stats = extract_code(repo_dir, pending.file)
+            snapshot = pending.snapshot
+        """
+        snapshot_id = self.make_id(repo_url, commit_sha, include)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{snapshot_id}-", dir=self.root)
+        try:
+            with open(os.path.join(tmp_dir, "code.txt"), "w", encoding="utf-8") as f:
+                pending = PendingSnapshot(file=f)
+                yield pending
+            stats = pending.stats or ExtractStats()
+            meta = {
+                "repo_url": repo_url,
+                "commit_sha": commit_sha,
+                "include": sorted(include) if include else None,
+                "created_at": time.time(),
+                **asdict(stats)
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            final_dir = os.path.join(self.root, snapshot_id)
+            with self._lock:
+                if self._refs.get(snapshot_id) and os.path.exists(final_dir):
+                    # A concurrent job already published this commit and it may be being read
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                else:
+                    stale = self._open.pop(snapshot_id, None)
+                    if stale is not None:
+                        stale.close()
+                    if os.path.exists(final_dir):
+                        shutil.rmtree(final_dir)
+                    os.replace(tmp_dir, final_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.logger.info(f"Stored snapshot {snapshot_id} for {repo_url}@{commit_sha[:12]}")
+        fd, tmp_path = tempfile.mkstemp(prefix=".latest-", dir=self.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(snapshot_id)
+        os.replace(tmp_path, self._latest_path(repo_url, include))
+        self.collect(keep=(snapshot_id,))
+        pending.snapshot = self.get(snapshot_id)
+
+@dataclass
+class PendingSnapshot:
+    """Handle yielded by SnapshotStore.writer while a snapshot is being built."""
+    file: TextIO
+    stats: Optional[ExtractStats] = None
+    snapshot: Optional[Snapshot] = None
+
+@dataclass
+class SnapshotDiff:
+    """Files added, modified and deleted between two snapshots of a repository."""
+    old_snapshot_id: str
+    old_commit: str
+    new_snapshot_id: str
+    new_commit: str
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    # Size of the new text of added and modified files plus the old text of deleted ones
+    changed_bytes: int = 0
+
+    @property
+    def changed(self) -> int:
+        return len(self.added) + len(self.modified) + len(self.deleted)
+
+    def summary(self, max_paths: int = 50) -> Dict[str, Any]:
+        """Summary for API responses."""
+        return {
+            "since_snapshot_id": self.old_snapshot_id,
+            "since_commit": self.old_commit,
+            "commit_sha": self.new_commit,
+            "added": len(self.added),
+            "modified": len(self.modified),
+            "deleted": len(self.deleted),
+            "changed_bytes": self.changed_bytes,
+            "paths": (self.added + self.modified + self.deleted)[:max_paths]
+        }
+
+    def iter_patches(self, old: "Snapshot", new: "Snapshot", context_lines: int = 3) -> Iterator[Tuple[str, str]]:
+        """
+        Yield (path, text) describing each change, in path order: a unified
+        diff for modified files, the full text for added ones and a one-line
+        note for deleted ones and for files whose text is not in the snapshots.
+        """
+        old_texts = dict(old.read_files(self.modified + self.deleted))
+        new_texts = dict(new.read_files(self.added + self.modified))
+        for path in sorted(self.added + self.modified + self.deleted):
+            if path in self.deleted:
+                yield path, "(file deleted)"
+            elif path in self.added:
+                yield path, new_texts.get(path, "(new file; content not indexed)")
+            elif path in old_texts and path in new_texts:
+                yield path, "".join(difflib.unified_diff(
+                    old_texts[path].splitlines(keepends=True), new_texts[path].splitlines(keepends=True),
+                    f"a/{path}", f"b/{path}", n=context_lines
+                ))
+            else:
+                yield path, "(file changed; content not indexed)"
+
+def _fingerprints(snapshot: "Snapshot") -> Dict[str, Optional[str]]:
+    """Blob SHA per indexed path; snapshots without SHAs fall back to a hash of the stored text."""
+    if snapshot.blob_shas:
+        return {path: snapshot.blob_shas.get(path) for path in snapshot.code_index}
+    return {path: hashlib.sha1(snapshot.file_bytes(path) or b"").hexdigest() for path in snapshot.code_index}
+
+def diff_snapshots(old: "Snapshot", new: "Snapshot") -> SnapshotDiff:
+    """Compare two snapshots file by file."""
+    diff = SnapshotDiff(old.snapshot_id, old.commit_sha, new.snapshot_id, new.commit_sha)
+    if new.changes and new.changes["base_snapshot_id"] == old.snapshot_id:
+        # Recorded by the incremental extraction
+        diff.added, diff.modified, diff.deleted = (list(new.changes[kind]) for kind in ("added", "modified", "deleted"))
+    else:
+        before, after = _fingerprints(old), _fingerprints(new)
+        diff.added = sorted(path for path in after if path not in before)
+        diff.modified = sorted(path for path in after if path in before and after[path] != before[path])
+        diff.deleted = sorted(path for path in before if path not in after)
+    diff.changed_bytes = (sum(len(new.file_bytes(path) or b"") for path in diff.added + diff.modified)
+                          + sum(len(old.file_bytes(path) or b"") for path in diff.deleted))
+    return diff
+
+def remote_head(repo_url: str) -> Optional[str]:
+    """
+    Resolve the commit SHA of a remote's HEAD without cloning.
+
+    Returns None if the remote cannot be queried, in which case callers clone
+    and read the SHA from the checkout.
+    """
+    try:
+        output = git.cmd.Git().ls_remote(repo_url, "HEAD")
+    except git.GitCommandError:
+        return None
+    return output.split()[0] if output else None
+
+class CloneManager:
+    """
+    Keeps one shallow bare mirror per repository URL and checks out from it.
+
+    The first request for a URL does a depth-limited, single-branch bare
+    clone (optionally blobless, in which case blobs are fetched on checkout).
+    Later requests refresh the mirror with a shallow `fetch` and materialize
+    a detached worktree, so re-analysing a repository only transfers new
+    commits instead of re-cloning it.
+    """
+
+    def __init__(self, root: str, depth: int = 1, blobless: bool = False,
+                 logger: Optional[logging.Logger] = None):
+        self.root = root
+        self.depth = depth
+        self.blobless = blobless
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+
+    def mirror_path(self, repo_url: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(repo_url.strip().encode("utf-8")).hexdigest()[:16] + ".git")
+
+    def _url_lock(self, repo_url: str) -> threading.Lock:
+        with self._lock:
+            return self._url_locks.setdefault(repo_url.strip(), threading.Lock())
+
+    def _clone_mirror(self, repo_url: str, path: str) -> git.Repo:
+        options = {"bare": True, "depth": self.depth, "single_branch": True}
+        if self.blobless:
+            options["filter"] = "blob:none"
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=".clone-", dir=self.root)
+        try:
+            git.Repo.clone_from(repo_url, tmp_path, **options)
+            os.replace(tmp_path, path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return git.Repo(path)
+
+    def mirror(self, repo_url: str) -> Tuple[git.Repo, str]:
+        """
+        Create or refresh the mirror for repo_url.
+
+        Returns:
+            (mirror repo, commit SHA of the remote HEAD)
+        """
+        path = self.mirror_path(repo_url)
+        with self._url_lock(repo_url):
+            if not os.path.isdir(path):
+                started = time.monotonic()
+                repo = self._clone_mirror(repo_url, path)
+                self.logger.info(f"Mirrored {repo_url} in {time.monotonic() - started:.1f}s")
+                return repo, repo.head.commit.hexsha
+            repo = git.Repo(path)
+            try:
+                repo.git.fetch("origin", "HEAD", depth=self.depth)
+            except git.GitCommandError as e:
+                # A broken mirror is cheaper to recreate than to repair
+                self.logger.warning(f"Refreshing mirror of {repo_url} failed ({e}); re-cloning")
+                shutil.rmtree(path, ignore_errors=True)
+                repo = self._clone_mirror(repo_url, path)
+                return repo, repo.head.commit.hexsha
+            repo.git.update_ref("HEAD", "FETCH_HEAD")
+            return repo, repo.head.commit.hexsha
+
+    def checkout(self, repo_url: str, dest: str) -> str:
+        """
+        Materialize the remote HEAD of repo_url as a worktree at dest.
+
+        Anything already at dest is replaced. Returns the checked-out commit SHA.
+        """
+        repo, sha = self.mirror(repo_url)
+        with self._url_lock(repo_url):
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            repo.git.worktree("prune")
+            repo.git.worktree("add", "--force", "--detach", os.path.abspath(dest), sha)
+        return sha
+
+    def prune(self, repo_url: str):
+        """Forget worktrees of repo_url's mirror whose directories were deleted."""
+        path = self.mirror_path(repo_url)
+        with self._url_lock(repo_url):
+            if os.path.isdir(path):
+                git.Repo(path).git.worktree("prune")
+
+@dataclass
+class Workspace:
+    """A job's private checkout."""
+    path: str
+    commit_sha: str
+
+class WorkspaceManager:
+    """
+    Allocates a private checkout directory per job.
+
+    Jobs no longer share a single checkout directory, so concurrent
+    ingestions cannot wipe each other's files. At most `max_concurrent_clones`
+    checkouts run at once; workspaces are deleted when the job finishes, and
+    leftovers older than `max_age` seconds (from crashed processes) are swept
+    before the first checkout.
+    """
+
+    def __init__(self, root: str, clones: CloneManager, max_concurrent_clones: int = 2,
+                 max_age: float = 24 * 3600, logger: Optional[logging.Logger] = None):
+        self.root = root
+        self.clones = clones
+        self.max_age = max_age
+        self.logger = logger or logging.getLogger(__name__)
+        self._clone_slots = threading.BoundedSemaphore(max_concurrent_clones)
+        self._lock = threading.Lock()
+        self.active = 0
+        self._swept = False
+
+    def sweep(self):
+        """Delete abandoned job directories."""
+        cutoff = time.time() - self.max_age
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.startswith("job-") and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def mirror(self, repo_url: str) -> Tuple[git.Repo, str]:
+        """Refresh repo_url's mirror within the clone limit, without checking it out."""
+        with self._clone_slots:
+            return self.clones.mirror(repo_url)
+
+    @contextmanager
+    def checkout(self, repo_url: str) -> Iterator[Workspace]:
+        """
+        Check out repo_url's HEAD into a fresh directory for the duration of the block.
+
+            with workspaces.checkout(url) as workspace:
+                extract_code(workspace.path, out)
+        """
+        with self._lock:
+            if not self._swept:
+                os.makedirs(self.root, exist_ok=True)
+                self.sweep()
+                self._swept = True
+            path = tempfile.mkdtemp(prefix="job-", dir=self.root)
+            self.active += 1
+        try:
+            with self._clone_slots:
+                commit_sha = self.clones.checkout(repo_url, path)
+            yield Workspace(path=path, commit_sha=commit_sha)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                self.clones.prune(repo_url)
+            except git.GitCommandError as e:
+                self.logger.warning(f"Pruning worktrees of {repo_url} failed: {e}")
+            with self._lock:
+                self.active -= 1
+
+# Shared clone manager, workspaces, classifier and snapshot store used by the repository analysis apps
+clone_manager = CloneManager(
+    os.environ.get("REPO_MIRROR_DIR", "./repo_mirrors"),
+    depth=int(os.environ.get("REPO_CLONE_DEPTH", "1")),
+    blobless=os.environ.get("REPO_CLONE_BLOBLESS", "false").lower() == "true"
+)
+workspace_manager = WorkspaceManager(
+    os.environ.get("REPO_WORKSPACE_DIR", "./repo_cache"),
+    clone_manager,
+    max_concurrent_clones=int(os.environ.get("REPO_MAX_CONCURRENT_CLONES", "2"))
+)
+_classification_cache_path = os.environ.get("REPO_CLASSIFY_CACHE_PATH", "./cache/classifications.sqlite")
+file_classifier = FileClassifier(
+    workers=int(os.environ.get("REPO_CLASSIFY_WORKERS", str(min(8, os.cpu_count() or 1)))),
+    cache=ClassificationCache(_classification_cache_path) if _classification_cache_path else None
+)
+lazy_imports.register_warm_up(file_classifier.warm_up)
+snapshot_store = SnapshotStore(
+    os.environ.get("REPO_SNAPSHOT_DIR", "./snapshots"),
+    quota_bytes=int(os.environ.get("REPO_SNAPSHOT_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+)
+
+def _incremental_base(stack: ExitStack, repo_url: str, include: Optional[List[str]],
+                      commit_sha: str) -> Optional[Snapshot]:
+    """The latest snapshot of repo_url, held on `stack`, if the next commit can be extracted on top of it."""
+    base_id = snapshot_store.latest(repo_url, include)
+    if not base_id:
+        return None
+    base = stack.enter_context(snapshot_store.use(base_id))
+    # A truncated base made budget decisions we cannot replay; a base without SHAs cannot be compared
+    if base is None or base.commit_sha == commit_sha or base.truncated or not base.blob_shas:
+        return None
+    return base
+
+def _changes_base(stack: ExitStack, snapshot: Snapshot) -> Optional[Snapshot]:
+    """The base snapshot of an incremental extraction, held on `stack`, if it still exists."""
+    if not snapshot.changes:
+        return None
+    return stack.enter_context(snapshot_store.use(snapshot.changes["base_snapshot_id"]))
+
+@contextmanager
+def ingest_repository(repo_url: str,
+                      progress: Optional[Callable[..., None]] = None,
+                      include: Optional[List[str]] = None) -> Iterator[Tuple[Snapshot, bool]]:
+    """
+    Snapshot the current HEAD of repo_url, reusing an existing snapshot if possible.
+
+    The snapshot is referenced for the duration of the block. The commit is
+    read straight from the mirror's object database (extract_tree) unless
+    REPO_INGEST_CHECKOUT is set or the mirror is blobless, in which case a
+    worktree is checked out and walked instead. When reading from the object
+    database and an earlier commit of the repository has a complete snapshot,
+    only the files that changed since then are read and classified.
+
+    Unless REPO_EMBEDDER is empty, the snapshot's embedding index for
+    retrieval is built too if it does not exist yet.
+
+    Args:
+        repo_url: Repository to ingest
+        progress: Optional callback taking keyword fields (stage, files_scanned,
+            bytes_read, files_classified, chunks_embedded), e.g. Job.update; it may raise to abort
+        include: Optional glob patterns (see glob_filter) restricting which paths are extracted
+
+    Yields:
+        (snapshot, reused) where reused is True if no checkout was needed
+    """
+    report = progress or (lambda **fields: None)
+    path_filter = glob_filter(include)
+    include = sorted(p.strip() for p in include or [] if p.strip()) or None
+
+    def report_extraction(stats: ExtractStats):
+        report(stage="extracting", files_scanned=len(stats.code_index), bytes_read=stats.byte_count,
+               files_classified=stats.classification.files)
+
+    # Skip the clone entirely if this commit has already been extracted
+    report(stage="resolving")
+    head = remote_head(repo_url)
+    if head:
+        with snapshot_store.use(SnapshotStore.make_id(repo_url, head, include)) as snapshot:
+            if snapshot is not None:
+                if EMBEDDER:
+                    ensure_index(snapshot, progress=report)
+                yield snapshot, True
+                return
+
+    report(stage="cloning")
+    with ExitStack() as stack:
+        with ExitStack() as source:
+            if INGEST_FROM_CHECKOUT or clone_manager.blobless:
+                # Blobless mirrors would fetch blobs one request at a time; a checkout fetches them in one go
+                workspace = source.enter_context(workspace_manager.checkout(repo_url))
+                commit_sha = workspace.commit_sha
+
+                def extract(out: TextIO) -> ExtractStats:
+                    return extract_code(workspace.path, out, progress=report_extraction, path_filter=path_filter)
+            else:
+                repo, commit_sha = workspace_manager.mirror(repo_url)
+                # Stops the repo's persistent cat-file processes
+                source.callback(repo.close)
+                base = _incremental_base(source, repo_url, include, commit_sha)
+                if base is not None:
+                    report(base_commit=base.commit_sha)
+
+                def extract(out: TextIO) -> ExtractStats:
+                    return extract_tree(repo, commit_sha, out, progress=report_extraction,
+                                        path_filter=path_filter, base=base)
+
+            # Reference the snapshot before it exists so collection cannot race us
+            stack.enter_context(snapshot_store.hold(SnapshotStore.make_id(repo_url, commit_sha, include)))
+            report(stage="extracting", commit_sha=commit_sha)
+            with snapshot_store.writer(repo_url, commit_sha, include) as pending:
+                pending.stats = extract(pending.file)
+        if EMBEDDER:
+            ensure_index(pending.snapshot, progress=report, base=_changes_base(stack, pending.snapshot))
+        yield pending.snapshot, False
@@ -0,0 +1,416 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from typing import Optional, List, Dict, Any, Iterable, Tuple, Callable
+from utils.utils_lazy import lazy_import
+from utils.utils_packing import exclusion_reason, estimate_tokens, TOKEN_BUDGET, INDEX_SHARE
+
+# Loaded on first use, keeping it off the startup path of every blueprint
+np = lazy_import("numpy")
+
+# Embedder used for new indexes: "hashing" (local, deterministic), "gemini", or empty to skip indexing at ingestion
+EMBEDDER = os.environ.get("REPO_EMBEDDER", "hashing")
+# Target size of one chunk of a file, in characters
+CHUNK_CHARS = int(os.environ.get("REPO_CHUNK_CHARS", "1500"))
+# Chunks sent to the model in retrieval mode
+TOP_K = int(os.environ.get("REPO_RETRIEVAL_TOP_K", "20"))
+# Most chunks a request may ask for
+MAX_TOP_K = 200
+
+# Files written next to code.txt in the snapshot directory
+VECTORS_FILE = "embeddings.npy"
+CHUNKS_FILE = "embeddings.json"
+
+@dataclass
+class Chunk:
+    """A run of whole lines of one file; start and end are character offsets into the file text."""
+    path: str
+    start_line: int
+    end_line: int
+    start: int
+    end: int
+
+def chunk_text(path: str, text: str, max_chars: int = CHUNK_CHARS) -> List[Chunk]:
+    """Split one file into chunks of whole lines of at most max_chars (longer lines are cut)."""
+    chunks = []
+    start = offset = 0
+    start_line = line_number = 1
+    for line in text.splitlines(keepends=True):
+        if len(line) > max_chars or offset + len(line) - start > max_chars:
+            if offset > start:
+                chunks.append(Chunk(path, start_line, line_number - 1, start, offset))
+            start, start_line = offset, line_number
+        if len(line) > max_chars:
+            # A single huge line (minified code, data) is cut into chunks of its own
+            for cut in range(0, len(line), max_chars):
+                chunks.append(Chunk(path, line_number, line_number, offset + cut,
+                                    offset + min(cut + max_chars, len(line))))
+            start, start_line = offset + len(line), line_number + 1
+        offset += len(line)
+        line_number += 1
+    if offset > start:
+        chunks.append(Chunk(path, start_line, line_number - 1, start, offset))
+    return chunks
+
+def chunk_files(files: Iterable[Tuple[str, str]], max_chars: int = CHUNK_CHARS) -> Iterable[Tuple[Chunk, str]]:
+    """Yield (chunk, chunk text) for every file worth retrieving from (no lockfiles, vendored or generated code)."""
+    for path, text in files:
+        if exclusion_reason(path) or not text.strip():
+            continue
+        for chunk in chunk_text(path, text, max_chars):
+            yield chunk, text[chunk.start:chunk.end]
+
+class Embedder(ABC):
+    """
+    Turns texts into vectors. Subclasses set `name` (stored with each index,
+    so an index is only queried with the embedder that built it) and
+    implement `embed_documents`.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings of texts, one row per text."""
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+class HashingEmbedder(Embedder):
+    """
+    Local, deterministic bag-of-words embedder using the hashing trick.
+
+    Identifiers are also split into their camelCase / snake_case parts, so a
+    question about "clone manager" finds `CloneManager`. Needs no network or
+    model download, which makes it the default and suitable for offline tests.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+    PART_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            bucket = (digest % self.dimension, 1.0 if digest >> 63 else -1.0)
+            with self._lock:
+                self._buckets[token] = bucket
+        return bucket
+
+    def _tokens(self, text: str) -> Iterable[str]:
+        for token in self.TOKEN_PATTERN.findall(text):
+            lowered = token.lower()
+            yield lowered
+            parts = self.PART_PATTERN.findall(token)
+            if len(parts) > 1:
+                for part in parts:
+                    yield part.lower()
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token, count in Counter(self._tokens(text)).items():
+                index, sign = self._bucket(token)
+                vectors[row, index] += sign * (1.0 + math.log(count))
+        return _normalize(vectors)
+
+class GeminiEmbedder(Embedder):
+    """Vertex AI text embeddings through the shared GeminiClient."""
+
+    def __init__(self, model: str = "text-embedding-005", batch_size: int = 32, client=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"gemini-{model}"
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from utils.utils_vertex import get_default_client
+            self._client = get_default_client()
+        return self._client
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.client.embed_content(texts[i:i + self.batch_size], self.model, task_type))
+        return _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+# Embedder factories by name; register more with register_embedder
+EMBEDDERS: Dict[str, Callable[[], Embedder]] = {
+    "hashing": HashingEmbedder,
+    "gemini": GeminiEmbedder
+}
+_embedders: Dict[str, Embedder] = {}
+_embedders_lock = threading.Lock()
+
+def register_embedder(name: str, factory: Callable[[], Embedder]):
+    """Make an embedder available to get_embedder and the REPO_EMBEDDER setting."""
+    with _embedders_lock:
+        EMBEDDERS[name] = factory
+        _embedders.pop(name, None)
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    """Return the shared embedder registered under name (default: REPO_EMBEDDER, else hashing)."""
+    name = name or EMBEDDER or "hashing"
+    with _embedders_lock:
+        if name not in _embedders:
+            if name not in EMBEDDERS:
+                raise ValueError(f"Unknown embedder '{name}'")
+            _embedders[name] = EMBEDDERS[name]()
+        return _embedders[name]
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class EmbeddingIndex:
+    """Chunk metadata plus a matrix of unit-length chunk embeddings searched by cosine similarity."""
+
+    def __init__(self, embedder_name: str, chunks: List[Chunk], vectors: np.ndarray):
+        self.embedder_name = embedder_name
+        self.chunks = chunks
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, files: Iterable[Tuple[str, str]], embedder: Embedder,
+              max_chars: int = CHUNK_CHARS, batch_size: int = 256,
+              progress: Optional[Callable[[int], None]] = None) -> "EmbeddingIndex":
+        """Chunk and embed files; progress, if given, is called with the running chunk count."""
+        chunks: List[Chunk] = []
+        blocks: List[np.ndarray] = []
+        batch: List[str] = []
+
+        def flush():
+            if batch:
+                blocks.append(embedder.embed_documents(batch))
+                batch.clear()
+                if progress is not None:
+                    progress(len(chunks))
+
+        for chunk, text in chunk_files(files, max_chars):
+            chunks.append(chunk)
+            # The path is part of what a chunk is about
+            batch.append(f"{chunk.path}\n{text}")
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        vectors = np.concatenate(blocks) if blocks else np.zeros((0, 1), dtype=np.float32)
+        return cls(embedder.name, chunks, vectors.astype(np.float32))
+
+    def search(self, query: np.ndarray, k: int = TOP_K) -> List[Tuple[Chunk, float]]:
+        """The k chunks most similar to a unit-length query vector, best first."""
+        if not self.chunks:
+            return []
+        scores = self.vectors @ query.astype(np.float32)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[i], float(scores[i])) for i in top]
+
+    def save(self, directory: str):
+        """Write the index into a snapshot directory; the vectors are replaced before the metadata that names them."""
+        for name, write in ((VECTORS_FILE, lambda f: np.save(f, self.vectors)),
+                            (CHUNKS_FILE, lambda f: f.write(json.dumps({
+                                "embedder": self.embedder_name,
+                                "rows": len(self.chunks),
+                                "chunks": [list(asdict(chunk).values()) for chunk in self.chunks]
+                            }).encode("utf-8")))):
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{name}-", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmp_path, os.path.join(directory, name))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["EmbeddingIndex"]:
+        """Read an index from a snapshot directory, or None if it has none (or a torn one)."""
+        try:
+            with open(os.path.join(directory, CHUNKS_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if vectors.shape[0] != meta["rows"]:
+            return None
+        return cls(meta["embedder"], [Chunk(*entry) for entry in meta["chunks"]], vectors)
+
+_index_locks: Dict[str, threading.Lock] = {}
+_index_locks_guard = threading.Lock()
+
+def ensure_index(snapshot, embedder: Optional[Embedder] = None,
+                 progress: Optional[Callable[..., None]] = None,
+                 logger: Optional[logging.Logger] = None,
+                 base=None) -> EmbeddingIndex:
+    """
+    Return a snapshot's embedding index, building and persisting it first if
+    it is missing or was built with a different embedder.
+
+    When the snapshot was extracted incrementally and its `base` snapshot
+    has an index from the same embedder, the base's rows for unchanged files
+    are kept and only added and modified files are embedded.
+
+    Args:
+        snapshot: A utils_repo.Snapshot
+        embedder: Embedder to use (default: get_embedder())
+        progress: Optional callback taking keyword fields, e.g. Job.update
+        logger: Optional logger
+        base: Optional snapshot that `snapshot.changes` is relative to
+
+    Returns:
+        EmbeddingIndex: The snapshot's index
+    """
+    embedder = embedder or get_embedder()
+    logger = logger or logging.getLogger(__name__)
+    with _index_locks_guard:
+        lock = _index_locks.setdefault(snapshot.path, threading.Lock())
+    # One build per snapshot; concurrent callers wait for it
+    with lock:
+        index = EmbeddingIndex.load(snapshot.path)
+        if index is not None and index.embedder_name == embedder.name:
+            return index
+        report = progress or (lambda **fields: None)
+        report(stage="embedding", chunks_embedded=0)
+        base_index = _patchable_base(snapshot, base, embedder)
+        if base_index is not None:
+            changes = snapshot.changes
+            stale = set(changes["added"]) | set(changes["modified"]) | set(changes["deleted"])
+            included = snapshot.included_paths()
+            # Unchanged files that are still included keep their chunks and vectors
+            keep = [i for i, chunk in enumerate(base_index.chunks) if chunk.path not in stale and chunk.path in included]
+            fresh = EmbeddingIndex.build(snapshot.read_files(stale & included), embedder,
+                                         progress=lambda count: report(chunks_embedded=count))
+            vectors = np.asarray(base_index.vectors[keep], dtype=np.float32)
+            if len(fresh.chunks):
+                vectors = np.concatenate([vectors, fresh.vectors]) if keep else fresh.vectors
+            index = EmbeddingIndex(embedder.name, [base_index.chunks[i] for i in keep] + fresh.chunks, vectors)
+            logger.info(f"Patched embedding index of snapshot {snapshot.snapshot_id}: kept {len(keep)} chunks, "
+                        f"embedded {len(fresh.chunks)}")
+        else:
+            index = EmbeddingIndex.build(snapshot.iter_files(), embedder,
+                                         progress=lambda count: report(chunks_embedded=count))
+            logger.info(f"Embedded {len(index.chunks)} chunks of snapshot {snapshot.snapshot_id} with {embedder.name}")
+        index.save(snapshot.path)
+        return index
+
+def _patchable_base(snapshot, base, embedder: Embedder) -> Optional[EmbeddingIndex]:
+    """The base snapshot's index, if the snapshot's index can be patched from it."""
+    if base is None or not snapshot.changes or snapshot.changes["base_snapshot_id"] != base.snapshot_id:
+        return None
+    index = EmbeddingIndex.load(base.path)
+    if index is None or index.embedder_name != embedder.name:
+        return None
+    return index
+
+@dataclass
+class RetrievalResult:
+    """The chunks chosen for a question, formatted for a prompt."""
+    text: str
+    index: List[str]
+    top_k: int
+    tokens: int = 0
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+
+    def report(self) -> Dict[str, Any]:
+        """Summary for API responses."""
+        return {
+            "top_k": self.top_k,
+            "tokens": self.tokens,
+            "files": len({chunk["path"] for chunk in self.chunks}),
+            "chunks": self.chunks
+        }
+
+def retrieve(snapshot, question: str, top_k: int = TOP_K,
+             embedder: Optional[Embedder] = None) -> RetrievalResult:
+    """
+    Find the chunks of a snapshot most relevant to a question.
+
+    Chosen chunks are emitted in file and line order, as
+    `----- File: <path> (lines a-b) -----` blocks. The full file index is
+    included when it needs at most INDEX_SHARE of TOKEN_BUDGET, otherwise
+    only the files the chunks came from are listed.
+    """
+    embedder = embedder or get_embedder()
+    index = ensure_index(snapshot, embedder)
+    hits = index.search(embedder.embed_query(question), top_k)
+
+    texts = dict(snapshot.read_files({chunk.path for chunk, _ in hits}))
+    blocks, chunks = [], []
+    for chunk, score in sorted(hits, key=lambda hit: (hit[0].path, hit[0].start)):
+        text = texts.get(chunk.path, "")[chunk.start:chunk.end]
+        blocks.append(f"----- File: {chunk.path} (lines {chunk.start_line}-{chunk.end_line}) -----\n"
+                      f"{text}\n-------------------------\n")
+        chunks.append({"path": chunk.path, "start_line": chunk.start_line,
+                       "end_line": chunk.end_line, "score": round(score, 4)})
+
+    code_index = snapshot.code_index
+    if estimate_tokens(str(code_index)) > TOKEN_BUDGET * INDEX_SHARE:
+        code_index = sorted(texts)
+    result = RetrievalResult(text="".join(blocks), index=code_index, top_k=top_k, chunks=chunks)
+    result.tokens = estimate_tokens(result.text) + estimate_tokens(str(result.index))
+    return result
+
+def get_retrieval_prompt(question: str, code_index: List[str], excerpts: str) -> str:
+    """Formats the prompt that answers a question from retrieved excerpts."""
+    return f"""
+    Task: {question}
+
+    Context:
+    - You are an expert code analyzer and technical writer.
+    - Here is an index of all the files in the codebase:
+      \n\n{code_index}\n\n
+    - Only the excerpts most relevant to the task are provided below, each labelled with its file and line range:
+      \n\n{excerpts}\n\n
+
+    Instructions:
+    1. Carefully analyze the provided excerpts.
+    2. Focus on addressing the specific task or question given.
+    3. If the excerpts are not enough to answer fully, say which files from the index would be needed.
+    4. Use markdown formatting to enhance readability.
+    5. If relevant, include code snippets from the excerpts, citing file and line numbers.
+
+    Response:
+    """
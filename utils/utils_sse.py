@@ -0,0 +1,62 @@
+"""
+ Copyright 2024 Google LLC
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+
+import json
+import logging
+from typing import Optional, Dict, Any, Iterable
+from flask import Response, request, stream_with_context
+from utils.utils_vertex import streamPrompt
+
+def wants_stream() -> bool:
+    """True if the client asked for a Server-Sent Events response."""
+    return 'text/event-stream' in request.headers.get('Accept', '') or request.args.get('stream') == '1'
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """Format a single Server-Sent Event with a JSON payload."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+def sse_response(events: Iterable[str]) -> Response:
+    """Wrap an iterable of formatted events in a streaming response."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop reverse proxies from buffering the stream
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def stream_prompt(prompt: str, model: str, meta: Optional[Dict[str, Any]] = None) -> Response:
+    """
+    Stream a prompt's response to the browser as Server-Sent Events.
+
+    Emits a `meta` event (the prompt plus any extra fields), one `chunk` event
+    per text chunk, then `done`, or `error` if generation fails.
+    """
+    def events():
+        yield sse_event({'prompt': prompt, **(meta or {})}, event='meta')
+        try:
+            for text in streamPrompt(prompt, model):
+                yield sse_event({'text': text}, event='chunk')
+        except Exception as e:
+            logging.error(f"Error in stream_prompt: {e}")
+            yield sse_event({'error': str(e)}, event='error')
+            return
+        yield sse_event({}, event='done')
+
+    return sse_response(events())
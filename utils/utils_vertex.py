@@ -14,16 +14,34 @@
  limitations under the License.
 """
 
+from __future__ import annotations
+
 import os
 import json
 import logging
+import hashlib
+import hmac
+import secrets
+import sqlite3
+import copy
+import contextvars
 import asyncio
-from typing import Optional, List, Union, Dict, Tuple, Any, Callable, Generator, Iterable
-from dataclasses import dataclass
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from google import genai
-from google.genai import types
+import threading
+import time
+import itertools
+import weakref
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from typing import Optional, List, Union, Dict, Tuple, Any, Callable, Iterator, AsyncIterator
+from dataclasses import dataclass, asdict
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
 import re
+from utils.utils_lazy import lazy_import
+
+# The genai SDK takes over half a second to import, so it is loaded on first use
+genai = lazy_import("google.genai")
+types = lazy_import("google.genai.types")
+genai_errors = lazy_import("google.genai.errors")
 
 @dataclass
 class TokenCount:
@@ -31,23 +49,904 @@ class TokenCount:
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    cached_tokens: int = 0
+
+    @classmethod
+    def from_usage(cls, usage) -> "TokenCount":
+        """Build a TokenCount from a response's usage_metadata (thinking tokens count as completion)."""
+        if usage is None:
+            return cls(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+        prompt_tokens = usage.prompt_token_count or 0
+        completion_tokens = (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)
+        return cls(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=usage.total_token_count or prompt_tokens + completion_tokens,
+            cached_tokens=usage.cached_content_token_count or 0
+        )
+
+    def update(self, other: "TokenCount"):
+        """Overwrite this count in place, e.g. as a stream reports its running usage."""
+        self.prompt_tokens = other.prompt_tokens
+        self.completion_tokens = other.completion_tokens
+        self.total_tokens = other.total_tokens
+        self.cached_tokens = other.cached_tokens
+
+# Labels attached to recorded usage; set per request (e.g. route and user) via set_usage_labels
+_usage_labels: contextvars.ContextVar = contextvars.ContextVar("gemini_usage_labels", default=None)
+
+def set_usage_labels(route: Optional[str] = None, user: Optional[str] = None):
+    """Label token usage recorded in the current context with a route and user."""
+    return _usage_labels.set({"route": route, "user": user})
+
+class UsageTracker:
+    """Aggregates token usage per (route, model, user) from response usage_metadata."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[Tuple[Optional[str], str, Optional[str]], Dict[str, int]] = {}
+        # Per-process key for pseudonymous user IDs; IPs and emails are too guessable to hash unkeyed
+        self._user_key = secrets.token_bytes(32)
+
+    def pseudonym(self, user: Optional[str]) -> Optional[str]:
+        """A stable, non-reversible stand-in for a user's email or IP address."""
+        if user is None:
+            return None
+        digest = hmac.new(self._user_key, user.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"user-{digest[:12]}"
+
+    def record(self, model: str, token_count: TokenCount):
+        """Add one upstream call's usage under the current context's labels."""
+        labels = _usage_labels.get() or {}
+        key = (labels.get("route"), model, labels.get("user"))
+        with self._lock:
+            totals = self._usage.get(key)
+            if totals is None:
+                totals = self._usage[key] = {
+                    "requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                    "cached_tokens": 0, "total_tokens": 0
+                }
+            totals["requests"] += 1
+            totals["prompt_tokens"] += token_count.prompt_tokens
+            totals["completion_tokens"] += token_count.completion_tokens
+            totals["cached_tokens"] += token_count.cached_tokens
+            totals["total_tokens"] += token_count.total_tokens
+
+    def snapshot(self, identify_users: bool = False) -> Dict[str, Any]:
+        """
+        Return per-(route, model, user) rows plus totals per route, model and user.
+
+        Users are reported as pseudonyms unless `identify_users` is set, which
+        callers should only do for administrators.
+        """
+        with self._lock:
+            rows = [{"route": route, "model": model,
+                     "user": user if identify_users else self.pseudonym(user), **totals}
+                    for (route, model, user), totals in self._usage.items()]
+
+        def rollup(field_name: str) -> Dict[str, Dict[str, int]]:
+            grouped: Dict[str, Dict[str, int]] = {}
+            for row in rows:
+                group = grouped.setdefault(str(row[field_name]), {})
+                for name in ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens"):
+                    group[name] = group.get(name, 0) + row[name]
+            return grouped
+
+        return {
+            "rows": rows,
+            "by_route": rollup("route"),
+            "by_model": rollup("model"),
+            "by_user": rollup("user")
+        }
+
+# Shared by every GeminiClient in the process
+usage_tracker = UsageTracker()
+
+@dataclass
+class _PooledClient:
+    """A pooled genai.Client together with its bookkeeping."""
+    client: Any
+    created_at: float
+    last_used: float
+    healthy: bool = True
+    loop_ref: Optional[weakref.ref] = None
+
+    def loop_alive(self) -> bool:
+        """False once the event loop an async client was bound to is gone or closed."""
+        if self.loop_ref is None:
+            return True
+        loop = self.loop_ref()
+        return loop is not None and not loop.is_closed()
+
+class ClientPool:
+    """
+    Process-wide, thread-safe pool of genai.Client instances keyed by (project, region).
+
+    A genai.Client owns its credentials and an HTTP session with keep-alive
+    connections, so reusing one per (project, region) avoids a new auth handshake
+    and TLS connection on every call. Clients idle for longer than `idle_timeout`
+    seconds are evicted, and clients flagged as unhealthy are rebuilt on next use.
+
+    The async transport of a client is tied to the event loop it first ran on, so
+    clients used through `client.aio` are pooled per event loop as well and dropped
+    once their loop is closed.
+    """
+
+    def __init__(self, idle_timeout: float = 600.0, logger: Optional[logging.Logger] = None):
+        self.idle_timeout = idle_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple, _PooledClient] = {}
+
+    def _create_client(self, project_id: str, region: str):
+        return genai.Client(
+            vertexai=True,
+            project=project_id,
+            location=region
+        )
+
+    def _close_client(self, entry: _PooledClient):
+        try:
+            close = getattr(entry.client, "close", None)
+            if close:
+                close()
+        except Exception as e:
+            self.logger.debug(f"Error closing pooled client: {str(e)}")
+
+    def _evict_idle(self, now: float):
+        """Drop idle clients and clients bound to a dead event loop. Caller holds the lock."""
+        expired = [key for key, entry in self._clients.items()
+                   if now - entry.last_used > self.idle_timeout or not entry.loop_alive()]
+        for key in expired:
+            self._close_client(self._clients.pop(key))
+
+    @staticmethod
+    def _key(project_id: str, region: str, loop: Optional[asyncio.AbstractEventLoop]) -> Tuple:
+        return (project_id, region) if loop is None else (project_id, region, id(loop))
+
+    def get(self, project_id: str, region: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Return a pooled client for (project_id, region), creating or rebuilding it if needed.
+
+        Args:
+            project_id: Google Cloud Project ID
+            region: Vertex AI location
+            loop: Event loop the client's async transport will run on, if used through `client.aio`
+
+        Returns:
+            genai.Client: A client bound to the given project and region
+        """
+        key = self._key(project_id, region, loop)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None and entry.healthy and entry.loop_alive():
+                entry.last_used = now
+                return entry.client
+
+        # Build outside the lock so a slow auth handshake doesn't block other regions
+        client = self._create_client(project_id, region)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None and entry.healthy and entry.loop_alive():
+                # Another thread won the race; keep its client and drop ours
+                self._close_client(_PooledClient(client=client, created_at=now, last_used=now))
+                entry.last_used = time.monotonic()
+                return entry.client
+            if entry is not None:
+                self._close_client(entry)
+            now = time.monotonic()
+            self._clients[key] = _PooledClient(
+                client=client,
+                created_at=now,
+                last_used=now,
+                loop_ref=weakref.ref(loop) if loop is not None else None
+            )
+            return client
+
+    def mark_unhealthy(self, project_id: str, region: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Flag the client for (project_id, region) so it is rebuilt on next use."""
+        with self._lock:
+            entry = self._clients.get(self._key(project_id, region, loop))
+            if entry is not None:
+                entry.healthy = False
+
+    def close_all(self):
+        """Close and drop every pooled client."""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for entry in entries:
+            self._close_client(entry)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return a snapshot of the pooled clients for diagnostics."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "project": key[0],
+                    "region": key[1],
+                    "async": entry.loop_ref is not None,
+                    "healthy": entry.healthy,
+                    "age_seconds": round(now - entry.created_at, 1),
+                    "idle_seconds": round(now - entry.last_used, 1)
+                }
+                for key, entry in self._clients.items()
+            ]
+
+# Shared by every GeminiClient in the process
+client_pool = ClientPool(idle_timeout=float(os.environ.get("GEMINI_CLIENT_IDLE_TIMEOUT", "600")))
+
+@dataclass
+class RegionStats:
+    """Rolling health statistics for a single region."""
+    latency_ewma: Optional[float] = None
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    throttles: int = 0
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    # While half-open, the time until which the one trial request handed out is awaited
+    probe_until: float = 0.0
+
+# Monotonic time by which the current call must finish; set per item by iter_generate_content
+_call_deadline: contextvars.ContextVar = contextvars.ContextVar("gemini_call_deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    """The caller's deadline passed before another attempt could be sent."""
+
+class RegionUnavailable(Exception):
+    """A half-open region's one trial request is already held by another caller."""
+
+def stop_at_deadline(retry_state) -> bool:
+    """Tenacity stop condition: give up if the next attempt would start after the call's deadline."""
+    deadline = _call_deadline.get()
+    return deadline is not None and time.monotonic() + (retry_state.upcoming_sleep or 0) >= deadline
+
+def is_region_failure(error: BaseException) -> bool:
+    """
+    Whether an error says something about the region rather than the request.
+
+    429s, 5xx responses and transport errors or timeouts count against a region
+    and are worth retrying elsewhere. Other API errors (400 INVALID_ARGUMENT,
+    403, 404, ...) and client-side validation errors would fail the same way in
+    every region, and once the caller's deadline has passed there is no point
+    in trying another region.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, genai_errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return not isinstance(error, (ValueError, TypeError))
+
+class RegionRouter:
+    """
+    Orders regions by health score and trips a circuit breaker on failing regions.
+
+    Each region keeps an exponentially weighted moving average of latency, error
+    rate and 429 rate. Lower scores are tried first; ties keep the configured
+    order. A region with `failure_threshold` consecutive failures is skipped for
+    `cooldown` seconds, then becomes half-open: the first caller to attempt it
+    (see begin_attempt) sends the one trial request, which closes the circuit
+    on success and reopens it on failure. Only errors for which
+    is_region_failure() holds count as failures.
+    """
+
+    def __init__(self,
+                 alpha: float = 0.2,
+                 failure_threshold: int = 3,
+                 cooldown: float = 30.0,
+                 default_latency: float = 2.0):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.default_latency = default_latency
+        self._lock = threading.Lock()
+        self._stats: Dict[str, RegionStats] = {}
+
+    def _get_stats(self, region: str) -> RegionStats:
+        """Return the stats for a region, creating them if needed. Caller holds the lock."""
+        stats = self._stats.get(region)
+        if stats is None:
+            stats = self._stats[region] = RegionStats()
+        return stats
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * current
+
+    def _score(self, stats: RegionStats) -> float:
+        latency = stats.latency_ewma if stats.latency_ewma is not None else self.default_latency
+        return latency * (1 + 4 * stats.error_rate + 8 * stats.throttle_rate)
+
+    def ordered_regions(self, regions: List[str]) -> List[str]:
+        """
+        Order regions from best to worst, skipping regions whose circuit is open
+        and half-open regions whose trial request is already in flight.
+
+        Listing a region claims nothing: callers try regions in order until one
+        works, so most listed regions are never attempted. The trial request
+        of a half-open region is claimed by begin_attempt. If no region is
+        available, all of them are returned in score order so the request
+        still gets a chance to succeed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(
+                enumerate(regions),
+                key=lambda item: (self._score(self._get_stats(item[1])), item[0])
+            )
+            available = []
+            for _, region in ranked:
+                stats = self._stats[region]
+                if stats.open_until > now:
+                    continue
+                if stats.consecutive_failures >= self.failure_threshold and stats.probe_until > now:
+                    continue
+                available.append(region)
+            if available:
+                return available
+            return [region for _, region in ranked]
+
+    def begin_attempt(self, region: str) -> bool:
+        """
+        Call just before sending a request to a region. Returns False if the
+        region is half-open and another caller holds its trial request;
+        otherwise claims the trial request of a half-open region (until the
+        outcome is recorded, or for `cooldown` seconds if it never is).
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = self._get_stats(region)
+            if stats.open_until > now or stats.consecutive_failures < self.failure_threshold:
+                return True
+            if stats.probe_until > now:
+                return False
+            stats.probe_until = now + self.cooldown
+            return True
+
+    def record_success(self, region: str, latency: Optional[float] = None):
+        """Record a successful call and its latency in seconds (None: not a generate call, latency not tracked)."""
+        with self._lock:
+            stats = self._get_stats(region)
+            stats.requests += 1
+            stats.probe_until = 0.0
+            if latency is not None:
+                stats.latency_ewma = self._ewma(stats.latency_ewma, latency)
+            stats.error_rate = self._ewma(stats.error_rate, 0.0)
+            stats.throttle_rate = self._ewma(stats.throttle_rate, 0.0)
+            stats.consecutive_failures = 0
+            stats.open_until = 0.0
+
+    def record_failure(self, region: str, error: Exception, latency: Optional[float] = None):
+        """
+        Record a failed call, tripping the circuit breaker if the region keeps failing.
+
+        Errors caused by the request itself (see is_region_failure) are counted
+        as requests but leave the region's health untouched. Either way the
+        region's trial request, if this was it, is over.
+        """
+        throttled = isinstance(error, genai_errors.APIError) and error.code == 429
+        with self._lock:
+            stats = self._get_stats(region)
+            stats.requests += 1
+            stats.probe_until = 0.0
+            if not is_region_failure(error):
+                return
+            stats.failures += 1
+            stats.error_rate = self._ewma(stats.error_rate, 1.0)
+            stats.throttle_rate = self._ewma(stats.throttle_rate, 1.0 if throttled else 0.0)
+            if throttled:
+                stats.throttles += 1
+            if latency is not None:
+                stats.latency_ewma = self._ewma(stats.latency_ewma, latency)
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.failure_threshold:
+                stats.open_until = time.monotonic() + self.cooldown
+
+    def scores(self) -> Dict[str, Dict[str, Any]]:
+        """Return the current score and statistics for every region seen so far."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                region: {
+                    "score": round(self._score(stats), 3),
+                    "latency_ewma": round(stats.latency_ewma, 3) if stats.latency_ewma is not None else None,
+                    "error_rate": round(stats.error_rate, 3),
+                    "throttle_rate": round(stats.throttle_rate, 3),
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "throttles": stats.throttles,
+                    "circuit_open": stats.open_until > now,
+                    "half_open": stats.open_until <= now and stats.consecutive_failures >= self.failure_threshold,
+                    "cooldown_remaining": round(max(0.0, stats.open_until - now), 1)
+                }
+                for region, stats in self._stats.items()
+            }
+
+# Shared by every GeminiClient in the process so health is learned across requests
+region_router = RegionRouter(cooldown=float(os.environ.get("GEMINI_REGION_COOLDOWN", "30")))
+
+class HedgePolicy:
+    """
+    Decides when to hedge a request to a second region and keeps hedge counters.
+
+    The hedge delay is the `percentile` of recently observed latencies for the
+    model, so only the slow tail gets hedged. Hedges are paid for from a token
+    bucket that earns `max_hedge_ratio` tokens per request, capping the extra
+    cost at roughly that fraction of traffic.
+    """
+
+    def __init__(self,
+                 percentile: float = 0.95,
+                 max_hedge_ratio: float = 0.1,
+                 burst: float = 5.0,
+                 min_samples: int = 10,
+                 min_delay: float = 0.25,
+                 window: int = 200):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._tokens = burst
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_suppressed = 0
+
+    def observe(self, model: str, latency: float):
+        """Record the latency of a successful call for the given model."""
+        with self._lock:
+            samples = self._latencies.get(model)
+            if samples is None:
+                samples = self._latencies[model] = deque(maxlen=self.window)
+            samples.append(latency)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Return how long to wait before hedging, or None if there is not enough data yet."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return max(self.min_delay, samples[index])
+
+    def record_request(self):
+        """Count a hedge-eligible request and earn hedge budget for it."""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.max_hedge_ratio)
+
+    def try_acquire(self) -> bool:
+        """Spend one hedge from the budget, returning False if it is exhausted."""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedges_fired += 1
+                return True
+            self.hedges_suppressed += 1
+            return False
+
+    def record_win(self):
+        """Count a hedge that answered before the primary request."""
+        with self._lock:
+            self.hedges_won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hedge counters for diagnostics."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "hedges_suppressed": self.hedges_suppressed,
+                "hedge_rate": round(self.hedges_fired / self.requests, 3) if self.requests else 0.0,
+                "hedge_win_rate": round(self.hedges_won / self.hedges_fired, 3) if self.hedges_fired else 0.0
+            }
+
+# Shared hedge policy and the worker threads that run hedged requests
+hedge_policy = HedgePolicy(
+    percentile=float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "0.95")),
+    max_hedge_ratio=float(os.environ.get("GEMINI_HEDGE_MAX_RATIO", "0.1"))
+)
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("GEMINI_HEDGE_WORKERS", "32")),
+    thread_name_prefix="gemini-hedge"
+)
+
+class ResponseCache:
+    """
+    Content-addressed cache of generate_content results.
+
+    Keys are a SHA-256 of (model, contents, generation config, schema, return_json).
+    Entries live in an in-memory LRU tier and, when `path` is set, in a SQLite
+    tier that survives restarts. Both tiers expire entries after `ttl` seconds;
+    the disk tier also evicts least recently used entries beyond `max_disk_bytes`.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_memory_entries: int = 256,
+                 ttl: float = 24 * 3600,
+                 max_disk_bytes: int = 256 * 1024 * 1024,
+                 logger: Optional[logging.Logger] = None):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # Values are kept JSON-encoded, like on disk, so every hit is an independent copy
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str,
+                 contents: List[types.Content],
+                 gen_config: types.GenerateContentConfig,
+                 return_json: bool) -> str:
+        """Hash everything that determines the response; transport options are ignored."""
+        payload = {
+            "model": model,
+            "contents": [c.model_dump(mode="json", exclude_none=True) if hasattr(c, "model_dump") else c
+                         for c in contents],
+            "config": gen_config.model_dump(mode="json", exclude_none=True, exclude={"http_options"}),
+            "return_json": return_json
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return (hit, value) for a key, promoting disk hits into memory."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    # Decode on every hit so callers never share (and mutate) the cached value
+                    return True, json.loads(value)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return True, json.loads(row[0])
+
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value in both tiers."""
+        now = time.time()
+        expires_at = now + self.ttl
+        encoded = json.dumps(value)
+        with self._lock:
+            self._remember(key, expires_at, encoded)
+            self.stores += 1
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, encoded, len(encoded), expires_at, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Response cache write failed: {str(e)}")
+
+    def _remember(self, key: str, expires_at: float, encoded: str):
+        """Insert a JSON-encoded value into the memory tier, evicting the least recently used entry. Caller holds the lock."""
+        self._memory[key] = (expires_at, encoded)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        """Drop expired rows, then the least recently used rows over the size budget. Caller holds the lock."""
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for diagnostics."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory)
+            }
+
+def _default_response_cache() -> Optional[ResponseCache]:
+    """Build the process-wide response cache from the environment, if enabled."""
+    if os.environ.get("GEMINI_RESPONSE_CACHE", "false").lower() != "true":
+        return None
+    return ResponseCache(
+        path=os.environ.get("GEMINI_RESPONSE_CACHE_PATH", "./cache/gemini_responses.sqlite") or None,
+        ttl=float(os.environ.get("GEMINI_RESPONSE_CACHE_TTL", str(24 * 3600))),
+        max_disk_bytes=int(os.environ.get("GEMINI_RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    )
+
+response_cache = _default_response_cache()
+
+@dataclass
+class _Flight:
+    """An in-flight call that identical concurrent calls wait on."""
+    done: threading.Event
+    result: Any = None
+    error: Optional[BaseException] = None
+
+class _StreamBroadcast:
+    """
+    Fans a single response stream out to any number of subscribers.
+
+    Chunks are buffered so late subscribers replay from the start. Whichever
+    subscriber runs past the buffer pulls the next chunk from the source.
+    """
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.started = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.source: Optional[Iterator] = None
+        self._chunks: List[Any] = []
+        self._done = False
+        self._state_lock = threading.Lock()
+        self._pull_lock = threading.Lock()
+        self._on_done: Optional[Callable[[], None]] = None
+
+    def start(self, source: Iterator, on_done: Callable[[], None]):
+        self.source = source
+        self._on_done = on_done
+        self.started.set()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._done = True
+        self.started.set()
+
+    def _chunk_at(self, index: int) -> Tuple[bool, Any]:
+        """Return (has_chunk, chunk) for a position, pulling from the source when needed."""
+        with self._state_lock:
+            if index < len(self._chunks):
+                return True, self._chunks[index]
+        with self._pull_lock:
+            with self._state_lock:
+                if index < len(self._chunks):
+                    return True, self._chunks[index]
+                if self.error is not None:
+                    raise self.error
+                if self._done:
+                    return False, None
+            try:
+                chunk = next(self.source)
+            except StopIteration:
+                self._finish()
+                return False, None
+            except Exception as e:
+                self.error = e
+                self._finish()
+                raise
+            with self._state_lock:
+                self._chunks.append(chunk)
+            return True, chunk
+
+    def _finish(self):
+        self._done = True
+        if self._on_done:
+            self._on_done()
+
+    def subscribe(self) -> Iterator:
+        """Return an iterator over every chunk of the stream, starting from the first."""
+        index = 0
+        while True:
+            has_chunk, chunk = self._chunk_at(index)
+            if not has_chunk:
+                return
+            index += 1
+            yield chunk
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests into a single upstream call.
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait for and share its result (or exception). Streams are fanned
+    out to every waiter. Streams older than `max_stream_join_age` seconds are
+    not joined so an abandoned stream is never handed to new callers.
+    """
+
+    def __init__(self, max_stream_join_age: float = 120.0):
+        self.max_stream_join_age = max_stream_join_age
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._async_calls: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers with the same key."""
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight(done=threading.Event())
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            # Each waiter gets its own copy so callers can't mutate each other's result
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fn()
+            # The leader gets a copy too, so mutating it cannot leak into waiters still copying
+            return copy.deepcopy(flight.result)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            flight.done.set()
+
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Async counterpart of do; coalesces callers on the same event loop."""
+        loop = asyncio.get_running_loop()
+        flight_key = (key, id(loop))
+        with self._lock:
+            future = self._async_calls.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._async_calls[flight_key] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return copy.deepcopy(await asyncio.shield(future))
+
+        try:
+            result = await fn()
+            future.set_result(result)
+            return copy.deepcopy(result)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody else awaited isn't logged
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(flight_key, None)
+
+    def stream(self, key: str, fn: Callable[[], Iterator]) -> Iterator:
+        """Start (or join) a stream for key and return an iterator over all of its chunks."""
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None or time.monotonic() - broadcast.created_at > self.max_stream_join_age
+            if leader:
+                broadcast = self._streams[key] = _StreamBroadcast()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        def release():
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+
+        if leader:
+            try:
+                broadcast.start(fn(), on_done=release)
+            except BaseException as e:
+                broadcast.fail(e)
+                release()
+                raise
+        else:
+            broadcast.started.wait()
+            if broadcast.source is None:
+                # The leader failed before the stream started
+                raise broadcast.error
+        return broadcast.subscribe()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters for diagnostics."""
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls) + len(self._streams)
+            }
+
+# Shared so identical requests from different routes and threads are coalesced
+single_flight = SingleFlight()
 
 class GeminiClient:
     """A client for interacting with Gemini API with region fallback capabilities."""
     
-    def __init__(self, project_id: Optional[str] = None, logger: Optional[logging.Logger] = None):
+    def __init__(self, project_id: Optional[str] = None, logger: Optional[logging.Logger] = None,
+                 pool: Optional[ClientPool] = None, router: Optional[RegionRouter] = None,
+                 hedging: Optional[HedgePolicy] = None, cache: Optional[ResponseCache] = None,
+                 flights: Optional[SingleFlight] = None):
         """
         Initialize the GeminiClient.
         
         Args:
             project_id (str, optional): Google Cloud Project ID. If None, will try to get from environment.
             logger (logging.Logger, optional): Custom logger instance. If None, will create a new one.
+            pool (ClientPool, optional): Client pool to draw genai.Client instances from. Defaults to the process-wide pool.
+            router (RegionRouter, optional): Router used to order regions by health. Defaults to the process-wide router.
+            hedging (HedgePolicy, optional): Policy for hedged requests. Defaults to the process-wide policy.
+            cache (ResponseCache, optional): Response cache. Defaults to the process-wide cache, if enabled.
+            flights (SingleFlight, optional): Coalescer for identical in-flight requests. Defaults to the process-wide one.
         """
         self.project_id = project_id or os.environ.get("GCP_PROJECT")
         if not self.project_id:
             raise ValueError("Project ID must be provided or set in GCP_PROJECT environment variable")
             
         self.logger = logger or logging.getLogger(__name__)
+        self.pool = pool or client_pool
+        self.router = router or region_router
+        self.hedging = hedging or hedge_policy
+        self.cache = cache or response_cache
+        self.flights = flights or single_flight
         
         # Default model for token counting
         self.default_model = "gemini-2.0-flash-001"
@@ -61,6 +960,9 @@ class GeminiClient:
             "australia-southeast1",
             "asia-south1"
         ]
+
+        # Context caches are regional; create, list and manage them in one region
+        self.cache_region = os.environ.get("GEMINI_CACHE_REGION", self.regions[0])
         
         # Default safety settings
         self.safety_settings = [
@@ -92,12 +994,34 @@ class GeminiClient:
         )
 
     def _initialize_client(self, region: str):
-        """Initialize Gemini client with the specified region."""
-        return genai.Client(
-            vertexai=True,
-            project=self.project_id,
-            location=region
-        )
+        """Get a pooled Gemini client for the specified region."""
+        return self.pool.get(self.project_id, region)
+
+    def get_region_scores(self) -> Dict[str, Dict[str, Any]]:
+        """Return the router's current per-region health scores."""
+        return self.router.scores()
+
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Return response cache hit/miss counters, or None if caching is disabled."""
+        return self.cache.stats() if self.cache else None
+
+    def get_single_flight_stats(self) -> Dict[str, Any]:
+        """Return counters describing how many requests were coalesced."""
+        return self.flights.stats()
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """Return counters describing how often hedged requests fired and won."""
+        return self.hedging.stats()
+
+    def _initialize_async_client(self, region: str):
+        """Get a pooled Gemini client whose async transport runs on the current event loop."""
+        return self.pool.get(self.project_id, region, loop=asyncio.get_running_loop())
+
+    def _handle_region_error(self, region: str, error: Exception,
+                             loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Flag the pooled client for rebuild unless the API itself answered with an error."""
+        if not isinstance(error, genai_errors.APIError):
+            self.pool.mark_unhealthy(self.project_id, region, loop=loop)
 
     def count_tokens(self, contents: List[types.Content], model: Optional[str] = None) -> TokenCount:
         """
@@ -115,7 +1039,9 @@ class GeminiClient:
         """
         try:
             # Use the first available region to count tokens
-            for region in self.regions:
+            for region in self.router.ordered_regions(self.regions):
+                if not self.router.begin_attempt(region):
+                    continue
                 try:
                     client = self._initialize_client(region)
                     
@@ -124,6 +1050,7 @@ class GeminiClient:
                         model=model or self.default_model,
                         contents=contents
                     )
+                    self.router.record_success(region)
                     
                     # Convert to our TokenCount format
                     return TokenCount(
@@ -133,6 +1060,10 @@ class GeminiClient:
                     )
                 except Exception as e:
                     self.logger.warning(f"Token counting failed in region {region}: {str(e)}")
+                    self.router.record_failure(region, e)
+                    if not is_region_failure(e):
+                        raise
+                    self._handle_region_error(region, e)
                     continue
                 
             # If we got here, all regions failed
@@ -141,6 +1072,143 @@ class GeminiClient:
             self.logger.error(f"Token counting failed: {str(e)}")
             raise
 
+    def embed_content(self, texts: List[str], model: str = "text-embedding-005",
+                      task_type: Optional[str] = None) -> List[List[float]]:
+        """
+        Compute text embeddings, falling back across regions like count_tokens.
+
+        Args:
+            texts: Texts to embed in one request (keep within the model's per-request limits)
+            model: Embedding model name
+            task_type: Optional task type, e.g. RETRIEVAL_DOCUMENT or RETRIEVAL_QUERY
+
+        Returns:
+            List of embedding vectors in input order
+
+        Raises:
+            ValueError: If embedding fails in all regions
+        """
+        config = types.EmbedContentConfig(task_type=task_type) if task_type else None
+        for region in self.router.ordered_regions(self.regions):
+            if not self.router.begin_attempt(region):
+                continue
+            try:
+                client = self._initialize_client(region)
+                response = client.models.embed_content(model=model, contents=texts, config=config)
+                self.router.record_success(region)
+                return [embedding.values for embedding in response.embeddings]
+            except Exception as e:
+                self.logger.warning(f"Embedding failed in region {region}: {str(e)}")
+                self.router.record_failure(region, e)
+                if not is_region_failure(e):
+                    raise
+                self._handle_region_error(region, e)
+        raise ValueError("Embedding failed in all regions")
+
+    async def count_tokens_async(self, contents: List[types.Content], model: Optional[str] = None) -> TokenCount:
+        """
+        Asynchronous version of count_tokens using the SDK's native async client.
+        
+        Args:
+            contents: List of Content objects to count tokens for
+            model: Optional model name to use for counting tokens (defaults to self.default_model)
+            
+        Returns:
+            TokenCount: Object containing token count information
+        """
+        loop = asyncio.get_running_loop()
+        for region in self.router.ordered_regions(self.regions):
+            if not self.router.begin_attempt(region):
+                continue
+            try:
+                client = self._initialize_async_client(region)
+                response = await client.aio.models.count_tokens(
+                    model=model or self.default_model,
+                    contents=contents
+                )
+                self.router.record_success(region)
+                return TokenCount(
+                    prompt_tokens=response.total_tokens,
+                    completion_tokens=0,  # Will be updated after generation
+                    total_tokens=response.total_tokens
+                )
+            except Exception as e:
+                self.logger.warning(f"Token counting failed in region {region}: {str(e)}")
+                self.router.record_failure(region, e)
+                if not is_region_failure(e):
+                    raise
+                self._handle_region_error(region, e, loop=loop)
+                continue
+        
+        self.logger.error("Token counting failed: all regions failed")
+        raise ValueError("Token counting failed in all regions")
+
+    # Context caching
+    @staticmethod
+    def _cache_region_from_name(name: str) -> Optional[str]:
+        """Extract the location from a cached content name (projects/P/locations/L/cachedContents/ID)."""
+        match = re.search(r'/locations/([^/]+)/', name or '')
+        return match.group(1) if match else None
+
+    def _candidate_regions(self, gen_config: types.GenerateContentConfig) -> List[str]:
+        """Regions to try for a call; requests that reference a context cache must run in its region."""
+        if gen_config.cached_content:
+            return [self._cache_region_from_name(gen_config.cached_content) or self.cache_region]
+        return self.router.ordered_regions(self.regions)
+
+    def create_cache(self,
+                     contents: List[types.Content],
+                     model: str,
+                     ttl_seconds: int = 3600,
+                     display_name: Optional[str] = None,
+                     system_instruction: Optional[str] = None) -> types.CachedContent:
+        """
+        Create a Vertex AI context cache holding the given contents.
+        
+        Args:
+            contents: Content to cache (must meet the model's minimum cache size)
+            model: Model the cache will be used with
+            ttl_seconds: Time to live in seconds
+            display_name: Optional human-readable name
+            system_instruction: Optional system instruction stored with the cache
+            
+        Returns:
+            types.CachedContent: The created cache; pass its name as GenerateContentConfig.cached_content
+        """
+        client = self._initialize_client(self.cache_region)
+        return client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=contents,
+                system_instruction=system_instruction,
+                display_name=display_name,
+                ttl=f"{int(ttl_seconds)}s"
+            )
+        )
+
+    def list_caches(self) -> List[types.CachedContent]:
+        """List the context caches in the cache region."""
+        client = self._initialize_client(self.cache_region)
+        return list(client.caches.list())
+
+    def get_cache(self, name: str) -> types.CachedContent:
+        """Fetch a context cache by its full resource name; raises if it expired or was deleted."""
+        client = self._initialize_client(self._cache_region_from_name(name) or self.cache_region)
+        return client.caches.get(name=name)
+
+    def delete_cache(self, name: str):
+        """Delete a context cache by its full resource name."""
+        client = self._initialize_client(self._cache_region_from_name(name) or self.cache_region)
+        client.caches.delete(name=name)
+
+    def update_cache_ttl(self, name: str, ttl_seconds: int) -> types.CachedContent:
+        """Reset a context cache's expiry to ttl_seconds from now."""
+        client = self._initialize_client(self._cache_region_from_name(name) or self.cache_region)
+        return client.caches.update(
+            name=name,
+            config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_seconds)}s")
+        )
+
     def _parse_response(self, response) -> Dict:
         """Parse response into a structured dictionary."""
         if hasattr(response, 'text'):
@@ -313,7 +1381,250 @@ class GeminiClient:
             
         return [chunk.strip() for chunk in text.split(separator) if chunk.strip()]
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
+    def _begin_attempt(self, region: str):
+        """Claim a region for one attempt; raises RegionUnavailable if its half-open trial is taken."""
+        if not self.router.begin_attempt(region):
+            raise RegionUnavailable(f"Region {region} is half-open and its trial request is in flight")
+
+    @staticmethod
+    def _bound_by_deadline(gen_config: types.GenerateContentConfig) -> types.GenerateContentConfig:
+        """Cap the HTTP timeout of one attempt at the time left before the call's deadline, if it has one."""
+        deadline = _call_deadline.get()
+        if deadline is None:
+            return gen_config
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            raise DeadlineExceeded("Deadline passed before the request could be sent")
+        http_options = gen_config.http_options or types.HttpOptions()
+        if http_options.timeout is not None and http_options.timeout <= remaining_ms:
+            return gen_config
+        return gen_config.model_copy(update={"http_options": http_options.model_copy(update={"timeout": remaining_ms})})
+
+    def _generate_in_region(self, region: str, contents: List[types.Content],
+                            gen_config: types.GenerateContentConfig, model: str):
+        """Run one non-streaming generate call in a region, recording the outcome with the router."""
+        gen_config = self._bound_by_deadline(gen_config)
+        self._begin_attempt(region)
+        started = time.monotonic()
+        try:
+            client = self._initialize_client(region)
+            response = client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=gen_config
+            )
+        except Exception as e:
+            self.router.record_failure(region, e, time.monotonic() - started)
+            self._handle_region_error(region, e)
+            raise
+        elapsed = time.monotonic() - started
+        self.router.record_success(region, elapsed)
+        self.hedging.observe(model, elapsed)
+        usage_tracker.record(model, TokenCount.from_usage(response.usage_metadata))
+        return response
+
+    def _stream_in_region(self, region: str, contents: List[types.Content],
+                          gen_config: types.GenerateContentConfig, model: str):
+        """Start a streaming generate call in a region, recording time-to-first-chunk with the router."""
+        gen_config = self._bound_by_deadline(gen_config)
+        self._begin_attempt(region)
+        started = time.monotonic()
+        try:
+            client = self._initialize_client(region)
+            response = client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=gen_config
+            )
+            # Pull the first chunk here so a failing region falls back
+            # instead of raising once the caller starts iterating
+            first_chunk = next(response, None)
+        except Exception as e:
+            self.router.record_failure(region, e, time.monotonic() - started)
+            self._handle_region_error(region, e)
+            raise
+        self.router.record_success(region, time.monotonic() - started)
+        if first_chunk is None:
+            return iter(())
+        return itertools.chain([first_chunk], response)
+
+    def _generate_hedged(self, regions: List[str], contents: List[types.Content],
+                         gen_config: types.GenerateContentConfig, model: str):
+        """
+        Send the request to the primary region and, if it is slower than the hedge
+        delay, race it against the secondary region.
+
+        The first successful response wins. The losing call is cancelled if it has
+        not started; an in-flight HTTP call cannot be interrupted, so its result is
+        discarded (its latency still feeds the router).
+        """
+        primary_region, secondary_region = regions
+        self.hedging.record_request()
+        # Run in a copy of the caller's context so usage labels follow the request
+        primary = _hedge_executor.submit(contextvars.copy_context().run, self._generate_in_region,
+                                         primary_region, contents, gen_config, model)
+
+        delay = self.hedging.hedge_delay(model)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        except Exception as e:
+            # The primary failed before the hedge deadline; plain fallback
+            self.logger.warning(f"Error with region {primary_region}: {str(e)}")
+            if not is_region_failure(e):
+                raise
+            return self._generate_in_region(secondary_region, contents, gen_config, model)
+
+        if not self.hedging.try_acquire():
+            try:
+                return primary.result()
+            except Exception as e:
+                self.logger.warning(f"Error with region {primary_region}: {str(e)}")
+                if not is_region_failure(e):
+                    raise
+                return self._generate_in_region(secondary_region, contents, gen_config, model)
+
+        self.logger.info(f"Hedging request to {secondary_region} after {delay:.2f}s without answer from {primary_region}")
+        hedged = _hedge_executor.submit(contextvars.copy_context().run, self._generate_in_region,
+                                        secondary_region, contents, gen_config, model)
+        pending = {primary, hedged}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedged:
+                        self.hedging.record_win()
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def _prepare_config(self, generation_config: Optional[types.GenerateContentConfig],
+                        return_json: bool, json_schema: Optional[Dict]) -> types.GenerateContentConfig:
+        """Resolve the generation config for a call without mutating the caller's (or the default) config."""
+        gen_config = generation_config or self.default_generation_config
+        if return_json:
+            if not json_schema:
+                json_schema = {"type": "OBJECT", "properties": {"response": {"type": "STRING"}}}
+            gen_config = gen_config.model_copy(update={
+                "response_mime_type": "application/json",
+                "response_schema": json_schema
+            })
+        return gen_config
+
+    def _cache_key(self, cache: Optional[bool], stream: bool, model: str, contents: List[types.Content],
+                   gen_config: types.GenerateContentConfig, return_json: bool) -> Optional[str]:
+        """
+        Return the response cache key for a call, or None if it should bypass the cache.
+
+        With cache=None only deterministic configs (temperature 0) are cached;
+        cache=True opts sampled configs in and cache=False bypasses the cache.
+        """
+        if self.cache is None or stream or cache is False:
+            return None
+        if cache is None and gen_config.temperature != 0:
+            return None
+        return ResponseCache.make_key(model, contents, gen_config, return_json)
+
+    def _cache_lookup(self, key: Optional[str], count_tokens: bool) -> Tuple[bool, Any]:
+        """Return (hit, value) in generate_content's return shape."""
+        if key is None:
+            return False, None
+        hit, entry = self.cache.get(key)
+        if not hit or (count_tokens and entry.get("tokens") is None):
+            return False, None
+        if count_tokens:
+            return True, (entry["result"], TokenCount(**entry["tokens"]))
+        return True, entry["result"]
+
+    def _cache_store(self, key: Optional[str], value: Any, count_tokens: bool):
+        """Store a generate_content return value under key."""
+        if key is None:
+            return
+        result, token_count = value if count_tokens else (value, None)
+        self.cache.set(key, {"result": result, "tokens": asdict(token_count) if token_count else None})
+
+    def _build_result(self, response, return_json: bool, count_tokens: bool):
+        """Turn a raw generate response into the value returned by generate_content."""
+        # Parse JSON response if requested
+        if return_json:
+            result = self._parse_response(response)
+        else:
+            result = response.text
+            
+        if count_tokens:
+            return result, TokenCount.from_usage(response.usage_metadata)
+        return result
+
+    def _track_stream(self, stream: Iterator, model: str, token_count: TokenCount) -> Iterator:
+        """Pass chunks through, keeping token_count current and recording usage when the stream ends."""
+        try:
+            for chunk in stream:
+                if chunk.usage_metadata:
+                    token_count.update(TokenCount.from_usage(chunk.usage_metadata))
+                yield chunk
+        finally:
+            usage_tracker.record(model, token_count)
+
+    async def _track_stream_async(self, stream: AsyncIterator, model: str, token_count: TokenCount) -> AsyncIterator:
+        """Async counterpart of _track_stream."""
+        try:
+            async for chunk in stream:
+                if chunk.usage_metadata:
+                    token_count.update(TokenCount.from_usage(chunk.usage_metadata))
+                yield chunk
+        finally:
+            usage_tracker.record(model, token_count)
+
+    def _generate(self, contents: List[types.Content], stream: bool, gen_config: types.GenerateContentConfig,
+                  model: str, return_json: bool, count_tokens: bool, hedge: bool, cache_key: Optional[str]):
+        """Run a generate call across regions; the upstream half of generate_content."""
+        last_error = None
+        regions = self._candidate_regions(gen_config)
+
+        if hedge and not stream and len(regions) > 1:
+            try:
+                response = self._generate_hedged(regions[:2], contents, gen_config, model)
+                result = self._build_result(response, return_json, count_tokens)
+                self._cache_store(cache_key, result, count_tokens)
+                return result
+            except Exception as e:
+                self.logger.warning(f"Hedged request failed in regions {regions[:2]}: {str(e)}")
+                if not is_region_failure(e):
+                    raise
+                last_error = e
+                regions = regions[2:]
+
+        for region in regions:
+            try:
+                if stream:
+                    # Usage arrives with the stream's chunks; token_count fills in as it is consumed
+                    token_count = TokenCount(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+                    response = self._track_stream(
+                        self._stream_in_region(region, contents, gen_config, model), model, token_count
+                    )
+                    return (response, token_count) if count_tokens else response
+
+                response = self._generate_in_region(region, contents, gen_config, model)
+                result = self._build_result(response, return_json, count_tokens)
+                self._cache_store(cache_key, result, count_tokens)
+                return result
+                    
+            except Exception as e:
+                self.logger.warning(f"Error with region {region}: {str(e)}")
+                # The request itself is at fault; every other region would reject it too
+                if not is_region_failure(e):
+                    raise
+                last_error = e
+                continue
+        
+        raise Exception(f"All regions failed. Last error: {str(last_error)}") from last_error
+
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3) | stop_at_deadline,
+           retry=retry_if_exception(is_region_failure), reraise=True)
     def generate_content(self, 
                         contents: List[types.Content],
                         stream: bool = False,
@@ -321,7 +1632,10 @@ class GeminiClient:
                         model: str = "gemini-2.0-flash-exp",
                         return_json: bool = False,
                         json_schema: Optional[Dict] = None,
-                        count_tokens: bool = False) -> Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]:
+                        count_tokens: bool = False,
+                        hedge: bool = False,
+                        cache: Optional[bool] = None,
+                        coalesce: bool = True) -> Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]:
         """
         Generate content using Gemini model with region fallback.
         
@@ -332,7 +1646,12 @@ class GeminiClient:
             model: Model name to use
             return_json: Whether to return response as JSON using SDK's JSON capability
             json_schema: Optional JSON schema for structured responses
-            count_tokens: Whether to count tokens and return token usage
+            count_tokens: Whether to return token usage (from the response's usage_metadata, no extra call).
+                When streaming, the TokenCount fills in as the stream is consumed
+            hedge: Whether to hedge slow requests to the next-best region (ignored when streaming)
+            cache: Response cache policy: None caches deterministic (temperature 0) configs,
+                True also caches sampled configs, False bypasses the cache
+            coalesce: Whether identical concurrent calls share one upstream request
             
         Returns:
             Union[str, Dict]: Generated content as string or JSON if return_json=True
@@ -341,61 +1660,171 @@ class GeminiClient:
         Raises:
             Exception: If all regions fail
         """
+        gen_config = self._prepare_config(generation_config, return_json, json_schema)
+
+        cache_key = self._cache_key(cache, stream, model, contents, gen_config, return_json)
+        hit, cached = self._cache_lookup(cache_key, count_tokens)
+        if hit:
+            return cached
+
+        if not coalesce or (stream and count_tokens):
+            return self._generate(contents, stream, gen_config, model, return_json, count_tokens, hedge, cache_key)
+
+        request_key = cache_key or ResponseCache.make_key(model, contents, gen_config, return_json)
+        flight_key = f"{request_key}:{stream}:{count_tokens}"
+
+        def call():
+            return self._generate(contents, stream, gen_config, model, return_json, count_tokens, hedge, cache_key)
+
+        if stream:
+            return self.flights.stream(flight_key, call)
+        return self.flights.do(flight_key, call)
+    
+    async def _generate_in_region_async(self, region: str, contents: List[types.Content],
+                                        gen_config: types.GenerateContentConfig, model: str):
+        """Async counterpart of _generate_in_region using client.aio."""
+        loop = asyncio.get_running_loop()
+        self._begin_attempt(region)
+        started = time.monotonic()
+        try:
+            client = self._initialize_async_client(region)
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=gen_config
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.router.record_failure(region, e, time.monotonic() - started)
+            self._handle_region_error(region, e, loop=loop)
+            raise
+        elapsed = time.monotonic() - started
+        self.router.record_success(region, elapsed)
+        self.hedging.observe(model, elapsed)
+        usage_tracker.record(model, TokenCount.from_usage(response.usage_metadata))
+        return response
+
+    async def _stream_in_region_async(self, region: str, contents: List[types.Content],
+                                      gen_config: types.GenerateContentConfig, model: str) -> AsyncIterator:
+        """Async counterpart of _stream_in_region using client.aio."""
+        loop = asyncio.get_running_loop()
+        self._begin_attempt(region)
+        started = time.monotonic()
+        try:
+            client = self._initialize_async_client(region)
+            response = await client.aio.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=gen_config
+            )
+            # Pull the first chunk here so a failing region falls back
+            try:
+                first_chunk = await response.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+        except Exception as e:
+            self.router.record_failure(region, e, time.monotonic() - started)
+            self._handle_region_error(region, e, loop=loop)
+            raise
+        self.router.record_success(region, time.monotonic() - started)
+
+        async def chunks():
+            if first_chunk is None:
+                return
+            yield first_chunk
+            async for chunk in response:
+                yield chunk
+
+        return chunks()
+
+    async def _generate_hedged_async(self, regions: List[str], contents: List[types.Content],
+                                     gen_config: types.GenerateContentConfig, model: str):
+        """Async counterpart of _generate_hedged; the losing request is cancelled outright."""
+        primary_region, secondary_region = regions
+        self.hedging.record_request()
+        primary = asyncio.ensure_future(
+            self._generate_in_region_async(primary_region, contents, gen_config, model)
+        )
+
+        delay = self.hedging.hedge_delay(model)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if not done and not self.hedging.try_acquire():
+            await asyncio.wait({primary})
+            done = {primary}
+        if done:
+            if primary.exception() is None:
+                return primary.result()
+            self.logger.warning(f"Error with region {primary_region}: {str(primary.exception())}")
+            if not is_region_failure(primary.exception()):
+                raise primary.exception()
+            return await self._generate_in_region_async(secondary_region, contents, gen_config, model)
+
+        self.logger.info(f"Hedging request to {secondary_region} after {delay:.2f}s without answer from {primary_region}")
+        hedged = asyncio.ensure_future(
+            self._generate_in_region_async(secondary_region, contents, gen_config, model)
+        )
+        pending = {primary, hedged}
         last_error = None
-        gen_config = generation_config or self.default_generation_config
-        token_count = None
-        
-        if return_json:
-            if not json_schema:
-                json_schema = {"type": "OBJECT", "properties": {"response": {"type": "STRING"}}}
-            gen_config.response_mime_type = "application/json"
-            gen_config.response_schema = json_schema
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self.hedging.record_win()
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
 
-        if count_tokens:
-            token_count = self.count_tokens(contents, model=model)
+    async def _generate_async(self, contents: List[types.Content], stream: bool, gen_config: types.GenerateContentConfig,
+                              model: str, return_json: bool, count_tokens: bool, hedge: bool, cache_key: Optional[str]):
+        """Async counterpart of _generate."""
+        last_error = None
+        regions = self._candidate_regions(gen_config)
 
-        for region in self.regions:
+        if hedge and not stream and len(regions) > 1:
+            try:
+                response = await self._generate_hedged_async(regions[:2], contents, gen_config, model)
+                result = self._build_result(response, return_json, count_tokens)
+                self._cache_store(cache_key, result, count_tokens)
+                return result
+            except Exception as e:
+                self.logger.warning(f"Hedged request failed in regions {regions[:2]}: {str(e)}")
+                if not is_region_failure(e):
+                    raise
+                last_error = e
+                regions = regions[2:]
+
+        for region in regions:
             try:
-                client = self._initialize_client(region)
-                
                 if stream:
-                    response = client.models.generate_content_stream(
-                        model=model,
-                        contents=contents,
-                        config=gen_config
+                    token_count = TokenCount(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+                    response = self._track_stream_async(
+                        await self._stream_in_region_async(region, contents, gen_config, model), model, token_count
                     )
-                    if count_tokens:
-                        # Update token count with completion tokens
-                        token_count.completion_tokens = sum(len(chunk.text.split()) for chunk in response)
-                        token_count.total_tokens = token_count.prompt_tokens + token_count.completion_tokens
                     return (response, token_count) if count_tokens else response
-                else:
-                    response = client.models.generate_content(
-                        model=model,
-                        contents=contents,
-                        config=gen_config
-                    )
-                    
-                    if count_tokens:
-                        # Update token count with completion tokens
-                        token_count.completion_tokens = len(response.text.split())
-                        token_count.total_tokens = token_count.prompt_tokens + token_count.completion_tokens
-                    
-                    # Parse JSON response if requested
-                    if return_json:
-                        result = self._parse_response(response)
-                    else:
-                        result = response.text
-                        
-                    return (result, token_count) if count_tokens else result
-                    
+
+                response = await self._generate_in_region_async(region, contents, gen_config, model)
+                result = self._build_result(response, return_json, count_tokens)
+                self._cache_store(cache_key, result, count_tokens)
+                return result
+
             except Exception as e:
                 self.logger.warning(f"Error with region {region}: {str(e)}")
+                # The request itself is at fault; every other region would reject it too
+                if not is_region_failure(e):
+                    raise
                 last_error = e
                 continue
         
         raise Exception(f"All regions failed. Last error: {str(last_error)}") from last_error
-    
+
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3),
+           retry=retry_if_exception(is_region_failure), reraise=True)
     async def generate_content_async(self, 
                                contents: List[types.Content],
                                stream: bool = False,
@@ -403,18 +1832,29 @@ class GeminiClient:
                                model: str = "gemini-2.0-flash-exp",
                                return_json: bool = False,
                                json_schema: Optional[Dict] = None,
-                               count_tokens: bool = False) -> Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]:
+                               count_tokens: bool = False,
+                               hedge: bool = False,
+                               cache: Optional[bool] = None,
+                               coalesce: bool = True) -> Union[str, Dict, AsyncIterator, Tuple[Union[str, Dict], TokenCount]]:
         """
-        Asynchronous version of generate_content.
+        Asynchronous version of generate_content using the SDK's native async client.
+        
+        Region fallback, retries and hedging mirror generate_content, but calls are
+        awaited on the event loop instead of occupying a worker thread each.
         
         Args:
             contents: List of Content objects containing the prompt
-            stream: Whether to stream the response
+            stream: Whether to stream the response (returns an async iterator of chunks)
             generation_config: Optional custom generation config
             model: Model name to use
             return_json: Whether to return response as JSON using SDK's JSON capability
             json_schema: Optional JSON schema for structured responses
-            count_tokens: Whether to count tokens and return token usage
+            count_tokens: Whether to return token usage (from the response's usage_metadata, no extra call).
+                When streaming, the TokenCount fills in as the stream is consumed
+            hedge: Whether to hedge slow requests to the next-best region (ignored when streaming)
+            cache: Response cache policy: None caches deterministic (temperature 0) configs,
+                True also caches sampled configs, False bypasses the cache
+            coalesce: Whether identical concurrent calls share one upstream request
             
         Returns:
             Union[str, Dict]: Generated content as string or JSON if return_json=True
@@ -423,22 +1863,111 @@ class GeminiClient:
         Raises:
             Exception: If all regions fail
         """
-        # We need to run the synchronous method in a thread pool executor since the
-        # Google Vertex AI API doesn't have native async support yet
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None, 
-            lambda: self.generate_content(
+        gen_config = self._prepare_config(generation_config, return_json, json_schema)
+
+        cache_key = self._cache_key(cache, stream, model, contents, gen_config, return_json)
+        hit, cached = self._cache_lookup(cache_key, count_tokens)
+        if hit:
+            return cached
+
+        if not coalesce or stream:
+            return await self._generate_async(contents, stream, gen_config, model, return_json, count_tokens, hedge, cache_key)
+
+        request_key = cache_key or ResponseCache.make_key(model, contents, gen_config, return_json)
+        flight_key = f"{request_key}:{count_tokens}"
+        return await self.flights.do_async(
+            flight_key,
+            lambda: self._generate_async(contents, stream, gen_config, model, return_json, count_tokens, hedge, cache_key)
+        )
+    
+    def _batch_item(self,
+                    contents: List[types.Content],
+                    generation_config: Optional[types.GenerateContentConfig],
+                    model: str,
+                    return_json: bool,
+                    json_schema: Optional[Dict],
+                    count_tokens: bool) -> Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]:
+        """Generate a single batch item, capturing errors instead of raising."""
+        try:
+            return self.generate_content(
                 contents=contents,
-                stream=stream,
+                stream=False,  # Streaming not supported in batch mode
                 generation_config=generation_config,
                 model=model,
                 return_json=return_json,
                 json_schema=json_schema,
                 count_tokens=count_tokens
             )
-        )
-    
+        except Exception as e:
+            self.logger.error(f"Error processing batch item: {str(e)}")
+            return {"error": str(e)}
+
+    def iter_generate_content(self,
+                              contents_list: List[List[types.Content]],
+                              generation_config: Optional[types.GenerateContentConfig] = None,
+                              model: str = "gemini-2.0-flash-exp",
+                              return_json: bool = False,
+                              json_schema: Optional[Dict] = None,
+                              count_tokens: bool = False,
+                              max_concurrency: int = 5,
+                              timeout: Optional[float] = None) -> Iterator[Tuple[int, Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]]:
+        """
+        Process multiple prompts concurrently, yielding results as they complete.
+        
+        Args:
+            contents_list: List of prompt lists to process
+            generation_config: Optional custom generation config
+            model: Model name to use
+            return_json: Whether to return responses as JSON
+            json_schema: Optional JSON schema for structured responses
+            count_tokens: Whether to count tokens and return token usage
+            max_concurrency: Maximum number of concurrent requests
+            timeout: Optional per-item timeout in seconds, measured from when the item starts.
+                Each HTTP attempt of the item is capped at the time left, and no retry or
+                fallback region is tried once it has passed, so the worker thread of a
+                timed out item is freed at its deadline rather than after all retries.
+            
+        Yields:
+            Tuple of (input index, response) in completion order. Failed or timed out
+            items yield {"error": ...} as their response.
+        """
+        started: Dict[int, float] = {}
+
+        def run(index: int, contents: List[types.Content]):
+            started[index] = time.monotonic()
+            if timeout is not None:
+                # Runs in a copied context, so the deadline only applies to this item
+                _call_deadline.set(started[index] + timeout)
+            return self._batch_item(contents, generation_config, model, return_json, json_schema, count_tokens)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="gemini-batch")
+        try:
+            futures = {executor.submit(contextvars.copy_context().run, run, i, contents): i
+                       for i, contents in enumerate(contents_list)}
+            pending = set(futures)
+            while pending:
+                wait_for = None
+                if timeout is not None:
+                    now = time.monotonic()
+                    deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+                    wait_for = max(0.0, min(deadlines) - now) if deadlines else timeout
+
+                done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield futures[future], future.result()
+
+                if timeout is not None:
+                    now = time.monotonic()
+                    expired = {f for f in pending
+                               if futures[f] in started and now - started[futures[f]] >= timeout}
+                    for future in expired:
+                        future.cancel()
+                        self.logger.error(f"Batch item {futures[future]} timed out after {timeout}s")
+                        yield futures[future], {"error": f"Timed out after {timeout}s"}
+                    pending -= expired
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def batch_generate_content(self, 
                              contents_list: List[List[types.Content]],
                              generation_config: Optional[types.GenerateContentConfig] = None,
@@ -446,9 +1975,10 @@ class GeminiClient:
                              return_json: bool = False,
                              json_schema: Optional[Dict] = None,
                              count_tokens: bool = False,
-                             max_concurrency: int = 5) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
+                             max_concurrency: int = 5,
+                             timeout: Optional[float] = None) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
         """
-        Process multiple prompts in batch mode.
+        Process multiple prompts concurrently on a bounded thread pool.
         
         Args:
             contents_list: List of prompt lists to process
@@ -458,33 +1988,23 @@ class GeminiClient:
             json_schema: Optional JSON schema for structured responses
             count_tokens: Whether to count tokens and return token usage
             max_concurrency: Maximum number of concurrent requests
+            timeout: Optional per-item timeout in seconds
             
         Returns:
             List of responses in the same order as the input prompts
         """
-        results = []
-        
-        # Process in batches to limit concurrency
-        for i in range(0, len(contents_list), max_concurrency):
-            batch = contents_list[i:i+max_concurrency]
-            
-            # Process each prompt in the batch
-            for contents in batch:
-                try:
-                    result = self.generate_content(
-                        contents=contents,
-                        stream=False,  # Streaming not supported in batch mode
-                        generation_config=generation_config,
-                        model=model,
-                        return_json=return_json,
-                        json_schema=json_schema,
-                        count_tokens=count_tokens
-                    )
-                    results.append(result)
-                except Exception as e:
-                    self.logger.error(f"Error processing batch item: {str(e)}")
-                    # Append error information to maintain order
-                    results.append({"error": str(e)})
+        results: List[Any] = [None] * len(contents_list)
+        for index, result in self.iter_generate_content(
+            contents_list=contents_list,
+            generation_config=generation_config,
+            model=model,
+            return_json=return_json,
+            json_schema=json_schema,
+            count_tokens=count_tokens,
+            max_concurrency=max_concurrency,
+            timeout=timeout
+        ):
+            results[index] = result
         
         return results
     
@@ -495,7 +2015,8 @@ class GeminiClient:
                                     return_json: bool = False,
                                     json_schema: Optional[Dict] = None,
                                     count_tokens: bool = False,
-                                    max_concurrency: int = 5) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
+                                    max_concurrency: int = 5,
+                                    timings: Optional[List[Dict[str, float]]] = None) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
         """
         Process multiple prompts in batch mode asynchronously.
         
@@ -507,15 +2028,21 @@ class GeminiClient:
             json_schema: Optional JSON schema for structured responses
             count_tokens: Whether to count tokens and return token usage
             max_concurrency: Maximum number of concurrent requests
+            timings: Optional list that is filled, in input order, with each item's
+                `queued` and `seconds` (time spent waiting for a slot, then generating)
             
         Returns:
             List of responses in the same order as the input prompts
         """
         results = []
         semaphore = asyncio.Semaphore(max_concurrency)
+        if timings is not None:
+            timings[:] = [{"queued": 0.0, "seconds": 0.0} for _ in contents_list]
         
-        async def process_item(contents):
+        async def process_item(index, contents):
+            submitted = time.monotonic()
             async with semaphore:
+                started = time.monotonic()
                 try:
                     return await self.generate_content_async(
                         contents=contents,
@@ -529,9 +2056,12 @@ class GeminiClient:
                 except Exception as e:
                     self.logger.error(f"Error processing batch item: {str(e)}")
                     return {"error": str(e)}
+                finally:
+                    if timings is not None:
+                        timings[index] = {"queued": started - submitted, "seconds": time.monotonic() - started}
         
         # Create all tasks
-        tasks = [process_item(contents) for contents in contents_list]
+        tasks = [process_item(i, contents) for i, contents in enumerate(contents_list)]
         
         # Wait for all tasks to complete
         results = await asyncio.gather(*tasks)
@@ -547,7 +2077,8 @@ class GeminiClient:
                    return_json: bool = False,
                    json_schema: Optional[Dict] = None,
                    count_tokens: bool = False,
-                   max_concurrency: int = 5) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
+                   max_concurrency: int = 5,
+                   timeout: Optional[float] = None) -> List[Union[str, Dict, Tuple[Union[str, Dict], TokenCount]]]:
         """
         Map a template across a list of items, generating content for each.
         
@@ -561,6 +2092,7 @@ class GeminiClient:
             json_schema: Optional JSON schema for structured responses
             count_tokens: Whether to count tokens and return token usage
             max_concurrency: Maximum number of concurrent requests
+            timeout: Optional per-item timeout in seconds
             
         Returns:
             List of responses corresponding to each item
@@ -593,7 +2125,8 @@ class GeminiClient:
             return_json=return_json,
             json_schema=json_schema,
             count_tokens=count_tokens,
-            max_concurrency=max_concurrency
+            max_concurrency=max_concurrency,
+            timeout=timeout
         )
     
     async def map_generate_async(self, 
@@ -654,24 +2187,57 @@ class GeminiClient:
             max_concurrency=max_concurrency
         )
 
-def sendPrompt(prompt: str, model: str) -> str:
+_default_client: Optional[GeminiClient] = None
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> GeminiClient:
+    """Return the process-wide GeminiClient for the GCP_PROJECT environment variable."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = GeminiClient()
+    return _default_client
+
+def sendPrompt(prompt: str, model: str, hedge: Optional[bool] = None, cache: Optional[bool] = None) -> str:
     """
     A simple wrapper to send a prompt to the Gemini API and get a response.
+
+    Hedging defaults to the GEMINI_HEDGING environment variable so interactive
+    routes can opt in without code changes. `cache` is passed through to
+    generate_content's response cache policy.
     """
+    if hedge is None:
+        hedge = os.environ.get("GEMINI_HEDGING", "false").lower() == "true"
     try:
-        client = GeminiClient()
+        client = get_default_client()
         contents = [
             types.Content(
                 role="user",
                     parts=[types.Part(text=prompt)]
             )
         ]
-        response = client.generate_content(contents, model=model)
+        response = client.generate_content(contents, model=model, hedge=hedge, cache=cache)
         return response
     except Exception as e:
         logging.error(f"Error in sendPrompt: {e}")
         return f"An error occurred: {e}"
 
+def streamPrompt(prompt: str, model: str) -> Iterator[str]:
+    """
+    Stream the response to a prompt as text chunks. Errors are raised to the caller.
+    """
+    client = get_default_client()
+    contents = [
+        types.Content(
+            role="user",
+            parts=[types.Part(text=prompt)]
+        )
+    ]
+    for chunk in client.generate_content(contents, model=model, stream=True):
+        if chunk.text:
+            yield chunk.text
+
 def example_usage():
     """Example usage of the GeminiClient"""
     client = GeminiClient()